@@ -0,0 +1,567 @@
+#!/usr/bin/env python3
+"""
+Shopee API Proxy Server - asyncio engine
+Serves the same /api/item, /api/ratings and /api/search contract as server.py
+on aiohttp, so concurrent lookups share one event loop and a keep-alive
+client pool instead of holding one blocking thread each.
+
+Cache, rate limiters, projection and snapshot store are shared with server.py.
+
+Usage: python async_server.py [--host 127.0.0.1] [--port 8000]
+"""
+
+import argparse
+import asyncio
+import contextvars
+import json
+import time
+
+import aiohttp
+from aiohttp import web
+
+import server
+from server import (
+    BROWSER_HEADERS,
+    SHOPEE_BASE_URL,
+    SESSION_POOL_SIZE,
+    UPSTREAM_DEADLINE,
+    UPSTREAM_MAX_ATTEMPTS,
+    COMPRESS_MIN_BYTES,
+    backoff_delay,
+    body_etag,
+    choose_encoding,
+    compress_body,
+    fixture_recorder,
+    metrics,
+    rate_limiters,
+    response_cache,
+    snapshot_store,
+    upstream_validators,
+)
+
+# Keep-alive connections per pooled session
+ASYNC_CONNECTIONS_PER_SESSION = 32
+# Seconds an idle keep-alive connection is kept open
+ASYNC_KEEPALIVE = 30
+# Overall deadline for one client request (queueing, retries and upstream time)
+REQUEST_DEADLINE = UPSTREAM_DEADLINE
+
+# Seconds startup waits for the session pool; sessions still down keep initializing in the background
+STARTUP_INIT_TIMEOUT = 15
+
+# Per-request holder ([seconds]) for time spent queueing on rate limits (X-Queue-Wait-Ms).
+# Mutated in place so waits inside coalesced/background loader tasks (which run
+# on a copy of the context) still reach the request that started them.
+queue_wait = contextvars.ContextVar('queue_wait', default=None)
+
+class UpstreamError(Exception):
+    """Upstream failure carrying the HTTP status to return to the client."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+# ============================================================================
+# UPSTREAM CLIENT
+# ============================================================================
+
+class AsyncSession:
+    """One aiohttp client session with its own cookie jar and connection pool."""
+
+    def __init__(self, session_id):
+        self.id = session_id
+        self.http = None
+        self.state = 'new'   # new | ready | quarantined
+        self.in_flight = 0
+        self.requests = 0
+        self.blocks = 0
+        self.inits = 0
+        self.init_task = None
+
+    def open(self):
+        connector = aiohttp.TCPConnector(
+            limit=ASYNC_CONNECTIONS_PER_SESSION,
+            keepalive_timeout=ASYNC_KEEPALIVE,
+        )
+        self.http = aiohttp.ClientSession(
+            headers=BROWSER_HEADERS,
+            connector=connector,
+            cookie_jar=aiohttp.CookieJar(unsafe=True),
+        )
+
+    async def _init(self):
+        self.http.cookie_jar.clear()
+        delay = 1
+        while True:
+            try:
+                print(f'[Async] Initializing session {self.id} with Shopee...')
+                async with self.http.get(f'{SHOPEE_BASE_URL}/', timeout=aiohttp.ClientTimeout(total=10)) as response:
+                    await response.read()
+                    print(f'[Async] Session {self.id} init: {response.status}, cookies: {len(self.http.cookie_jar)}')
+                self.inits += 1
+                self.state = 'ready'
+                metrics.inc('shopee_session_inits_total', (('result', 'ok'),))
+                return
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                print(f'[Async] Session {self.id} init error: {e}')
+                metrics.inc('shopee_session_inits_total', (('result', 'error'),))
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 60)
+
+    def ensure_init(self):
+        """Start (or join) the homepage visit; concurrent callers share one task."""
+        if self.init_task is None or self.init_task.done():
+            self.init_task = asyncio.create_task(self._init())
+        return self.init_task
+
+    def snapshot(self):
+        return {
+            'id': self.id,
+            'state': self.state,
+            'in_flight': self.in_flight,
+            'cookies': len(self.http.cookie_jar) if self.http else 0,
+            'requests': self.requests,
+            'blocks': self.blocks,
+            'inits': self.inits,
+        }
+
+class AsyncUpstream:
+    """Pool of async Shopee sessions with rate limiting and jittered retries."""
+
+    def __init__(self, size):
+        self.sessions = [AsyncSession(i) for i in range(size)]
+
+    async def start(self):
+        """Open the sessions and wait (bounded) for their first homepage visit."""
+        for pooled in self.sessions:
+            pooled.open()
+        _, pending = await asyncio.wait(
+            [pooled.ensure_init() for pooled in self.sessions], timeout=STARTUP_INIT_TIMEOUT
+        )
+        if pending:
+            print(f'[Async] {len(pending)} session(s) not ready after {STARTUP_INIT_TIMEOUT}s; '
+                  'serving anyway, init continues in the background')
+
+    async def close(self):
+        await asyncio.gather(*(pooled.http.close() for pooled in self.sessions))
+
+    async def _checkout(self):
+        while True:
+            candidates = [s for s in self.sessions if s.state == 'ready']
+            if candidates:
+                return min(candidates, key=lambda s: s.in_flight)
+            # Every session is being refreshed; wait for the first one back
+            pending = [s.ensure_init() for s in self.sessions]
+            await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+
+    def _quarantine(self, pooled):
+        if pooled.state == 'ready':
+            pooled.state = 'quarantined'
+            print(f'[Async] Session {pooled.id} quarantined')
+            pooled.ensure_init()
+
+    async def get_json(self, label, url, headers, deadline):
+        """
+        GET a Shopee API URL with the same retry policy as server.fetch_upstream().
+        Returns (json_data, size_in_bytes); raises UpstreamError.
+        """
+        limiter = rate_limiters[label]
+        family = (('family', label),)
+        attempt = 0
+        request_headers = upstream_validators.conditional_headers(url, headers)
+        while True:
+            try:
+                wait = limiter.reserve(deadline)
+            except Exception as e:
+                raise UpstreamError(503, str(e))
+            if wait:
+                holder = queue_wait.get()
+                if holder is not None:
+                    holder[0] += wait
+                await asyncio.sleep(wait)
+
+            pooled = await self._checkout()
+            pooled.in_flight += 1
+            pooled.requests += 1
+            metrics.inc('shopee_upstream_in_flight', family)
+            status, error = None, None
+            started = time.time()
+            try:
+                timeout = aiohttp.ClientTimeout(total=max(1, min(15, deadline - time.time())))
+                async with pooled.http.get(url, headers=request_headers, timeout=timeout) as response:
+                    status = response.status
+                    response_headers = response.headers
+                    body = await response.read()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = e
+            finally:
+                pooled.in_flight -= 1
+                metrics.inc('shopee_upstream_in_flight', family, -1)
+            metrics.inc('shopee_upstream_requests_total', family + (('status', str(status or 'error')),))
+            if status is not None:
+                metrics.observe('shopee_upstream_latency_seconds', family, time.time() - started)
+                metrics.inc('shopee_upstream_bytes_total', family, len(body))
+
+            if status in (403, 429):
+                pooled.blocks += 1
+                limiter.on_block()
+                self._quarantine(pooled)
+            elif status == 304:
+                limiter.on_success()
+                cached = upstream_validators.revalidated(url)
+                if cached is not None:
+                    return cached
+                # Stored body was evicted meanwhile; refetch unconditionally
+                request_headers = headers
+                continue
+            elif status is not None and status < 500:
+                limiter.on_success()
+                if status >= 400:
+                    raise UpstreamError(status, f'HTTP {status}: upstream error for {url}')
+                try:
+                    data = json.loads(body)
+                except ValueError as e:
+                    raise UpstreamError(502, f'Invalid upstream JSON: {e}')
+                upstream_validators.remember(url, response_headers, data, len(body))
+                if fixture_recorder:
+                    fixture_recorder.save(url, status, body)
+                return data, len(body)
+
+            delay = backoff_delay(attempt)
+            attempt += 1
+            if attempt >= UPSTREAM_MAX_ATTEMPTS or time.time() + delay >= deadline:
+                if status is None:
+                    raise UpstreamError(500, str(error) or error.__class__.__name__)
+                raise UpstreamError(status, f'HTTP {status}: upstream error for {url}')
+            print(f'[Async] Got {status or error} on {label}, retry {attempt} in {delay:.2f}s...')
+            metrics.inc('shopee_upstream_retries_total', family + (('reason', str(status or 'error')),))
+            await asyncio.sleep(delay)
+
+    def snapshot(self):
+        return [pooled.snapshot() for pooled in self.sessions]
+
+upstream = AsyncUpstream(SESSION_POOL_SIZE)
+
+# ============================================================================
+# CACHE + COALESCING
+# ============================================================================
+
+class AsyncFlight:
+    """
+    Async singleflight: concurrent callers with the same key share one task.
+    The shared task is cancelled only when every waiter has gone away
+    (e.g. all requesting clients disconnected).
+    """
+
+    def __init__(self):
+        self.calls = {}   # key -> {task, waiters}
+        self.stats = {'calls': 0, 'coalesced': 0, 'cancelled': 0}
+
+    async def do(self, key, factory):
+        call = self.calls.get(key)
+        if call is None:
+            task = asyncio.create_task(factory())
+            call = self.calls[key] = {'task': task, 'waiters': 0}
+            task.add_done_callback(lambda _t, key=key: self.calls.pop(key, None))
+            # Abandoned calls can still fail after their last waiter left; mark the error retrieved
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            self.stats['calls'] += 1
+        else:
+            self.stats['coalesced'] += 1
+
+        call['waiters'] += 1
+        try:
+            return await asyncio.shield(call['task'])
+        except asyncio.CancelledError:
+            if not call['task'].done() and call['waiters'] == 1:
+                call['task'].cancel()
+                self.stats['cancelled'] += 1
+            raise
+        finally:
+            call['waiters'] -= 1
+
+flight = AsyncFlight()
+background_tasks = set()
+
+async def cached_fetch(endpoint, params, loader):
+    """Async counterpart of ResponseCache.fetch(): fresh hit, stale + refresh, or coalesced miss."""
+    key, data, state, refresh = response_cache.lookup(endpoint, params)
+    if state == 'fresh':
+        return data
+    if state == 'stale':
+        if refresh:
+            task = asyncio.create_task(_refresh(key, loader))
+            background_tasks.add(task)
+            task.add_done_callback(background_tasks.discard)
+        return data
+
+    data, size = await flight.do(key, loader)
+    response_cache.put(key, data, size)
+    return data
+
+async def _refresh(key, loader):
+    success = False
+    try:
+        data, size = await flight.do(key, loader)
+        response_cache.put(key, data, size)
+        success = True
+    except Exception as e:
+        print(f'[Cache] Background refresh failed for {key[0]}: {e}')
+    finally:
+        response_cache.finish_refresh(key, success)
+
+async def load_item(itemid, shopid, deadline):
+    url, headers = server.item_request(itemid, shopid)
+
+    async def loader():
+        data, size = await upstream.get_json('item', url, headers, deadline)
+        snapshot_store.record([server.project_item(data)], 'item')
+        return data, size
+
+    return await cached_fetch('item', {'itemid': itemid, 'shopid': shopid}, loader)
+
+async def load_search_page(keyword, limit, page, filters, deadline):
+    url, headers = server.search_request(keyword, limit, page, filters)
+
+    async def loader():
+        data, size = await upstream.get_json('search', url, headers, deadline)
+        snapshot_store.record([server.project_search_item(item) for item in data.get('items') or []], 'search')
+        return data, size
+
+    return await cached_fetch('search', dict(filters, keyword=keyword, limit=limit, page=page), loader)
+
+# ============================================================================
+# HTTP ROUTES
+# ============================================================================
+
+def json_response(data, status=200):
+    return web.Response(body=server.ndjson_line(data)[:-1], status=status, content_type='application/json')
+
+def error_response(message, status):
+    return json_response({'error': message}, status)
+
+def projection_args(query):
+    fmt = query.get('format', 'full')
+    if fmt not in ('full', 'compact'):
+        raise ValueError('format must be full or compact')
+    fields = [f.strip() for f in query.get('fields', '').split(',') if f.strip()]
+    return fmt == 'compact' or bool(fields), fields
+
+@web.middleware
+async def deadline_middleware(request, handler):
+    """
+    Enforce the per-request deadline, report rate-limit queue time and record request metrics.
+    Streaming handlers lift the deadline (request['deadline_scope']) before
+    preparing their response and apply it to each upstream fetch instead.
+    """
+    wait_holder = [0.0]
+    queue_wait.set(wait_holder)
+    resource = request.match_info.route.resource
+    route = (('route', resource.canonical if resource else 'unmatched'),)
+    started = time.time()
+    metrics.inc('proxy_requests_in_flight', route)
+    try:
+        async with asyncio.timeout(REQUEST_DEADLINE) as scope:
+            request['deadline_scope'] = scope
+            response = await handler(request)
+    except TimeoutError:
+        response = error_response('Request deadline exceeded', 504)
+    except UpstreamError as e:
+        response = error_response(str(e), e.status)
+    except web.HTTPException as e:
+        metrics.inc('proxy_requests_total', route + (('method', request.method), ('status', str(e.status))))
+        raise
+    finally:
+        metrics.inc('proxy_requests_in_flight', route, -1)
+    if not response.prepared:
+        if request.path.startswith('/api/'):
+            response.headers['X-Queue-Wait-Ms'] = str(round(wait_holder[0] * 1000))
+        response = conditional_and_compressed(request, response)
+    metrics.inc('proxy_requests_total', route + (('method', request.method), ('status', str(response.status))))
+    metrics.observe('proxy_request_duration_seconds', route, time.time() - started)
+    if not response.prepared and response.body is not None:
+        metrics.inc('proxy_response_bytes_total', route, len(response.body))
+    return response
+
+def conditional_and_compressed(request, response):
+    """Same ETag/304 and br/gzip policy as server.add_etag_and_compress()."""
+    if response.status != 200 or response.content_type != 'application/json' or response.body is None:
+        return response
+    body = response.body
+    if request.method == 'GET':
+        etag = body_etag(body)
+        response.headers['ETag'] = etag
+        if etag in [tag.strip() for tag in request.headers.get('If-None-Match', '').split(',')]:
+            return web.Response(status=304, headers={'ETag': etag, 'Vary': 'Accept-Encoding'})
+
+    response.headers['Vary'] = 'Accept-Encoding'
+    encoding = choose_encoding(request.headers.get('Accept-Encoding'))
+    if encoding and len(body) >= COMPRESS_MIN_BYTES:
+        response.body = compress_body(body, encoding)
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+async def health(request):
+    """Health check endpoint."""
+    return json_response({
+        'status': 'ok',
+        'service': 'shopee-proxy',
+        'engine': 'asyncio',
+        'sessions': upstream.snapshot(),
+        'cache': response_cache.snapshot(),
+        'rate_limits': {name: limiter.snapshot() for name, limiter in rate_limiters.items()},
+        'snapshots': snapshot_store.snapshot(),
+        'coalescing': flight.stats,
+    })
+
+def scrape_time_samples():
+    yield from server.shared_scrape_samples()
+    yield ('proxy_coalesced_calls_total', 'counter', 'Calls that joined an in-flight call', (('flight', 'upstream'),), flight.stats['coalesced'])
+    for pooled in upstream.snapshot():
+        labels = (('session', pooled['id']),)
+        yield ('shopee_session_in_flight', 'gauge', 'Requests in flight per session', labels, pooled['in_flight'])
+
+async def prometheus_metrics(request):
+    """Prometheus text-format metrics (same names as server.py)."""
+    return web.Response(text=metrics.render(scrape_time_samples()), headers={'Content-Type': 'text/plain; version=0.0.4'})
+
+async def get_item(request):
+    """Proxy for Shopee item details API (same params as server.py)."""
+    itemid = request.query.get('itemid')
+    shopid = request.query.get('shopid')
+    if not itemid or not shopid:
+        return error_response('Missing itemid or shopid', 400)
+    try:
+        compact, fields = projection_args(request.query)
+    except ValueError as e:
+        return error_response(str(e), 400)
+
+    data = await load_item(itemid, shopid, time.time() + REQUEST_DEADLINE)
+    if not compact:
+        return json_response(data)
+    product = server.project_item(data, fields)
+    if product is None:
+        return json_response({'error': 'Item not found', 'upstream_error': data.get('error')}, 404)
+    return json_response(product)
+
+async def get_ratings(request):
+    """Proxy for Shopee ratings API (same params as server.py)."""
+    itemid = request.query.get('itemid')
+    shopid = request.query.get('shopid')
+    limit = request.query.get('limit', '5')
+    if not itemid or not shopid:
+        return error_response('Missing itemid or shopid', 400)
+    try:
+        compact, fields = projection_args(request.query)
+    except ValueError as e:
+        return error_response(str(e), 400)
+
+    url, headers = server.ratings_request(itemid, shopid, limit)
+    deadline = time.time() + REQUEST_DEADLINE
+    data = await cached_fetch(
+        'ratings', {'itemid': itemid, 'shopid': shopid, 'limit': limit},
+        lambda: upstream.get_json('ratings', url, headers, deadline)
+    )
+    return json_response(server.project_ratings(data, fields) if compact else data)
+
+async def search(request):
+    """Proxy for Shopee search API (same params as server.py, including pages=N streaming)."""
+    query = request.query
+    keyword = query.get('keyword')
+    limit = query.get('limit', '20')
+    if not keyword:
+        return error_response('Missing keyword', 400)
+
+    filters = {name: query[name] for name in ('by', 'order', 'price_min', 'price_max') if query.get(name)}
+    if filters.get('by', 'relevancy') not in server.SEARCH_SORTS:
+        return error_response(f'by must be one of: {", ".join(server.SEARCH_SORTS)}', 400)
+    if filters.get('order', 'desc') not in ('asc', 'desc'):
+        return error_response('order must be asc or desc', 400)
+    try:
+        pages = int(query.get('pages', 1))
+        int(limit)
+        for name in ('price_min', 'price_max'):
+            if name in filters:
+                int(filters[name])
+    except ValueError:
+        return error_response('pages, limit and prices must be integers', 400)
+    if pages < 1 or pages > server.SEARCH_MAX_PAGES:
+        return error_response(f'pages must be between 1 and {server.SEARCH_MAX_PAGES}', 400)
+    try:
+        compact, fields = projection_args(query)
+    except ValueError as e:
+        return error_response(str(e), 400)
+
+    deadline = time.time() + REQUEST_DEADLINE
+    if pages == 1:
+        data = await load_search_page(keyword, limit, 0, filters, deadline)
+        return json_response(server.project_search(data, fields) if compact else data)
+
+    tasks = [
+        asyncio.create_task(load_search_page(keyword, limit, page, filters, deadline))
+        for page in range(pages)
+    ]
+    # A 504 can't be sent once the stream has started: each page fetch gets
+    # the deadline instead, and the queue wait is reported in the final line
+    request['deadline_scope'].reschedule(None)
+    response = web.StreamResponse(headers={'Content-Type': 'application/x-ndjson'})
+    await response.prepare(request)
+    seen = set()
+    try:
+        for page, task in enumerate(tasks):
+            try:
+                async with asyncio.timeout(max(0, deadline - time.time())):
+                    data = await task
+            except TimeoutError:
+                await response.write(server.ndjson_line({'page': page, 'error': 'Request deadline exceeded'}))
+                continue
+            except UpstreamError as e:
+                await response.write(server.ndjson_line({'page': page, 'error': str(e)}))
+                continue
+            items = []
+            for item in data.get('items') or []:
+                itemid = item.get('itemid') or (item.get('item_basic') or {}).get('itemid')
+                if itemid in seen:
+                    continue
+                seen.add(itemid)
+                items.append(server.project_search_item(item, fields) if compact else item)
+            await response.write(server.ndjson_line({'page': page, 'items': items, 'nomore': bool(data.get('nomore'))}))
+            if data.get('nomore'):
+                break
+        await response.write(server.ndjson_line({
+            'done': True, 'count': len(seen), 'queue_wait_ms': round(queue_wait.get()[0] * 1000)
+        }))
+    finally:
+        for task in tasks:
+            task.cancel()
+    await response.write_eof()
+    return response
+
+async def on_startup(app):
+    await upstream.start()
+
+async def on_cleanup(app):
+    await upstream.close()
+
+def create_app():
+    app = web.Application(middlewares=[deadline_middleware])
+    app.router.add_get('/health', health)
+    app.router.add_get('/metrics', prometheus_metrics)
+    app.router.add_get('/api/item', get_item)
+    app.router.add_get('/api/ratings', get_ratings)
+    app.router.add_get('/api/search', search)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Shopee proxy (asyncio engine)')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    args = parser.parse_args()
+
+    print(f'🚀 Shopee Proxy Server (asyncio) starting on http://{args.host}:{args.port}')
+    print('   Endpoints: /health, /metrics, /api/item, /api/ratings, /api/search')
+
+    # Cancel in-flight handlers (and their upstream calls) when the client disconnects
+    web.run_app(create_app(), host=args.host, port=args.port, handler_cancellation=True, print=None)
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Benchmark the proxy engines against the local Shopee stand-in.
+Starts standin.py plus each proxy engine as subprocesses, drives /api/item,
+/api/ratings and /api/search at each concurrency level and reports
+throughput and p50/p95/p99 latency.
+
+Usage: python bench.py [--mode sync|async|both] [--endpoints item,ratings,search]
+                       [--requests 2000] [--concurrency 50,200] [--latency 80]
+                       [--fixtures DIR [--fixtures-only]] [--block-rate 0.02] [--rate-limit 500] [--output results.json]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+import aiohttp
+
+from fixtures import FixtureStore
+
+BACKEND_DIR = Path(__file__).parent
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def start_process(args, env=None):
+    return subprocess.Popen(
+        [sys.executable, *args],
+        cwd=BACKEND_DIR,
+        env=dict(os.environ, **(env or {})),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+async def wait_ready(url, timeout=20):
+    deadline = time.time() + timeout
+    async with aiohttp.ClientSession() as client:
+        while time.time() < deadline:
+            try:
+                async with client.get(url) as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f'{url} did not become ready')
+
+ENDPOINTS = {
+    'item': lambda n: f'/api/item?itemid={n}&shopid=42',
+    'ratings': lambda n: f'/api/ratings?itemid={n}&shopid=42&limit=20',
+    'search': lambda n: f'/api/search?keyword=standin+{n}&limit=20',
+}
+
+def fixture_paths(directory):
+    """
+    Proxy request paths whose upstream request has a recorded fixture,
+    per endpoint, so a --fixtures run replays recordings instead of missing.
+    """
+    paths = {endpoint: [] for endpoint in ENDPOINTS}
+    for key in sorted(FixtureStore(directory).load_all()):
+        parts = urlsplit(key)
+        query = dict(parse_qsl(parts.query, keep_blank_values=True))
+        if parts.path == '/api/v4/item/get':
+            paths['item'].append('/api/item?' + urlencode({name: query[name] for name in ('itemid', 'shopid')}))
+        elif parts.path == '/api/v2/item/get_ratings' and query.get('offset') == '0' and query.get('type') == '0':
+            paths['ratings'].append('/api/ratings?' + urlencode({name: query[name] for name in ('itemid', 'shopid', 'limit')}))
+        elif parts.path == '/api/v4/search/search_items' and 'newest' not in query:
+            params = {name: query[name] for name in ('keyword', 'limit', 'by', 'order', 'price_min', 'price_max') if name in query}
+            paths['search'].append('/api/search?' + urlencode(params))
+    return paths
+
+# Unique keys keep increasing across runs so one run does not warm the next one's cache
+next_key = {'value': 1}
+
+async def run_load(base_url, endpoint, total, concurrency, unique, recorded=None):
+    """
+    Fire `total` requests at one endpoint with at most `concurrency` in flight.
+    With `recorded` paths (from fixtures) the requests cycle through those instead.
+    """
+    make_path = (lambda n: recorded[n % len(recorded)]) if recorded else ENDPOINTS[endpoint]
+    first_key = next_key['value']
+    if unique:
+        next_key['value'] += total
+    latencies = []
+    statuses = {}
+    counter = iter(range(total))
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=60)
+
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as client:
+        async def worker():
+            for i in counter:
+                key = first_key + i if unique else (i % 50) + 1
+                start = time.perf_counter()
+                try:
+                    async with client.get(base_url + make_path(key)) as response:
+                        await response.read()
+                        status = response.status
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    status = 'error'
+                statuses[status] = statuses.get(status, 0) + 1
+                latencies.append(time.perf_counter() - start)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'endpoint': endpoint,
+        'concurrency': concurrency,
+        'requests': total,
+        'errors': sum(count for status, count in statuses.items() if status != 200),
+        'statuses': {str(status): count for status, count in statuses.items()},
+        'elapsed': elapsed,
+        'throughput': total / elapsed if elapsed else 0,
+        'mean_ms': sum(latencies) / len(latencies) * 1000 if latencies else 0,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+    }
+
+def print_report(mode, result):
+    non_ok = ', '.join(f'{status}: {count}' for status, count in result['statuses'].items() if status != '200')
+    print(f'  {mode:<6} {result["endpoint"]:<8} c={result["concurrency"]:<5} {result["requests"]:>6} req  '
+          f'{result["errors"]:>4} err  {result["throughput"]:>8.1f} req/s  mean {result["mean_ms"]:>7.1f} ms  '
+          f'p50 {result["p50_ms"]:>7.1f} ms  p95 {result["p95_ms"]:>7.1f} ms  p99 {result["p99_ms"]:>7.1f} ms'
+          + (f'  ({non_ok})' if non_ok else ''))
+
+async def bench_mode(mode, args, upstream_url, db_path):
+    env = {
+        'SHOPEE_BASE_URL': upstream_url,
+        'SHOPEE_RATE_LIMIT': 'off',
+        'SHOPEE_SNAPSHOT_DB': db_path,
+    }
+    if mode == 'sync':
+        command = ['-c', f'import server; server.app.run(host="127.0.0.1", port={args.proxy_port}, threaded=True)']
+    else:
+        command = ['async_server.py', '--port', str(args.proxy_port)]
+
+    proxy = start_process(command, env)
+    results = []
+    try:
+        base_url = f'http://127.0.0.1:{args.proxy_port}'
+        await wait_ready(f'{base_url}/health')
+        for concurrency in args.concurrency:
+            for endpoint in args.endpoints:
+                recorded = args.recorded_paths.get(endpoint) if args.recorded_paths else None
+                result = await run_load(base_url, endpoint, args.requests, concurrency, not args.repeat_keys, recorded)
+                result['mode'] = mode
+                print_report(mode, result)
+                results.append(result)
+        return results
+    finally:
+        proxy.terminate()
+        proxy.wait()
+
+def standin_command(args):
+    command = ['standin.py', '--port', str(args.upstream_port), '--latency', str(args.latency)]
+    if args.fixtures:
+        command += ['--fixtures', args.fixtures]
+        if args.fixtures_only:
+            command += ['--fixtures-only']
+    if args.block_rate:
+        command += ['--block-rate', str(args.block_rate)]
+    if args.rate_limit:
+        command += ['--rate-limit', str(args.rate_limit)]
+    return command
+
+async def main(args):
+    modes = ['sync', 'async'] if args.mode == 'both' else [args.mode]
+    args.recorded_paths = fixture_paths(args.fixtures) if args.fixtures else None
+    if args.recorded_paths:
+        for endpoint in args.endpoints:
+            if not args.recorded_paths[endpoint]:
+                print(f'Note: no {endpoint} fixtures in {args.fixtures}; using synthetic keys (stand-in misses)')
+    upstream_url = f'http://127.0.0.1:{args.upstream_port}'
+    standin = start_process(standin_command(args))
+    results = []
+    try:
+        await wait_ready(f'{upstream_url}/')
+        print(f'Benchmark: {args.requests} requests per run, endpoints {",".join(args.endpoints)}, '
+              f'concurrency {",".join(map(str, args.concurrency))}, upstream latency ~{args.latency:.0f} ms, '
+              f'{"repeated" if args.repeat_keys else "unique"} keys'
+              + (f', fixtures {args.fixtures} ('
+                 + ', '.join(f'{len(args.recorded_paths[e])} {e}' for e in args.endpoints) + ' recorded keys)'
+                 if args.fixtures else ''))
+        with tempfile.TemporaryDirectory() as tmp:
+            for mode in modes:
+                results += await bench_mode(mode, args, upstream_url, str(Path(tmp) / f'{mode}.db'))
+    finally:
+        standin.terminate()
+        standin.wait()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'args': {k: v for k, v in vars(args).items() if k != 'recorded_paths'}, 'results': results}, f, indent=2)
+        print(f'Results written to {args.output}')
+
+def csv_list(convert):
+    return lambda value: [convert(part) for part in value.split(',') if part]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark proxy engines against the local stand-in')
+    parser.add_argument('--mode', choices=['sync', 'async', 'both'], default='both')
+    parser.add_argument('--endpoints', type=csv_list(str), default=list(ENDPOINTS), help='comma-separated: item,ratings,search')
+    parser.add_argument('--requests', type=int, default=2000, help='requests per endpoint and concurrency level')
+    parser.add_argument('--concurrency', type=csv_list(int), default=[200], help='comma-separated concurrency levels')
+    parser.add_argument('--latency', type=float, default=80, help='stand-in latency in ms')
+    parser.add_argument('--fixtures', help='replay recorded fixtures from this directory (see fixtures.py)')
+    parser.add_argument('--fixtures-only', action='store_true', help='stand-in answers 404 for unrecorded requests')
+    parser.add_argument('--block-rate', type=float, default=0.0, help='fraction of upstream requests answered with 403')
+    parser.add_argument('--rate-limit', type=float, help='stand-in upstream requests per second')
+    parser.add_argument('--output', help='write results as JSON (for regression comparisons)')
+    parser.add_argument('--repeat-keys', action='store_true', help='reuse 50 item ids (exercises the cache)')
+    parser.add_argument('--proxy-port', type=int, default=8100)
+    parser.add_argument('--upstream-port', type=int, default=9100)
+    asyncio.run(main(parser.parse_args()))
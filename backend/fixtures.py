@@ -0,0 +1,61 @@
+"""
+Upstream response fixtures shared by the proxy's record mode and standin.py replay.
+A fixture is one JSON file per upstream URL (path + sorted query), named by
+the SHA-1 of that key, holding the raw response body.
+
+Record:  SHOPEE_RECORD_DIR=fixtures python server.py
+Replay:  python standin.py --fixtures fixtures
+"""
+
+import hashlib
+import json
+import os
+from threading import Lock
+from urllib.parse import parse_qsl, urlsplit, urlencode
+
+def fixture_key(path, query):
+    """Canonical key for an upstream request: path plus sorted query string."""
+    if isinstance(query, str):
+        query = parse_qsl(query, keep_blank_values=True)
+    elif hasattr(query, 'items'):
+        query = query.items()
+    return f'{path}?{urlencode(sorted(query))}'
+
+def url_fixture_key(url):
+    parts = urlsplit(url)
+    return fixture_key(parts.path, parts.query)
+
+class FixtureStore:
+    """Directory of recorded upstream responses, keyed by fixture_key()."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = Lock()
+        self.saved = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def path_for(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json')
+
+    def save(self, url, status, body):
+        """Write the raw body for `url` (last response wins)."""
+        key = url_fixture_key(url)
+        record = {'key': key, 'status': status, 'body': body.decode('utf-8', 'replace')}
+        path = self.path_for(key)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(record, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        with self.lock:
+            self.saved += 1
+
+    def load_all(self):
+        """Return {key: (status, body_bytes)} for every fixture in the directory."""
+        fixtures = {}
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            with open(os.path.join(self.directory, name), encoding='utf-8') as f:
+                record = json.load(f)
+            fixtures[record['key']] = (record.get('status', 200), record['body'].encode('utf-8'))
+        return fixtures
@@ -4,19 +4,153 @@ Shopee API Proxy Server v2
 Enhanced with session handling and better anti-bot evasion.
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
+from collections import OrderedDict, deque
+from bisect import bisect_left
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from threading import Condition, Event, Lock, Thread, local
+from requests.adapters import HTTPAdapter
+from urllib.parse import quote, urlencode
+from pathlib import Path
+from fixtures import FixtureStore
+import gzip
+import hashlib
+import json
+import os
+import queue
+import random
 import requests
+import sqlite3
 import time
 
+try:
+    import orjson
+except ImportError:  # Optional; falls back to the stdlib encoder
+    orjson = None
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    jsonify() backed by orjson when it is installed. Calls orjson can't
+    honour (indent, separators, a custom cls, pretty debug output) use the
+    stdlib provider.
+    """
+
+    # Keep insertion order on both encoders; sort_keys=True still sorts
+    sort_keys = False
+
+    def _encode(self, obj, kwargs):
+        """orjson bytes for obj, or None when orjson is missing or can't honour kwargs."""
+        if orjson is None or set(kwargs) - {'default', 'sort_keys', 'ensure_ascii'}:
+            return None
+        # Dates go through `default` too, so both encoders format them the same way
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if kwargs.get('sort_keys', self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=kwargs.get('default', self.default), option=option)
+
+    def dumps(self, obj, **kwargs):
+        data = self._encode(obj, kwargs)
+        return super().dumps(obj, **kwargs) if data is None else data.decode('utf-8')
+
+    def response(self, *args, **kwargs):
+        if args and kwargs:
+            raise TypeError('jsonify() behavior undefined when passed both args and kwargs')
+        obj = args[0] if len(args) == 1 else (args or kwargs or None)
+        pretty = self.compact is False or (self.compact is None and self._app.debug)
+        data = None if pretty else self._encode(obj, {})
+        if data is None:
+            return super().response(*args, **kwargs)
+        return self._app.response_class(data, mimetype=self.mimetype)
+
+try:
+    import brotli
+except ImportError:  # Optional; responses fall back to gzip
+    brotli = None
+
+def ndjson_line(obj):
+    """Encode one NDJSON record."""
+    if orjson is not None:
+        return orjson.dumps(obj) + b'\n'
+    return (json.dumps(obj, ensure_ascii=False) + '\n').encode('utf-8')
+
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
 CORS(app)  # Allow all origins (for localhost extension use)
 
-# Create a session that will store cookies between requests
-session = requests.Session()
+# Max concurrent upstream fetches for a single batch request
+BATCH_WORKERS = 8
+# Max items accepted by POST /api/items
+BATCH_MAX_ITEMS = 50
+
+# Upstream origin; point at a local stand-in for benchmarks
+SHOPEE_BASE_URL = os.getenv('SHOPEE_BASE_URL', 'https://shopee.co.id').rstrip('/')
+# Record mode: save every successful upstream response as a replay fixture here
+SHOPEE_RECORD_DIR = os.getenv('SHOPEE_RECORD_DIR')
+
+# Number of independently initialized Shopee sessions (separate cookie jars)
+SESSION_POOL_SIZE = 4
+# Concurrent upstream requests allowed on one session
+SESSION_MAX_IN_FLIGHT = 4
+# Seconds a request waits for a healthy session before giving up
+SESSION_CHECKOUT_TIMEOUT = 15
+# Sessions whose health score drops below this are quarantined and refreshed
+SESSION_MIN_SCORE = 0.5
+# Upstream latency (seconds) still considered healthy when scoring sessions
+SESSION_LATENCY_TARGET = 1.5
+
+# Ratings page size and defaults for GET /api/ratings/all
+RATINGS_PAGE_SIZE = 50
+RATINGS_DEFAULT_MAX = 200
+RATINGS_MAX_CAP = 5000
+# Ratings pages fetched concurrently per stream
+RATINGS_PAGE_WINDOW = 4
+
+# Search pages fetched in parallel by GET /api/search?pages=N
+SEARCH_MAX_PAGES = 5
+SEARCH_SORTS = ('relevancy', 'ctime', 'sales', 'price')
+
+# Bytes of upstream bodies remembered with their ETag/Last-Modified for revalidation
+# (kept apart from the response cache, so it adds to CACHE_MAX_BYTES)
+VALIDATOR_MAX_BYTES = 16 * 1024 * 1024
+# JSON bodies smaller than this are sent uncompressed
+COMPRESS_MIN_BYTES = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+# SQLite file for product snapshots and price history
+SNAPSHOT_DB = os.getenv('SHOPEE_SNAPSHOT_DB', str(Path(__file__).parent / 'snapshots.db'))
+# Writes are batched by a background thread: up to this many per transaction...
+SNAPSHOT_BATCH_SIZE = 200
+# ...or whatever arrived within this many seconds
+SNAPSHOT_FLUSH_INTERVAL = 1.0
+# Snapshots waiting to be written before new ones are dropped
+SNAPSHOT_QUEUE_MAX = 10000
+
+# Token-bucket rate limits per upstream endpoint family (requests/second).
+# The rate halves on 403/429 and creeps back up on success (AIMD).
+# Set SHOPEE_RATE_LIMIT=off to disable (local stand-in benchmarks only).
+RATE_LIMIT_ENABLED = os.getenv('SHOPEE_RATE_LIMIT', 'on').lower() != 'off'
+RATE_LIMITS = {
+    'item':    {'rate': 5.0, 'min_rate': 0.5, 'max_rate': 20.0, 'burst': 5},
+    'ratings': {'rate': 5.0, 'min_rate': 0.5, 'max_rate': 20.0, 'burst': 5},
+    'search':  {'rate': 2.0, 'min_rate': 0.2, 'max_rate': 10.0, 'burst': 3},
+}
+# Requests/second regained per second of successful traffic
+RATE_RECOVERY = 0.5
+# Seconds between two rate decreases (one burst of 403s counts once)
+RATE_DECREASE_COOLDOWN = 2.0
+# Total seconds an upstream fetch may spend queueing, retrying and backing off
+UPSTREAM_DEADLINE = 30
+UPSTREAM_MAX_ATTEMPTS = 4
+# Exponential backoff base and cap (seconds); sleeps are fully jittered
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 8
 
 # Complete browser-like headers
-session.headers.update({
+BROWSER_HEADERS = {
     'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
     'Accept': 'application/json, text/plain, */*',
     'Accept-Language': 'id-ID,id;q=0.9,en-US;q=0.8,en;q=0.7',
@@ -29,19 +163,1198 @@ session.headers.update({
     'Sec-Fetch-Dest': 'empty',
     'Sec-Fetch-Mode': 'cors',
     'Sec-Fetch-Site': 'same-origin',
-})
+}
+
+# ============================================================================
+# METRICS
+# ============================================================================
+
+# Histogram buckets (seconds) for upstream and request latency
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+METRIC_HELP = {
+    'proxy_requests_total': ('counter', 'Proxy requests by route, method and status'),
+    'proxy_request_duration_seconds': ('histogram', 'Proxy request handling time by route'),
+    'proxy_requests_in_flight': ('gauge', 'Proxy requests currently being handled'),
+    'proxy_response_bytes_total': ('counter', 'Response body bytes sent by route (non-streamed)'),
+    'shopee_upstream_requests_total': ('counter', 'Upstream Shopee requests by endpoint family and status'),
+    'shopee_upstream_latency_seconds': ('histogram', 'Upstream Shopee latency by endpoint family'),
+    'shopee_upstream_in_flight': ('gauge', 'Upstream Shopee requests currently in flight'),
+    'shopee_upstream_bytes_total': ('counter', 'Upstream response body bytes received by endpoint family'),
+    'shopee_upstream_retries_total': ('counter', 'Upstream retries by endpoint family and reason'),
+    'shopee_session_inits_total': ('counter', 'Shopee session (re)initializations by result'),
+}
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        f'{key}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34)).replace(chr(10), chr(92) + "n")}"'
+        for key, value in labels
+    )
+    return '{' + ','.join(escaped) + '}'
+
+class Metrics:
+    """
+    Minimal Prometheus-style registry. Updates are a dict lookup and an add
+    under one lock, so they are cheap enough for the request hot path.
+    Labels are passed as tuples of (name, value) pairs.
+    """
+
+    def __init__(self, buckets):
+        self.lock = Lock()
+        self.buckets = buckets
+        self.values = {}       # (name, labels) -> number (counters and gauges)
+        self.histograms = {}   # (name, labels) -> [per-bucket counts..., +Inf count, sum]
+
+    def inc(self, name, labels=(), value=1):
+        key = (name, labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        key = (name, labels)
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [0] * (len(self.buckets) + 2)
+            histogram[index] += 1
+            histogram[-1] += value
+
+    def render(self, extra=()):
+        """
+        Prometheus text exposition. `extra` is an iterable of
+        (name, type, help, labels, value) samples computed at scrape time.
+        """
+        with self.lock:
+            values = dict(self.values)
+            histograms = {key: list(h) for key, h in self.histograms.items()}
+
+        samples = {}
+        for (name, labels), value in values.items():
+            samples.setdefault(name, []).append(f'{name}{_format_labels(labels)} {value}')
+        for (name, labels), histogram in histograms.items():
+            lines = samples.setdefault(name, [])
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), histogram[:-1]):
+                cumulative += count
+                lines.append(f'{name}_bucket{_format_labels(labels + (("le", bound),))} {cumulative}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {histogram[-1]}')
+            lines.append(f'{name}_count{_format_labels(labels)} {cumulative}')
+
+        help_text = dict(METRIC_HELP)
+        for name, kind, text, labels, value in extra:
+            help_text[name] = (kind, text)
+            samples.setdefault(name, []).append(f'{name}{_format_labels(labels)} {value}')
+
+        output = []
+        for name in sorted(samples):
+            kind, text = help_text.get(name, ('untyped', name))
+            output.append(f'# HELP {name} {text}')
+            output.append(f'# TYPE {name} {kind}')
+            output.extend(samples[name])
+        return '\n'.join(output) + '\n'
+
+metrics = Metrics(LATENCY_BUCKETS)
+
+# ============================================================================
+# REQUEST COALESCING
+# ============================================================================
+
+class SingleFlight:
+    """
+    Collapse concurrent calls with the same key into one in-flight call.
+    The first caller runs the function; callers arriving while it runs wait
+    and share its result (or its exception).
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.calls = {}   # key -> {event, result, error}
+        self.stats = {'calls': 0, 'coalesced': 0}
+
+    def do(self, key, fn):
+        with self.lock:
+            call = self.calls.get(key)
+            if call is not None:
+                self.stats['coalesced'] += 1
+                leader = False
+            else:
+                call = {'event': Event(), 'result': None, 'error': None}
+                self.calls[key] = call
+                self.stats['calls'] += 1
+                leader = True
+
+        if not leader:
+            call['event'].wait()
+            if call['error'] is not None:
+                raise call['error']
+            return call['result']
+
+        try:
+            call['result'] = fn()
+            return call['result']
+        except Exception as e:
+            call['error'] = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call['event'].set()
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.stats, in_flight=len(self.calls))
+
+upstream_flight = SingleFlight()
+session_flight = SingleFlight()
+
+# ============================================================================
+# SESSION POOL
+# ============================================================================
+
+class PooledSession:
+    """One Shopee session with its own cookie jar, connection pool and health stats."""
+
+    def __init__(self, session_id):
+        self.id = session_id
+        self.http = requests.Session()
+        self.http.headers.update(BROWSER_HEADERS)
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=SESSION_MAX_IN_FLIGHT)
+        self.http.mount('https://', adapter)
+        self.http.mount('http://', adapter)
+        self.state = 'new'               # new | ready | quarantined
+        self.in_flight = 0
+        self.recent = deque(maxlen=20)   # recent outcomes: True if blocked/failed
+        self.latency = None              # EWMA of upstream latency in seconds
+        self.requests = 0
+        self.blocks = 0
+        self.inits = 0
+
+    @property
+    def score(self):
+        """Health in [0, 1]: share of recent successes, scaled down when slow."""
+        score = 1.0
+        if self.recent:
+            score -= sum(self.recent) / len(self.recent)
+        if self.latency and self.latency > SESSION_LATENCY_TARGET:
+            score *= SESSION_LATENCY_TARGET / self.latency
+        return score
+
+    def record(self, status, latency):
+        failed = status is None or status in (403, 429)
+        self.requests += 1
+        self.recent.append(failed)
+        if status in (403, 429):
+            self.blocks += 1
+        if status is not None:
+            self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+        return failed
+
+    def init(self):
+        """Visit Shopee homepage to get a fresh set of cookies."""
+        self.http.cookies.clear()
+        try:
+            print(f'[Proxy] Initializing session {self.id} with Shopee...')
+            response = self.http.get(f'{SHOPEE_BASE_URL}/', timeout=10)
+            print(f'[Proxy] Session {self.id} init: {response.status_code}, cookies: {len(self.http.cookies)}')
+            self.inits += 1
+            metrics.inc('shopee_session_inits_total', (('result', 'ok'),))
+            return True
+        except Exception as e:
+            print(f'[Proxy] Session {self.id} init error: {e}')
+            metrics.inc('shopee_session_inits_total', (('result', 'error'),))
+            return False
+
+    def snapshot(self):
+        return {
+            'id': self.id,
+            'state': self.state,
+            'score': round(self.score, 3),
+            'in_flight': self.in_flight,
+            'cookies': len(self.http.cookies),
+            'requests': self.requests,
+            'blocks': self.blocks,
+            'inits': self.inits,
+            'latency_ms': round(self.latency * 1000) if self.latency is not None else None,
+        }
+
+class SessionPool:
+    """
+    Pool of independently initialized Shopee sessions.
+    Requests check out the healthiest session with spare capacity. A session
+    that gets blocked (or whose score drops too low) is quarantined and
+    re-initialized in the background while traffic moves to the others.
+    """
+
+    def __init__(self, size):
+        self.cond = Condition()
+        self.sessions = [PooledSession(i) for i in range(size)]
+        self.stats = {'checkouts': 0, 'waits': 0, 'quarantines': 0, 'refreshes': 0}
+
+    def _init_session(self, pooled):
+        """Initialize one session; concurrent callers share the same homepage visit."""
+        success = session_flight.do(pooled.id, pooled.init)
+        if success:
+            with self.cond:
+                pooled.recent.clear()
+                pooled.latency = None
+                pooled.state = 'ready'
+                self.cond.notify_all()
+        return success
+
+    def init_all(self):
+        """(Re)initialize every session concurrently. Returns True if any succeeded."""
+        with ThreadPoolExecutor(max_workers=len(self.sessions)) as executor:
+            results = list(executor.map(self._init_session, self.sessions))
+        return any(results)
+
+    @contextmanager
+    def checkout(self):
+        pooled = self._acquire()
+        try:
+            if pooled.state == 'new':
+                self._init_session(pooled)
+            yield pooled
+        finally:
+            with self.cond:
+                pooled.in_flight -= 1
+                self.cond.notify_all()
+
+    def _acquire(self):
+        deadline = time.time() + SESSION_CHECKOUT_TIMEOUT
+        with self.cond:
+            self.stats['checkouts'] += 1
+            waited = False
+            while True:
+                candidates = [
+                    s for s in self.sessions
+                    if s.state != 'quarantined' and s.in_flight < SESSION_MAX_IN_FLIGHT
+                ]
+                if candidates:
+                    pooled = max(candidates, key=lambda s: (s.state == 'ready', s.score, -s.in_flight))
+                    pooled.in_flight += 1
+                    return pooled
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise requests.RequestException('No healthy Shopee session available')
+                if not waited:
+                    self.stats['waits'] += 1
+                    waited = True
+                self.cond.wait(remaining)
+
+    def report(self, pooled, status, latency):
+        """Record an upstream outcome; quarantine the session if it looks blocked."""
+        with self.cond:
+            failed = pooled.record(status, latency)
+            blocked = status in (403, 429)
+            if pooled.state == 'ready' and (blocked or (failed and pooled.score < SESSION_MIN_SCORE)):
+                pooled.state = 'quarantined'
+                self.stats['quarantines'] += 1
+                print(f'[Proxy] Session {pooled.id} quarantined (status={status}, score={pooled.score:.2f})')
+                Thread(target=self._refresh, args=(pooled,), daemon=True).start()
+
+    def _refresh(self, pooled):
+        """Re-initialize a quarantined session, backing off while Shopee refuses."""
+        delay = 1
+        while not self._init_session(pooled):
+            time.sleep(delay)
+            delay = min(delay * 2, 60)
+        with self.cond:
+            self.stats['refreshes'] += 1
+
+    def total_cookies(self):
+        return sum(len(s.http.cookies) for s in self.sessions)
+
+    def snapshot(self):
+        with self.cond:
+            return dict(self.stats, sessions=[s.snapshot() for s in self.sessions])
+
+session_pool = SessionPool(SESSION_POOL_SIZE)
 
-# Initialize session by visiting the main page
 def init_session():
-    """Visit Shopee homepage to get initial cookies."""
-    try:
-        print('[Proxy] Initializing session with Shopee...')
-        response = session.get('https://shopee.co.id/', timeout=10)
-        print(f'[Proxy] Session init: {response.status_code}, cookies: {len(session.cookies)}')
-        return True
-    except Exception as e:
-        print(f'[Proxy] Session init error: {e}')
-        return False
+    """Initialize every pooled session by visiting the Shopee homepage."""
+    return session_pool.init_all()
+
+def pooled_get(url, headers, timeout=15, label='other'):
+    """GET through a checked-out pooled session, feeding its health score and metrics."""
+    family = (('family', label),)
+    with session_pool.checkout() as pooled:
+        start = time.time()
+        metrics.inc('shopee_upstream_in_flight', family)
+        try:
+            response = pooled.http.get(url, headers=headers, timeout=timeout)
+        except requests.RequestException:
+            session_pool.report(pooled, None, time.time() - start)
+            metrics.inc('shopee_upstream_requests_total', family + (('status', 'error'),))
+            raise
+        finally:
+            metrics.inc('shopee_upstream_in_flight', family, -1)
+        latency = time.time() - start
+        session_pool.report(pooled, response.status_code, latency)
+        metrics.inc('shopee_upstream_requests_total', family + (('status', str(response.status_code)),))
+        metrics.observe('shopee_upstream_latency_seconds', family, latency)
+        metrics.inc('shopee_upstream_bytes_total', family, len(response.content))
+        return response
+
+# ============================================================================
+# RATE LIMITING
+# ============================================================================
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket whose rate adapts to upstream pushback: multiplicative
+    decrease on 403/429, additive recovery on success. Callers reserve a
+    token and sleep until it is due, so waiters are served in arrival order.
+    """
+
+    def __init__(self, name, rate, min_rate, max_rate, burst):
+        self.lock = Lock()
+        self.name = name
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.time()
+        self.last_decrease = 0
+        self.stats = {'acquired': 0, 'queued': 0, 'rejected': 0, 'decreases': 0, 'wait_seconds': 0.0}
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, deadline):
+        """
+        Reserve one request slot, sleeping until it is due.
+        Returns the seconds spent waiting; raises if the wait would pass `deadline`.
+        """
+        wait = self.reserve(deadline)
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    def reserve(self, deadline):
+        """Reserve one request slot and return how long the caller must wait for it."""
+        if not RATE_LIMIT_ENABLED:
+            return 0
+        with self.lock:
+            now = time.time()
+            self._refill(now)
+            wait = 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+            if now + wait > deadline:
+                self.stats['rejected'] += 1
+                raise requests.RequestException(f'Rate limit queue for {self.name} exceeded deadline')
+            self.tokens -= 1
+            self.stats['acquired'] += 1
+            if wait:
+                self.stats['queued'] += 1
+                self.stats['wait_seconds'] += wait
+        return wait
+
+    def on_success(self):
+        with self.lock:
+            # Roughly +RATE_RECOVERY req/s for each second of traffic at the current rate
+            self.rate = min(self.max_rate, self.rate + RATE_RECOVERY / self.rate)
+
+    def on_block(self):
+        with self.lock:
+            now = time.time()
+            if now - self.last_decrease < RATE_DECREASE_COOLDOWN:
+                return
+            self.last_decrease = now
+            self._refill(now)
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.stats['decreases'] += 1
+            print(f'[Proxy] Rate limit for {self.name} lowered to {self.rate:.2f} req/s')
+
+    def snapshot(self):
+        with self.lock:
+            self._refill(time.time())
+            return dict(self.stats, rate=round(self.rate, 3), tokens=round(self.tokens, 2),
+                        wait_seconds=round(self.stats['wait_seconds'], 3))
+
+rate_limiters = {
+    name: AdaptiveRateLimiter(name, **limits) for name, limits in RATE_LIMITS.items()
+}
+
+# Per-thread queue wait, reported to clients via the X-Queue-Wait-Ms header
+queue_wait = local()
+
+def reset_queue_wait():
+    queue_wait.seconds = 0.0
+
+def get_queue_wait():
+    return getattr(queue_wait, 'seconds', 0.0)
+
+def backoff_delay(attempt):
+    """Full-jitter exponential backoff for retry number `attempt` (0-based)."""
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * (2 ** attempt)))
+
+# ============================================================================
+# RESPONSE CACHE
+# ============================================================================
+
+# Seconds an entry is served as fresh, per endpoint
+CACHE_TTLS = {
+    'item': 60,
+    'ratings': 300,
+    'search': 120,
+}
+# Extra seconds an expired entry may still be served while it is refreshed
+CACHE_STALE_TTL = 600
+# Budget for cached upstream payloads (raw response bytes)
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+def normalize_params(params):
+    """Build a stable cache key part from query params."""
+    normalized = []
+    for key, value in sorted(params.items()):
+        value = ' '.join(str(value).split())
+        if key == 'keyword':
+            value = value.lower()
+        normalized.append((key, value))
+    return tuple(normalized)
+
+class ResponseCache:
+    """
+    Bounded LRU cache for upstream JSON responses.
+    Entries are fresh for a per-endpoint TTL, then served stale for up to
+    `stale_ttl` seconds while a single background refresh runs.
+    """
+
+    def __init__(self, ttls, stale_ttl, max_bytes, flight=None):
+        self.lock = Lock()
+        self.flight = flight or SingleFlight()
+        self.ttls = ttls
+        self.stale_ttl = stale_ttl
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()   # key -> {data, size, stored_at, ttl}
+        self.total_bytes = 0
+        self.refreshing = set()
+        self.stats = {
+            'hits': 0,
+            'stale_hits': 0,
+            'misses': 0,
+            'refreshes': 0,
+            'evictions': 0,
+        }
+
+    def _lookup(self, key):
+        """Return (entry, state) where state is 'fresh', 'stale' or None."""
+        entry = self.entries.get(key)
+        if entry is None:
+            return None, None
+        age = time.time() - entry['stored_at']
+        if age < entry['ttl']:
+            self.entries.move_to_end(key)
+            return entry, 'fresh'
+        if age < entry['ttl'] + self.stale_ttl:
+            self.entries.move_to_end(key)
+            return entry, 'stale'
+        self._remove(key)
+        return None, None
+
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry:
+            self.total_bytes -= entry['size']
+
+    def put(self, key, data, size):
+        endpoint = key[0]
+        with self.lock:
+            self._remove(key)
+            if size > self.max_bytes:
+                return
+            self.entries[key] = {
+                'data': data,
+                'size': size,
+                'stored_at': time.time(),
+                'ttl': self.ttls.get(endpoint, 60),
+            }
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes and self.entries:
+                oldest = next(iter(self.entries))
+                self._remove(oldest)
+                self.stats['evictions'] += 1
+
+    def fetch(self, endpoint, params, loader):
+        """
+        Return cached data for endpoint+params, calling `loader` on a miss.
+        `loader` returns (data, size_in_bytes) and may raise; errors are not cached.
+        """
+        key, data, state, refresh = self.lookup(endpoint, params)
+        if state == 'fresh':
+            return data
+        if state == 'stale':
+            if refresh:
+                Thread(target=self._refresh, args=(key, loader), daemon=True).start()
+            return data
+
+        data, size = self.flight.do(key, loader)
+        self.put(key, data, size)
+        return data
+
+    def lookup(self, endpoint, params):
+        """
+        Look up endpoint+params and count the hit/miss.
+        Returns (key, data, state, refresh) where state is 'fresh', 'stale' or
+        None, and refresh is True when the caller should start the (single)
+        background refresh of a stale entry and then call finish_refresh().
+        """
+        key = (endpoint, normalize_params(params))
+        with self.lock:
+            entry, state = self._lookup(key)
+            if state == 'fresh':
+                self.stats['hits'] += 1
+                return key, entry['data'], state, False
+            if state == 'stale':
+                self.stats['stale_hits'] += 1
+                refresh = key not in self.refreshing
+                self.refreshing.add(key)
+                return key, entry['data'], state, refresh
+            self.stats['misses'] += 1
+            return key, None, None, False
+
+    def finish_refresh(self, key, success):
+        with self.lock:
+            self.refreshing.discard(key)
+            if success:
+                self.stats['refreshes'] += 1
+
+    def _refresh(self, key, loader):
+        success = False
+        try:
+            data, size = self.flight.do(key, loader)
+            self.put(key, data, size)
+            success = True
+        except Exception as e:
+            print(f'[Cache] Background refresh failed for {key[0]}: {e}')
+        finally:
+            self.finish_refresh(key, success)
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.stats, entries=len(self.entries), bytes=self.total_bytes)
+
+response_cache = ResponseCache(CACHE_TTLS, CACHE_STALE_TTL, CACHE_MAX_BYTES, upstream_flight)
+
+class UpstreamValidators:
+    """
+    Remembers ETag/Last-Modified of upstream responses (when Shopee sends
+    them) so refetches can be conditional and a 304 reuses the stored body.
+    """
+
+    def __init__(self, max_bytes):
+        self.lock = Lock()
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()   # url -> {etag, last_modified, data, size}
+        self.total_bytes = 0
+        self.stats = {'conditional': 0, 'not_modified': 0, 'evictions': 0}
+
+    def conditional_headers(self, url, headers):
+        """Return request headers with If-None-Match/If-Modified-Since added when known."""
+        with self.lock:
+            entry = self.entries.get(url)
+            if entry is None:
+                return headers
+            self.stats['conditional'] += 1
+        headers = dict(headers)
+        if entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def remember(self, url, response_headers, data, size):
+        etag = response_headers.get('ETag')
+        last_modified = response_headers.get('Last-Modified')
+        with self.lock:
+            old = self.entries.pop(url, None)
+            if old:
+                self.total_bytes -= old['size']
+            if (not etag and not last_modified) or size > self.max_bytes:
+                return
+            self.entries[url] = {'etag': etag, 'last_modified': last_modified, 'data': data, 'size': size}
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.total_bytes -= evicted['size']
+                self.stats['evictions'] += 1
+
+    def revalidated(self, url):
+        """Stored (data, size) after a 304, or None if it was evicted meanwhile."""
+        with self.lock:
+            entry = self.entries.get(url)
+            if entry is None:
+                return None
+            self.entries.move_to_end(url)
+            self.stats['not_modified'] += 1
+            return entry['data'], entry['size']
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.stats, entries=len(self.entries), bytes=self.total_bytes)
+
+upstream_validators = UpstreamValidators(VALIDATOR_MAX_BYTES)
+
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix='batch')
+
+# Fixtures for standin.py --fixtures (None unless SHOPEE_RECORD_DIR is set)
+fixture_recorder = FixtureStore(SHOPEE_RECORD_DIR) if SHOPEE_RECORD_DIR else None
+
+def fetch_upstream(url, headers, label, retry_blocked=True):
+    """
+    GET a Shopee API URL through the rate limiter and session pool.
+    403/429, 5xx and connection errors are retried with jittered exponential
+    backoff until UPSTREAM_DEADLINE; blocked sessions are quarantined, so
+    retries run on healthy ones. Pass retry_blocked=False when the caller
+    retries 403s itself (other failures are still retried here).
+    Returns (json_data, size_in_bytes); raises requests exceptions.
+    """
+    limiter = rate_limiters[label]
+    deadline = time.time() + UPSTREAM_DEADLINE
+    attempt = 0
+    request_headers = upstream_validators.conditional_headers(url, headers)
+    
+    while True:
+        queue_wait.seconds = get_queue_wait() + limiter.acquire(deadline)
+        timeout = max(1, min(15, deadline - time.time()))
+        try:
+            response = pooled_get(url, request_headers, timeout=timeout, label=label)
+            status = response.status_code
+        except requests.RequestException as e:
+            response, status, error = None, None, e
+        
+        if status in (403, 429):
+            limiter.on_block()
+        elif status == 304:
+            limiter.on_success()
+            cached = upstream_validators.revalidated(url)
+            if cached is not None:
+                return cached
+            # Stored body was evicted meanwhile; refetch unconditionally
+            request_headers = headers
+            continue
+        elif status is not None and status < 500:
+            limiter.on_success()
+            break
+        
+        delay = backoff_delay(attempt)
+        attempt += 1
+        if (status == 403 and not retry_blocked) or attempt >= UPSTREAM_MAX_ATTEMPTS or time.time() + delay >= deadline:
+            break
+        print(f'[Proxy] Got {status or error} on {label}, retry {attempt} in {delay:.2f}s...')
+        metrics.inc('shopee_upstream_retries_total', (('family', label), ('reason', str(status or 'error'))))
+        time.sleep(delay)
+    
+    if response is None:
+        raise error
+    response.raise_for_status()
+    data, size = response.json(), len(response.content)
+    upstream_validators.remember(url, response.headers, data, size)
+    if fixture_recorder:
+        fixture_recorder.save(url, response.status_code, response.content)
+    return data, size
+
+# ============================================================================
+# RESPONSE PROJECTION
+# ============================================================================
+
+# Bump when the compact product/rating schema changes shape
+SCHEMA_VERSION = 1
+# Shopee API prices are rupiah scaled by 100000
+PRICE_SCALE = 100000
+
+def to_rupiah(value):
+    """Convert a Shopee API price to integer rupiah (None stays None)."""
+    if value is None or value < 0:
+        return None
+    return int(value) // PRICE_SCALE
+
+def pick_fields(record, fields):
+    """Keep only the requested top-level fields (all when `fields` is empty)."""
+    if not fields:
+        return record
+    return {key: record[key] for key in fields if key in record}
+
+def project_product(item, fields=None):
+    """Map a Shopee item (item/get `data` or search `item_basic`) to the compact schema."""
+    rating = item.get('item_rating') or {}
+    rating_counts = rating.get('rating_count') or []
+    itemid = item.get('itemid')
+    shopid = item.get('shopid')
+    discount = item.get('raw_discount')
+    if discount is None:
+        discount = item.get('show_discount')
+    
+    product = {
+        'schema': SCHEMA_VERSION,
+        'itemid': itemid,
+        'shopid': shopid,
+        'name': item.get('name') or item.get('title'),
+        'url': f'https://shopee.co.id/product/{shopid}/{itemid}',
+        'price': to_rupiah(item.get('price')),
+        'price_min': to_rupiah(item.get('price_min')),
+        'price_max': to_rupiah(item.get('price_max')),
+        'price_before_discount': to_rupiah(item.get('price_before_discount')) or None,
+        'discount_pct': discount or 0,
+        'rating': round(rating.get('rating_star') or 0, 2),
+        'rating_count': rating_counts[0] if rating_counts else 0,
+        'sold': item.get('sold'),
+        'historical_sold': item.get('historical_sold'),
+        'stock': item.get('stock'),
+        'liked': item.get('liked_count'),
+        'brand': item.get('brand') or None,
+        'image': item.get('image'),
+        'shop': {
+            'location': item.get('shop_location'),
+            'official': bool(item.get('is_official_shop') or item.get('show_official_shop_label')),
+            'preferred': bool(item.get('shopee_verified') or item.get('is_preferred_plus_seller')),
+        },
+        'variations': [
+            {
+                'modelid': model.get('modelid'),
+                'name': model.get('name'),
+                'price': to_rupiah(model.get('price')),
+                'stock': model.get('stock'),
+            }
+            for model in item.get('models') or []
+        ],
+    }
+    return pick_fields(product, fields)
+
+def project_item(payload, fields=None):
+    """Compact form of an item/get response; None when Shopee returned no item."""
+    item = payload.get('data') or payload.get('item')
+    if not item:
+        return None
+    return project_product(item, fields)
+
+def project_search_item(item, fields=None):
+    """Compact form of one search_items entry."""
+    return project_product(item.get('item_basic') or item, fields)
+
+def project_search(payload, fields=None):
+    return {
+        'schema': SCHEMA_VERSION,
+        'total_count': payload.get('total_count'),
+        'nomore': bool(payload.get('nomore')),
+        'items': [project_search_item(item, fields) for item in payload.get('items') or []],
+    }
+
+def project_rating(rating, fields=None):
+    """Map one Shopee rating record to the compact schema."""
+    record = {
+        'schema': SCHEMA_VERSION,
+        'star': rating.get('rating_star'),
+        'comment': rating.get('comment') or '',
+        'author': rating.get('author_username'),
+        'ctime': rating.get('ctime'),
+        'variation': ', '.join(
+            product.get('model_name') for product in rating.get('product_items') or []
+            if product.get('model_name')
+        ) or None,
+        'images': len(rating.get('images') or []),
+        'videos': len(rating.get('videos') or []),
+        'likes': rating.get('like_count') or 0,
+    }
+    return pick_fields(record, fields)
+
+def project_ratings(payload, fields=None):
+    data = payload.get('data') or {}
+    summary = data.get('item_rating_summary') or {}
+    counts = summary.get('rating_count') or []
+    return {
+        'schema': SCHEMA_VERSION,
+        'total': summary.get('rating_total'),
+        'stars': counts[1:6] if len(counts) >= 6 else None,
+        'ratings': [project_rating(rating, fields) for rating in data.get('ratings') or []],
+    }
+
+def projection_args():
+    """
+    Read format/fields query params.
+    Returns (compact, fields); `fields=` implies the compact format.
+    """
+    fmt = request.args.get('format', 'full')
+    if fmt not in ('full', 'compact'):
+        raise ValueError('format must be full or compact')
+    fields = [f.strip() for f in request.args.get('fields', '').split(',') if f.strip()]
+    return fmt == 'compact' or bool(fields), fields
+
+# ============================================================================
+# SNAPSHOT STORE
+# ============================================================================
+
+SNAPSHOT_SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    id INTEGER PRIMARY KEY,
+    shopid INTEGER NOT NULL,
+    itemid INTEGER NOT NULL,
+    fetched_at REAL NOT NULL,
+    source TEXT NOT NULL,
+    name TEXT,
+    price INTEGER,
+    price_before_discount INTEGER,
+    rating REAL,
+    sold INTEGER,
+    historical_sold INTEGER,
+    stock INTEGER,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_snapshots_item ON snapshots (shopid, itemid, fetched_at);
+
+-- One row per price change; modelid 0 is the item-level price
+CREATE TABLE IF NOT EXISTS price_history (
+    shopid INTEGER NOT NULL,
+    itemid INTEGER NOT NULL,
+    modelid INTEGER NOT NULL,
+    name TEXT,
+    price INTEGER NOT NULL,
+    stock INTEGER,
+    recorded_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_price_item ON price_history (shopid, itemid, modelid, recorded_at);
+CREATE INDEX IF NOT EXISTS idx_price_time ON price_history (modelid, recorded_at);
+"""
+
+class SnapshotStore:
+    """
+    Embedded SQLite (WAL) store of product snapshots and price history.
+    Request threads only enqueue compact products; a background writer
+    commits them in batches so disk I/O stays off the request path.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.queue = queue.Queue(maxsize=SNAPSHOT_QUEUE_MAX)
+        self.readers = local()
+        self.stats = {'queued': 0, 'written': 0, 'price_changes': 0, 'dropped': 0, 'errors': 0}
+        self.stats_lock = Lock()
+        self.started = False
+        self.start_lock = Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def _ensure_started(self):
+        if self.started:
+            return
+        with self.start_lock:
+            if self.started:
+                return
+            conn = self._connect()
+            conn.executescript(SNAPSHOT_SCHEMA)
+            conn.close()
+            Thread(target=self._writer, daemon=True, name='snapshot-writer').start()
+            self.started = True
+
+    def record(self, products, source):
+        """Queue compact products for writing; never blocks the caller."""
+        self._ensure_started()
+        fetched_at = time.time()
+        queued = dropped = 0
+        for product in products:
+            if not product or not product.get('itemid') or not product.get('shopid'):
+                continue
+            try:
+                self.queue.put_nowait((product, source, fetched_at))
+                queued += 1
+            except queue.Full:
+                dropped += 1
+        with self.stats_lock:
+            self.stats['queued'] += queued
+            self.stats['dropped'] += dropped
+
+    def _writer(self):
+        conn = self._connect()
+        while True:
+            batch = [self.queue.get()]
+            flush_at = time.time() + SNAPSHOT_FLUSH_INTERVAL
+            while len(batch) < SNAPSHOT_BATCH_SIZE:
+                remaining = flush_at - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                with conn:
+                    changes = sum(self._write(conn, product, source, fetched_at) for product, source, fetched_at in batch)
+                with self.stats_lock:
+                    self.stats['written'] += len(batch)
+                    self.stats['price_changes'] += changes
+            except sqlite3.Error as e:
+                with self.stats_lock:
+                    self.stats['errors'] += 1
+                print(f'[Snapshots] Write failed ({len(batch)} snapshots): {e}')
+
+    def _write(self, conn, product, source, fetched_at):
+        """Insert one snapshot plus any price change points; returns the number of changes."""
+        shopid, itemid = product['shopid'], product['itemid']
+        conn.execute(
+            'INSERT INTO snapshots (shopid, itemid, fetched_at, source, name, price, '
+            'price_before_discount, rating, sold, historical_sold, stock, data) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (shopid, itemid, fetched_at, source, product.get('name'), product.get('price'),
+             product.get('price_before_discount'), product.get('rating'), product.get('sold'),
+             product.get('historical_sold'), product.get('stock'), json.dumps(product, ensure_ascii=False))
+        )
+        prices = [(0, None, product.get('price'), product.get('stock'))]
+        prices += [
+            (v.get('modelid'), v.get('name'), v.get('price'), v.get('stock'))
+            for v in product.get('variations') or [] if v.get('modelid')
+        ]
+        changes = 0
+        for modelid, name, price, stock in prices:
+            if price is None:
+                continue
+            last = conn.execute(
+                'SELECT price FROM price_history WHERE shopid = ? AND itemid = ? AND modelid = ? '
+                'ORDER BY recorded_at DESC LIMIT 1',
+                (shopid, itemid, modelid)
+            ).fetchone()
+            if last is not None and last['price'] == price:
+                continue
+            conn.execute(
+                'INSERT INTO price_history (shopid, itemid, modelid, name, price, stock, recorded_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (shopid, itemid, modelid, name, price, stock, fetched_at)
+            )
+            changes += 1
+        return changes
+
+    def _reader(self):
+        self._ensure_started()
+        conn = getattr(self.readers, 'conn', None)
+        if conn is None:
+            conn = self.readers.conn = self._connect()
+        return conn
+
+    def latest(self, shopid, itemid):
+        """Most recent snapshot of an item, or None."""
+        row = self._reader().execute(
+            'SELECT fetched_at, source, data FROM snapshots WHERE shopid = ? AND itemid = ? '
+            'ORDER BY fetched_at DESC LIMIT 1',
+            (shopid, itemid)
+        ).fetchone()
+        if row is None:
+            return None
+        return {'fetched_at': row['fetched_at'], 'source': row['source'], 'product': json.loads(row['data'])}
+
+    def price_history(self, shopid, itemid, modelid=None, since=0):
+        """Price change points per variation (modelid 0 = item level)."""
+        query = ('SELECT modelid, name, price, stock, recorded_at FROM price_history '
+                 'WHERE shopid = ? AND itemid = ? AND recorded_at >= ?')
+        args = [shopid, itemid, since]
+        if modelid is not None:
+            query += ' AND modelid = ?'
+            args.append(modelid)
+        query += ' ORDER BY modelid, recorded_at'
+        history = {}
+        for row in self._reader().execute(query, args):
+            series = history.setdefault(row['modelid'], {'modelid': row['modelid'], 'name': row['name'], 'points': []})
+            series['points'].append({'price': row['price'], 'stock': row['stock'], 'at': row['recorded_at']})
+        return list(history.values())
+
+    def price_drops(self, since, min_pct, limit):
+        """Items whose latest item-level price is at least min_pct below their high since `since`."""
+        rows = self._reader().execute(
+            """
+            WITH latest AS (
+                SELECT p.shopid, p.itemid, p.price, p.recorded_at FROM price_history p
+                WHERE p.modelid = 0 AND p.recorded_at = (
+                    SELECT MAX(q.recorded_at) FROM price_history q
+                    WHERE q.shopid = p.shopid AND q.itemid = p.itemid AND q.modelid = 0
+                )
+            ), in_window AS (
+                -- Change points inside the window, plus the price already in effect when it opened
+                SELECT shopid, itemid, price, 1 AS changed FROM price_history
+                WHERE modelid = 0 AND recorded_at >= ?
+                UNION ALL
+                SELECT p.shopid, p.itemid, p.price, 0 FROM price_history p
+                WHERE p.modelid = 0 AND p.recorded_at = (
+                    SELECT MAX(q.recorded_at) FROM price_history q
+                    WHERE q.shopid = p.shopid AND q.itemid = p.itemid AND q.modelid = 0 AND q.recorded_at < ?
+                )
+            ), recent AS (
+                SELECT shopid, itemid, MAX(price) AS high, MIN(price) AS low, SUM(changed) AS changes
+                FROM in_window GROUP BY shopid, itemid
+            )
+            SELECT l.shopid, l.itemid, l.price, l.recorded_at, r.high, r.low, r.changes,
+                   (r.high - l.price) * 100.0 / r.high AS drop_pct,
+                   (SELECT s.name FROM snapshots s WHERE s.shopid = l.shopid AND s.itemid = l.itemid
+                    ORDER BY s.fetched_at DESC LIMIT 1) AS name
+            FROM latest l JOIN recent r ON r.shopid = l.shopid AND r.itemid = l.itemid
+            WHERE r.high > 0 AND (r.high - l.price) * 100.0 / r.high >= ?
+            ORDER BY drop_pct DESC LIMIT ?
+            """,
+            (since, since, min_pct, limit)
+        ).fetchall()
+        return [dict(row, drop_pct=round(row['drop_pct'], 1)) for row in rows]
+
+    def snapshot(self):
+        with self.stats_lock:
+            return dict(self.stats, pending=self.queue.qsize(), path=self.path)
+
+snapshot_store = SnapshotStore(SNAPSHOT_DB)
+
+def item_request(itemid, shopid):
+    """Build the upstream URL and headers for item details."""
+    url = f'{SHOPEE_BASE_URL}/api/v4/item/get?itemid={itemid}&shopid={shopid}'
+    
+    # Set proper referer for this request
+    headers = {
+        'Referer': f'https://shopee.co.id/product-i.{shopid}.{itemid}',
+        'X-Shopee-Language': 'id',
+        'X-Requested-With': 'XMLHttpRequest',
+        'X-API-SOURCE': 'pc',
+    }
+    return url, headers
+
+def load_item(itemid, shopid, retry_blocked=True):
+    """Fetch item details through the response cache."""
+    url, headers = item_request(itemid, shopid)
+    
+    def loader():
+        data, size = fetch_upstream(url, headers, 'item', retry_blocked)
+        snapshot_store.record([project_item(data)], 'item')
+        return data, size
+    
+    return response_cache.fetch('item', {'itemid': itemid, 'shopid': shopid}, loader)
+
+def ratings_request(itemid, shopid, limit, offset=0, star=0):
+    """Build the upstream URL and headers for one page of ratings (star 0 = all)."""
+    url = f'{SHOPEE_BASE_URL}/api/v2/item/get_ratings?itemid={itemid}&shopid={shopid}&limit={limit}&offset={offset}&type={star}'
+    
+    headers = {
+        'Referer': f'https://shopee.co.id/product-i.{shopid}.{itemid}',
+        'X-Shopee-Language': 'id',
+        'X-Requested-With': 'XMLHttpRequest',
+        'X-API-SOURCE': 'pc',
+    }
+    return url, headers
+
+def search_request(keyword, limit, page=0, filters=None):
+    """Build the upstream URL and headers for one page of search results."""
+    filters = filters or {}
+    params = [('by', filters['by'])] if 'by' in filters else []
+    params += [('keyword', keyword), ('limit', limit)]
+    if page:
+        params.append(('newest', int(limit) * page))
+    params.append(('order', filters.get('order', 'desc')))
+    params += [('page_type', 'search'), ('scenario', 'PAGE_GLOBAL_SEARCH'), ('version', 2)]
+    params += [(name, filters[name]) for name in ('price_min', 'price_max') if name in filters]
+    url = f'{SHOPEE_BASE_URL}/api/v4/search/search_items?{urlencode(params)}'
+    
+    headers = {
+        'Referer': f'https://shopee.co.id/search?keyword={quote(keyword)}',
+        'X-Shopee-Language': 'id',
+        'X-Requested-With': 'XMLHttpRequest',
+        'X-API-SOURCE': 'pc',
+    }
+    return url, headers
+
+def load_search_page(keyword, limit, page=0, filters=None):
+    """Fetch one page of search results through the response cache."""
+    filters = filters or {}
+    url, headers = search_request(keyword, limit, page, filters)
+    
+    def loader():
+        data, size = fetch_upstream(url, headers, 'search')
+        snapshot_store.record([project_search_item(item) for item in data.get('items') or []], 'search')
+        return data, size
+    
+    return response_cache.fetch('search', dict(filters, keyword=keyword, limit=limit, page=page), loader)
+
+def load_item_timed(itemid, shopid, retry_blocked=True):
+    """load_item() for worker threads; returns (data, queue_wait_seconds)."""
+    reset_queue_wait()
+    return load_item(itemid, shopid, retry_blocked), get_queue_wait()
+
+def route_label():
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+@app.before_request
+def before_request():
+    reset_queue_wait()
+    request.started_at = time.time()
+    metrics.inc('proxy_requests_in_flight', (('route', route_label()),))
+
+@app.after_request
+def record_request_metrics(response):
+    route = (('route', route_label()),)
+    metrics.inc('proxy_requests_total', route + (('method', request.method), ('status', str(response.status_code))))
+    metrics.observe('proxy_request_duration_seconds', route, time.time() - request.started_at)
+    if not response.is_streamed and response.content_length:
+        metrics.inc('proxy_response_bytes_total', route, response.content_length)
+    return response
+
+@app.teardown_request
+def finish_request_metrics(exc):
+    if hasattr(request, 'started_at'):
+        metrics.inc('proxy_requests_in_flight', (('route', route_label()),), -1)
+
+@app.after_request
+def add_queue_wait_header(response):
+    """Expose time spent queueing for upstream rate limits."""
+    if request.path.startswith('/api/'):
+        response.headers['X-Queue-Wait-Ms'] = str(round(get_queue_wait() * 1000))
+    return response
+
+def choose_encoding(accept_encoding):
+    """Pick 'br' or 'gzip' from an Accept-Encoding header (None = send identity)."""
+    accepted = set()
+    for part in (accept_encoding or '').lower().split(','):
+        coding, _, params = part.strip().partition(';')
+        if params.replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+        accepted.add(coding.strip())
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
+
+def compress_body(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+def body_etag(body):
+    """Weak content-hash ETag (weak because the same JSON may be sent gzip or br)."""
+    return 'W/"' + hashlib.sha1(body).hexdigest() + '"'
+
+@app.after_request
+def add_etag_and_compress(response):
+    """
+    Tag JSON bodies with a content-hash ETag (If-None-Match -> 304) and
+    compress large ones when the client accepts br or gzip.
+    """
+    if (response.status_code != 200 or response.is_streamed or response.direct_passthrough
+            or response.mimetype != 'application/json' or 'Content-Encoding' in response.headers):
+        return response
+    
+    body = response.get_data()
+    if request.method == 'GET':
+        response.headers['ETag'] = body_etag(body)
+        response = response.make_conditional(request)
+        if response.status_code == 304:
+            return response
+    
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding(request.headers.get('Accept-Encoding'))
+    if encoding and len(body) >= COMPRESS_MIN_BYTES:
+        response.set_data(compress_body(body, encoding))
+        response.headers['Content-Encoding'] = encoding
+    return response
 
 @app.route('/health', methods=['GET'])
 def health():
@@ -49,20 +1362,60 @@ def health():
     return jsonify({
         'status': 'ok', 
         'service': 'shopee-proxy',
-        'cookies': len(session.cookies)
+        'cookies': session_pool.total_cookies(),
+        'session_pool': session_pool.snapshot(),
+        'cache': response_cache.snapshot(),
+        'upstream_validators': upstream_validators.snapshot(),
+        'rate_limits': {name: limiter.snapshot() for name, limiter in rate_limiters.items()},
+        'snapshots': snapshot_store.snapshot(),
+        'recording': fixture_recorder and {'dir': SHOPEE_RECORD_DIR, 'saved': fixture_recorder.saved},
+        'coalescing': {
+            'upstream': upstream_flight.snapshot(),
+            'session_init': session_flight.snapshot()
+        }
     })
 
+def shared_scrape_samples():
+    """Cache and rate-limit samples read at scrape time (shared with async_server)."""
+    cache = response_cache.snapshot()
+    for key in ('hits', 'stale_hits', 'misses', 'refreshes', 'evictions'):
+        yield ('proxy_cache_events_total', 'counter', 'Response cache events', (('event', key),), cache[key])
+    yield ('proxy_cache_bytes', 'gauge', 'Bytes held by the response cache', (), cache['bytes'])
+    for name, limiter in rate_limiters.items():
+        stats = limiter.snapshot()
+        yield ('shopee_rate_limit_rps', 'gauge', 'Current adaptive rate limit', (('family', name),), stats['rate'])
+        yield ('shopee_rate_limit_wait_seconds_total', 'counter', 'Time spent queueing for rate limits', (('family', name),), stats['wait_seconds'])
+
+def scrape_time_samples():
+    """Gauges and counters read from component stats when /metrics is scraped."""
+    yield from shared_scrape_samples()
+    for name, flight in (('upstream', upstream_flight), ('session_init', session_flight)):
+        stats = flight.snapshot()
+        yield ('proxy_coalesced_calls_total', 'counter', 'Calls that joined an in-flight call', (('flight', name),), stats['coalesced'])
+    pool = session_pool.snapshot()
+    for key in ('quarantines', 'refreshes', 'waits'):
+        yield ('shopee_session_pool_events_total', 'counter', 'Session pool events', (('event', key),), pool[key])
+    for pooled in pool['sessions']:
+        labels = (('session', pooled['id']),)
+        yield ('shopee_session_score', 'gauge', 'Session health score', labels, pooled['score'])
+        yield ('shopee_session_in_flight', 'gauge', 'Requests in flight per session', labels, pooled['in_flight'])
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus text-format metrics."""
+    return Response(metrics.render(scrape_time_samples()), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/init', methods=['GET'])
 def api_init():
-    """Manually reinitialize the session."""
+    """Manually reinitialize all pooled sessions."""
     success = init_session()
-    return jsonify({'success': success, 'cookies': len(session.cookies)})
+    return jsonify({'success': success, 'cookies': session_pool.total_cookies()})
 
 @app.route('/api/item', methods=['GET'])
 def get_item():
     """
     Proxy for Shopee item details API.
-    Query params: itemid, shopid
+    Query params: itemid, shopid, format (full|compact), fields (comma list, implies compact)
     """
     itemid = request.args.get('itemid')
     shopid = request.args.get('shopid')
@@ -70,42 +1423,111 @@ def get_item():
     if not itemid or not shopid:
         return jsonify({'error': 'Missing itemid or shopid'}), 400
     
-    # Ensure we have cookies
-    if len(session.cookies) == 0:
-        init_session()
-    
-    url = f'https://shopee.co.id/api/v4/item/get?itemid={itemid}&shopid={shopid}'
-    
-    # Set proper referer for this request
-    headers = {
-        'Referer': f'https://shopee.co.id/product-i.{shopid}.{itemid}',
-        'X-Shopee-Language': 'id',
-        'X-Requested-With': 'XMLHttpRequest',
-        'X-API-SOURCE': 'pc',
-    }
+    try:
+        compact, fields = projection_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
     try:
-        response = session.get(url, headers=headers, timeout=15)
-        
-        # If forbidden, try refreshing cookies and retry
-        if response.status_code == 403:
-            print('[Proxy] Got 403, refreshing session...')
-            init_session()
-            time.sleep(0.5)
-            response = session.get(url, headers=headers, timeout=15)
-        
-        response.raise_for_status()
-        return jsonify(response.json())
+        data = load_item(itemid, shopid)
+        if not compact:
+            return jsonify(data)
+        product = project_item(data, fields)
+        if product is None:
+            return jsonify({'error': 'Item not found', 'upstream_error': data.get('error')}), 404
+        return jsonify(product)
     except requests.HTTPError as e:
         return jsonify({'error': f'HTTP {e.response.status_code}: {str(e)}'}), e.response.status_code
     except requests.RequestException as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/items', methods=['POST'])
+def get_items():
+    """
+    Batch proxy for Shopee item details API.
+    JSON body: {"items": [{"itemid": X, "shopid": Y}, ...]} (or [[X, Y], ...])
+    Query params: format (full|compact), fields (comma list, implies compact)
+    Returns per-item results in request order; failures carry their own error.
+    """
+    try:
+        compact, fields = projection_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    body = request.get_json(silent=True) or {}
+    raw_items = body.get('items') if isinstance(body, dict) else body
+    
+    if not isinstance(raw_items, list) or not raw_items:
+        return jsonify({'error': 'Missing items list'}), 400
+    if len(raw_items) > BATCH_MAX_ITEMS:
+        return jsonify({'error': f'Too many items (max {BATCH_MAX_ITEMS})'}), 400
+    
+    pairs = []
+    for raw in raw_items:
+        if isinstance(raw, dict):
+            pairs.append((raw.get('itemid'), raw.get('shopid')))
+        elif isinstance(raw, (list, tuple)) and len(raw) == 2:
+            pairs.append((raw[0], raw[1]))
+        else:
+            pairs.append((None, None))
+    
+    results = [None] * len(pairs)
+    
+    def run_pass(indexes):
+        """Fetch the given items concurrently; return indexes that got 403."""
+        futures = {
+            # 403s are retried once for the whole batch below; other failures back off per item
+            i: batch_executor.submit(load_item_timed, pairs[i][0], pairs[i][1], False)
+            for i in indexes
+        }
+        blocked = []
+        for i, future in futures.items():
+            itemid, shopid = pairs[i]
+            try:
+                data, waited = future.result()
+                # Items queue in parallel, so the batch waited as long as its slowest item
+                queue_wait.seconds = max(get_queue_wait(), waited)
+                if compact:
+                    data = project_item(data, fields)
+                    if data is None:
+                        results[i] = {'itemid': itemid, 'shopid': shopid, 'error': 'Item not found', 'status': 404}
+                        continue
+                results[i] = {'itemid': itemid, 'shopid': shopid, 'data': data}
+            except requests.HTTPError as e:
+                status = e.response.status_code
+                if status == 403:
+                    blocked.append(i)
+                results[i] = {'itemid': itemid, 'shopid': shopid, 'error': f'HTTP {status}: {str(e)}', 'status': status}
+            except requests.RequestException as e:
+                results[i] = {'itemid': itemid, 'shopid': shopid, 'error': str(e), 'status': 500}
+        return blocked
+    
+    valid = []
+    for i, (itemid, shopid) in enumerate(pairs):
+        if itemid and shopid:
+            valid.append(i)
+        else:
+            results[i] = {'itemid': itemid, 'shopid': shopid, 'error': 'Missing itemid or shopid', 'status': 400}
+    
+    blocked = run_pass(valid)
+    
+    # Retry only the blocked items, once for the whole batch; the blocked
+    # sessions are already quarantined, so this pass runs on healthy ones
+    if blocked:
+        print(f'[Proxy] Got 403 on {len(blocked)} batch item(s), retrying on other sessions...')
+        run_pass(blocked)
+    
+    return jsonify({
+        'results': results,
+        'ok': sum(1 for r in results if 'data' in r),
+        'failed': sum(1 for r in results if 'error' in r),
+    })
+
 @app.route('/api/ratings', methods=['GET'])
 def get_ratings():
     """
     Proxy for Shopee ratings API.
-    Query params: itemid, shopid, limit (default 5)
+    Query params: itemid, shopid, limit (default 5), format (full|compact), fields
     """
     itemid = request.args.get('itemid')
     shopid = request.args.get('shopid')
@@ -114,40 +1536,121 @@ def get_ratings():
     if not itemid or not shopid:
         return jsonify({'error': 'Missing itemid or shopid'}), 400
     
-    # Ensure we have cookies
-    if len(session.cookies) == 0:
-        init_session()
-    
-    url = f'https://shopee.co.id/api/v2/item/get_ratings?itemid={itemid}&shopid={shopid}&limit={limit}&offset=0&type=0'
+    try:
+        compact, fields = projection_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    headers = {
-        'Referer': f'https://shopee.co.id/product-i.{shopid}.{itemid}',
-        'X-Shopee-Language': 'id',
-        'X-Requested-With': 'XMLHttpRequest',
-        'X-API-SOURCE': 'pc',
-    }
+    url, headers = ratings_request(itemid, shopid, limit)
     
     try:
-        response = session.get(url, headers=headers, timeout=15)
-        
-        if response.status_code == 403:
-            print('[Proxy] Got 403 on ratings, refreshing session...')
-            init_session()
-            time.sleep(0.5)
-            response = session.get(url, headers=headers, timeout=15)
-            
-        response.raise_for_status()
-        return jsonify(response.json())
+        data = response_cache.fetch(
+            'ratings', {'itemid': itemid, 'shopid': shopid, 'limit': limit},
+            lambda: fetch_upstream(url, headers, 'ratings')
+        )
+        return jsonify(project_ratings(data, fields) if compact else data)
     except requests.HTTPError as e:
         return jsonify({'error': f'HTTP {e.response.status_code}: {str(e)}'}), e.response.status_code
     except requests.RequestException as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/ratings/all', methods=['GET'])
+def get_all_ratings():
+    """
+    Stream every rating of a product as NDJSON (one rating object per line).
+    Query params: itemid, shopid, max (default 200), stars (e.g. "1,2"; 0 or omitted = all),
+    format (full|compact), fields
+    Pages are fetched concurrently under the ratings rate limit and written as
+    they arrive, so arrival order is not guaranteed. Failed pages produce an
+    {"error": ...} line; the last line is {"done": true, "count": N}.
+    """
+    itemid = request.args.get('itemid')
+    shopid = request.args.get('shopid')
+    
+    if not itemid or not shopid:
+        return jsonify({'error': 'Missing itemid or shopid'}), 400
+    
+    try:
+        cap = min(int(request.args.get('max', RATINGS_DEFAULT_MAX)), RATINGS_MAX_CAP)
+        stars = [int(s) for s in request.args.get('stars', '').split(',') if s.strip()] or [0]
+    except ValueError:
+        return jsonify({'error': 'max and stars must be integers'}), 400
+    if any(star < 0 or star > 5 for star in stars):
+        return jsonify({'error': 'stars must be between 0 and 5 (0 = all)'}), 400
+    
+    try:
+        compact, fields = projection_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    def fetch_page(star, offset):
+        url, headers = ratings_request(itemid, shopid, RATINGS_PAGE_SIZE, offset, star)
+        data, _ = fetch_upstream(url, headers, 'ratings')
+        return (data.get('data') or {})
+    
+    def generate():
+        count = 0
+        pending = set()
+        try:
+            for star in dict.fromkeys(stars):
+                if count >= cap:
+                    break
+                try:
+                    first = fetch_page(star, 0)
+                except requests.RequestException as e:
+                    yield ndjson_line({'error': str(e), 'star': star, 'offset': 0})
+                    continue
+                
+                for rating in (first.get('ratings') or [])[:cap - count]:
+                    count += 1
+                    yield ndjson_line(project_rating(rating, fields) if compact else rating)
+                
+                # Size the remaining offsets from the rating summary on the first page
+                summary = first.get('item_rating_summary') or {}
+                per_star = summary.get('rating_count') or []
+                total = per_star[star] if 0 < star < len(per_star) else summary.get('rating_total', 0)
+                end = min(total or 0, RATINGS_PAGE_SIZE + cap - count)
+                offsets = iter(range(RATINGS_PAGE_SIZE, end, RATINGS_PAGE_SIZE))
+                
+                while True:
+                    # Keep a bounded window of pages in flight
+                    for offset in offsets:
+                        future = batch_executor.submit(fetch_page, star, offset)
+                        future.offset = offset
+                        pending.add(future)
+                        if len(pending) >= RATINGS_PAGE_WINDOW:
+                            break
+                    if not pending:
+                        break
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        try:
+                            page = future.result()
+                        except requests.RequestException as e:
+                            yield ndjson_line({'error': str(e), 'star': star, 'offset': future.offset})
+                            continue
+                        for rating in (page.get('ratings') or [])[:cap - count]:
+                            count += 1
+                            yield ndjson_line(project_rating(rating, fields) if compact else rating)
+            
+            yield ndjson_line({'done': True, 'count': count})
+        finally:
+            # Client went away or we finished; drop pages not yet started
+            for future in pending:
+                future.cancel()
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
 @app.route('/api/search', methods=['GET'])
 def search():
     """
     Proxy for Shopee search API.
-    Query params: keyword, limit (default 20)
+    Query params: keyword, limit (default 20), pages (default 1, max 5),
+    by (relevancy|ctime|sales|price), order (asc|desc), price_min, price_max,
+    format (full|compact), fields (comma list, implies compact)
+    With pages > 1 the pages are fetched in parallel and streamed as NDJSON in
+    page order: {"page": N, "items": [...], "nomore": bool} with items already
+    seen on earlier pages removed, then {"done": true, "count": N}.
     """
     keyword = request.args.get('keyword')
     limit = request.args.get('limit', '20')
@@ -155,43 +1658,151 @@ def search():
     if not keyword:
         return jsonify({'error': 'Missing keyword'}), 400
     
-    # Ensure we have cookies
-    if len(session.cookies) == 0:
-        init_session()
-    
-    url = f'https://shopee.co.id/api/v4/search/search_items?keyword={keyword}&limit={limit}&order=desc&page_type=search&scenario=PAGE_GLOBAL_SEARCH&version=2'
-    
-    headers = {
-        'Referer': f'https://shopee.co.id/search?keyword={keyword}',
-        'X-Shopee-Language': 'id',
-        'X-Requested-With': 'XMLHttpRequest',
-        'X-API-SOURCE': 'pc',
+    filters = {
+        name: request.args[name]
+        for name in ('by', 'order', 'price_min', 'price_max')
+        if request.args.get(name)
     }
+    if filters.get('by', 'relevancy') not in SEARCH_SORTS:
+        return jsonify({'error': f'by must be one of: {", ".join(SEARCH_SORTS)}'}), 400
+    if filters.get('order', 'desc') not in ('asc', 'desc'):
+        return jsonify({'error': 'order must be asc or desc'}), 400
+    try:
+        pages = int(request.args.get('pages', 1))
+        int(limit)
+        for name in ('price_min', 'price_max'):
+            if name in filters:
+                int(filters[name])
+    except ValueError:
+        return jsonify({'error': 'pages, limit and prices must be integers'}), 400
+    if pages < 1 or pages > SEARCH_MAX_PAGES:
+        return jsonify({'error': f'pages must be between 1 and {SEARCH_MAX_PAGES}'}), 400
     
     try:
-        response = session.get(url, headers=headers, timeout=15)
-        
-        if response.status_code == 403:
-            print('[Proxy] Got 403 on search, refreshing session...')
-            init_session()
-            time.sleep(0.5)
-            response = session.get(url, headers=headers, timeout=15)
+        compact, fields = projection_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if pages == 1:
+        try:
+            data = load_search_page(keyword, limit, 0, filters)
+            return jsonify(project_search(data, fields) if compact else data)
+        except requests.HTTPError as e:
+            return jsonify({'error': f'HTTP {e.response.status_code}: {str(e)}'}), e.response.status_code
+        except requests.RequestException as e:
+            return jsonify({'error': str(e)}), 500
+    
+    def generate():
+        futures = [
+            batch_executor.submit(load_search_page, keyword, limit, page, filters)
+            for page in range(pages)
+        ]
+        seen = set()
+        try:
+            for page, future in enumerate(futures):
+                try:
+                    data = future.result()
+                except requests.RequestException as e:
+                    yield ndjson_line({'page': page, 'error': str(e)})
+                    continue
+                
+                items = []
+                for item in data.get('items') or []:
+                    itemid = item.get('itemid') or (item.get('item_basic') or {}).get('itemid')
+                    if itemid in seen:
+                        continue
+                    seen.add(itemid)
+                    items.append(item)
+                
+                if compact:
+                    items = [project_search_item(item, fields) for item in items]
+                yield ndjson_line({
+                    'page': page,
+                    'items': items,
+                    'nomore': bool(data.get('nomore'))
+                })
+                if data.get('nomore'):
+                    break
             
-        response.raise_for_status()
-        return jsonify(response.json())
-    except requests.HTTPError as e:
-        return jsonify({'error': f'HTTP {e.response.status_code}: {str(e)}'}), e.response.status_code
-    except requests.RequestException as e:
-        return jsonify({'error': str(e)}), 500
+            yield ndjson_line({'done': True, 'count': len(seen)})
+        finally:
+            for future in futures:
+                future.cancel()
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/api/history/item', methods=['GET'])
+def history_item():
+    """
+    Latest stored snapshot of an item (no upstream call).
+    Query params: itemid, shopid
+    """
+    try:
+        itemid = int(request.args.get('itemid', ''))
+        shopid = int(request.args.get('shopid', ''))
+    except ValueError:
+        return jsonify({'error': 'Missing or invalid itemid or shopid'}), 400
+    
+    latest = snapshot_store.latest(shopid, itemid)
+    if latest is None:
+        return jsonify({'error': 'No snapshot stored for this item'}), 404
+    return jsonify(latest)
+
+@app.route('/api/history/price', methods=['GET'])
+def history_price():
+    """
+    Stored price history per variation (no upstream call).
+    Query params: itemid, shopid, modelid (optional; 0 = item level), days (default all)
+    """
+    try:
+        itemid = int(request.args.get('itemid', ''))
+        shopid = int(request.args.get('shopid', ''))
+        modelid = int(request.args['modelid']) if request.args.get('modelid') else None
+        days = float(request.args.get('days', 0))
+    except ValueError:
+        return jsonify({'error': 'itemid, shopid, modelid and days must be numbers'}), 400
+    
+    since = time.time() - days * 86400 if days else 0
+    return jsonify({
+        'itemid': itemid,
+        'shopid': shopid,
+        'variations': snapshot_store.price_history(shopid, itemid, modelid, since)
+    })
+
+@app.route('/api/history/drops', methods=['GET'])
+def history_drops():
+    """
+    Items whose latest price is well below their recent high (no upstream call).
+    Query params: min_pct (default 10), days (default 30), limit (default 50)
+    """
+    try:
+        min_pct = float(request.args.get('min_pct', 10))
+        days = float(request.args.get('days', 30))
+        limit = min(int(request.args.get('limit', 50)), 500)
+    except ValueError:
+        return jsonify({'error': 'min_pct, days and limit must be numbers'}), 400
+    
+    since = time.time() - days * 86400
+    return jsonify({'drops': snapshot_store.price_drops(since, min_pct, limit)})
 
 if __name__ == '__main__':
     print('🚀 Shopee Proxy Server v2 starting on http://localhost:8000')
     print('   Endpoints:')
-    print('   - GET /health')
-    print('   - GET /api/init (reinitialize session)')
+    print('   - GET /health (includes cache stats)')
+    print('   - GET /metrics (Prometheus text format)')
+    print('   - GET /api/init (reinitialize all pooled sessions)')
     print('   - GET /api/item?itemid=X&shopid=Y')
+    print('   - POST /api/items {"items": [{"itemid": X, "shopid": Y}, ...]}')
     print('   - GET /api/ratings?itemid=X&shopid=Y&limit=5')
+    print('   - GET /api/ratings/all?itemid=X&shopid=Y&max=200&stars=4,5 (NDJSON stream)')
     print('   - GET /api/search?keyword=X&limit=20')
+    print('   - GET /api/search?keyword=X&pages=3&by=sales&price_max=500000 (NDJSON stream)')
+    print('   - GET /api/history/item?itemid=X&shopid=Y (latest stored snapshot)')
+    print('   - GET /api/history/price?itemid=X&shopid=Y&days=30')
+    print('   - GET /api/history/drops?min_pct=10&days=30')
+    print('   Data endpoints accept format=compact or fields=a,b,c for the compact schema')
+    if fixture_recorder:
+        print(f'   Recording upstream fixtures to {SHOPEE_RECORD_DIR}')
     
     # Initialize session on startup
     init_session()
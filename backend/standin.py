@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Shopee endpoints used by the proxy.
+Returns synthetic item, ratings and search payloads (or replays fixtures
+recorded with SHOPEE_RECORD_DIR) after a configurable delay, so proxy
+engines can be benchmarked without touching shopee.co.id. Blocking can be
+simulated with random 403s and a per-second rate limit.
+
+Usage: python standin.py [--port 9000] [--latency 80] [--fixtures DIR [--fixtures-only]]
+                         [--block-rate 0.05] [--rate-limit 50 [--limit-status 429]]
+Then run a proxy with SHOPEE_BASE_URL=http://127.0.0.1:9000
+Counters are served at /__standin/stats.
+"""
+
+import argparse
+import asyncio
+import random
+import time
+
+from aiohttp import web
+
+from fixtures import FixtureStore, fixture_key
+
+PRICE_SCALE = 100000
+
+def fake_item(itemid, shopid):
+    rng = random.Random(f'{shopid}.{itemid}')
+    price = rng.randrange(10, 2000) * 1000 * PRICE_SCALE
+    return {
+        'itemid': itemid,
+        'shopid': shopid,
+        'name': f'Stand-in product {itemid}',
+        'price': price,
+        'price_min': price,
+        'price_max': price,
+        'price_before_discount': price * 2,
+        'raw_discount': 50,
+        'stock': rng.randrange(0, 500),
+        'sold': rng.randrange(0, 1000),
+        'historical_sold': rng.randrange(0, 20000),
+        'liked_count': rng.randrange(0, 5000),
+        'item_rating': {'rating_star': round(rng.uniform(3, 5), 2), 'rating_count': [100, 2, 3, 5, 20, 70]},
+        'shop_location': 'KOTA JAKARTA SELATAN',
+        'is_official_shop': rng.random() < 0.2,
+        'models': [
+            {'modelid': itemid * 10 + i, 'name': f'Variant {i}', 'price': price, 'stock': rng.randrange(0, 100)}
+            for i in range(3)
+        ],
+    }
+
+class TokenBucket:
+    """Requests per second allowed by the stand-in (None = unlimited)."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+
+    def allow(self):
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+def create_app(latency, fixtures=None, fixtures_only=False, block_rate=0.0, rate_limit=None, limit_status=429):
+    stats = {'requests': 0, 'replayed': 0, 'synthetic': 0, 'missing': 0, 'blocked': 0, 'rate_limited': 0}
+    bucket = TokenBucket(rate_limit) if rate_limit else None
+
+    async def delay():
+        if latency:
+            # +/-25% jitter around the configured latency
+            await asyncio.sleep(latency * random.uniform(0.75, 1.25))
+
+    @web.middleware
+    async def upstream_behaviour(request, handler):
+        """Rate limit, 403 injection and fixture replay for the /api/ endpoints."""
+        if not request.path.startswith('/api/'):
+            return await handler(request)
+        stats['requests'] += 1
+        if bucket and not bucket.allow():
+            stats['rate_limited'] += 1
+            return web.json_response({'error': 'rate limited'}, status=limit_status)
+        await delay()
+        if block_rate and random.random() < block_rate:
+            stats['blocked'] += 1
+            return web.json_response({'error': 90309999, 'is_customized': False}, status=403)
+        if fixtures is not None:
+            recorded = fixtures.get(fixture_key(request.path, request.query))
+            if recorded:
+                stats['replayed'] += 1
+                status, body = recorded
+                return web.Response(body=body, status=status, content_type='application/json')
+            if fixtures_only:
+                stats['missing'] += 1
+                return web.json_response({'error': 'no fixture'}, status=404)
+        stats['synthetic'] += 1
+        return await handler(request)
+
+    async def stats_view(request):
+        return web.json_response(stats)
+
+    async def home(request):
+        await delay()
+        response = web.Response(text='<html>stand-in</html>', content_type='text/html')
+        response.set_cookie('SPC_F', f'standin-{random.random()}')
+        return response
+
+    async def item(request):
+        itemid = int(request.query.get('itemid', 0))
+        shopid = int(request.query.get('shopid', 0))
+        return web.json_response({'error': None, 'data': fake_item(itemid, shopid)})
+
+    async def ratings(request):
+        offset = int(request.query.get('offset', 0))
+        limit = int(request.query.get('limit', 5))
+        total = 100
+        ratings = [
+            {'rating_star': 5 - (i % 3), 'comment': f'Review {i}', 'author_username': f'user{i}', 'ctime': 1700000000 + i}
+            for i in range(offset, min(offset + limit, total))
+        ]
+        return web.json_response({'data': {
+            'ratings': ratings,
+            'item_rating_summary': {'rating_total': total, 'rating_count': [total, 5, 5, 10, 30, 50]},
+        }})
+
+    async def search(request):
+        limit = int(request.query.get('limit', 20))
+        newest = int(request.query.get('newest', 0))
+        items = [{'itemid': i, 'item_basic': fake_item(i, 1000 + i % 7)} for i in range(newest + 1, newest + limit + 1)]
+        return web.json_response({'total_count': 1000, 'nomore': newest + limit >= 1000, 'items': items})
+
+    app = web.Application(middlewares=[upstream_behaviour])
+    app.router.add_get('/', home)
+    app.router.add_get('/__standin/stats', stats_view)
+    app.router.add_get('/api/v4/item/get', item)
+    app.router.add_get('/api/v2/item/get_ratings', ratings)
+    app.router.add_get('/api/v4/search/search_items', search)
+    return app
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Shopee upstream stand-in')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument('--latency', type=float, default=80, help='mean response delay in ms')
+    parser.add_argument('--fixtures', help='replay responses recorded with SHOPEE_RECORD_DIR from this directory')
+    parser.add_argument('--fixtures-only', action='store_true', help='404 instead of synthetic data when no fixture matches')
+    parser.add_argument('--block-rate', type=float, default=0.0, help='fraction of API requests answered with 403')
+    parser.add_argument('--rate-limit', type=float, help='API requests per second before rejecting')
+    parser.add_argument('--limit-status', type=int, default=429, help='status returned over the rate limit')
+    args = parser.parse_args()
+
+    fixtures = FixtureStore(args.fixtures).load_all() if args.fixtures else None
+    print(f'[Stand-in] Serving fake Shopee API on http://{args.host}:{args.port} (latency ~{args.latency:.0f} ms)')
+    if fixtures is not None:
+        print(f'[Stand-in] Replaying {len(fixtures)} fixtures from {args.fixtures}')
+    app = create_app(
+        args.latency / 1000,
+        fixtures=fixtures,
+        fixtures_only=args.fixtures_only,
+        block_rate=args.block_rate,
+        rate_limit=args.rate_limit,
+        limit_status=args.limit_status,
+    )
+    web.run_app(app, host=args.host, port=args.port, print=None)
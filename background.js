@@ -878,13 +878,14 @@ const RemoteConnectionManager = {
 
         let result;
         try {
-            result = await ToolExecutor.execute(tool_name, args, tabId, (current, total) => {
+            result = await ToolExecutor.execute(tool_name, args, tabId, (current, total, url) => {
                 // Send progress updates to server
                 this.emit('tool_progress', {
                     request_id,
                     name: tool_name,
                     current,
-                    total
+                    total,
+                    url
                 });
             });
         } catch (error) {
@@ -20,8 +20,52 @@ USE_SSL = os.getenv('USE_SSL', 'true').lower() == 'true'
 
 # API Keys (loaded from environment)
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY', '')
+
+# Gemini client
+GEMINI_BASE_URL = os.getenv('GEMINI_BASE_URL', 'https://generativelanguage.googleapis.com/v1beta').rstrip('/')
+GEMINI_MODEL = os.getenv('GEMINI_MODEL', 'gemini-2.5-flash')
+GEMINI_MAX_ATTEMPTS = int(os.getenv('GEMINI_MAX_ATTEMPTS', 3))   # retries only before the first byte
+
+# Gemini context caching of the stable prompt prefix (system prompt, tools, frozen history)
+PREFIX_CACHE_ENABLED = os.getenv('PREFIX_CACHE', 'on').lower() != 'off'
+PREFIX_CACHE_TTL = int(os.getenv('PREFIX_CACHE_TTL', 600))                # seconds a cached-content handle lives
+PREFIX_CACHE_MIN_TOKENS = int(os.getenv('PREFIX_CACHE_MIN_TOKENS', 2048))  # smallest prefix worth (re)caching
+
+# Context compaction: past this estimated token count, older tool results are summarized
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', 32000))
+CONTEXT_KEEP_RECENT = int(os.getenv('CONTEXT_KEEP_RECENT', 6))          # trailing messages always sent verbatim
+CONTEXT_COMPACT_TARGET = 0.5  # a compaction step goes down to this fraction of the budget (keeps the cached prefix stable between steps)
+TOOL_SUMMARY_CHARS = int(os.getenv('TOOL_SUMMARY_CHARS', 2000))          # target size of one summarized result
 SERPER_API_KEY = os.getenv('SERPER_API_KEY', '')
 
+# Serper (Google search) fan-out
+SERPER_URL = os.getenv('SERPER_URL', 'https://google.serper.dev/search')
+SERPER_CONCURRENCY = int(os.getenv('SERPER_CONCURRENCY', 5))   # sub-queries in flight at once
+SERPER_DEADLINE = float(os.getenv('SERPER_DEADLINE', 20))       # overall seconds per tool call
+
+# Shared state for multi-worker deployments: 'memory' (single worker) or redis://host:port/db
+STATE_BACKEND = os.getenv('STATE_BACKEND', 'memory')
+# Socket.IO message queue (e.g. the same redis:// URL) so emits reach sockets on other workers
+SOCKETIO_MESSAGE_QUEUE = os.getenv('SOCKETIO_MESSAGE_QUEUE', '')
+
+# Extension workers: concurrent jobs one extension accepts (it may announce its own on register)
+EXTENSION_CAPACITY = int(os.getenv('EXTENSION_CAPACITY', 1))
+# Consecutive failed/timed-out jobs before an extension is benched, and for how long (seconds)
+EXTENSION_MAX_FAILURES = 3
+EXTENSION_BENCH_SECONDS = 60
+
+# Stream delivery: chunks are coalesced per session and flushed every STREAM_FLUSH_MS
+# or once STREAM_FLUSH_BYTES are pending; while a client has more than
+# STREAM_MAX_BACKLOG queued packets the window doubles, up to STREAM_MAX_DELAY_MS
+STREAM_FLUSH_MS = int(os.getenv('STREAM_FLUSH_MS', 40))
+STREAM_FLUSH_BYTES = int(os.getenv('STREAM_FLUSH_BYTES', 2048))
+STREAM_MAX_BACKLOG = 16
+STREAM_MAX_DELAY_MS = 500
+
+# Hub-side timeouts (seconds) for requests waiting on the extension
+TOOL_TIMEOUT = float(os.getenv('TOOL_TIMEOUT', 120))
+AI_REQUEST_TIMEOUT = float(os.getenv('AI_REQUEST_TIMEOUT', 300))
+
 # Optional Auth (leave empty for no auth)
 AUTH_TOKEN = os.getenv('AUTH_TOKEN', '')
 
@@ -29,3 +73,16 @@ AUTH_TOKEN = os.getenv('AUTH_TOKEN', '')
 BASE_DIR = Path(__file__).parent
 STATIC_DIR = BASE_DIR / 'static'
 CERTS_DIR = BASE_DIR / 'certs'
+
+# Conversation store (SQLite, append-only) and in-memory hot set
+CONVERSATION_DB = os.getenv('CONVERSATION_DB', str(BASE_DIR / 'conversations.db'))
+CONVERSATION_HOT_BYTES = int(os.getenv('CONVERSATION_HOT_BYTES', 64 * 1024 * 1024))   # LRU budget for loaded sessions
+CONVERSATION_BATCH_SIZE = 200        # messages per write transaction
+CONVERSATION_FLUSH_INTERVAL = 0.2    # seconds a write may wait for its batch
+CONVERSATION_QUEUE_MAX = 10000       # queued writes before appends wait for the writer
+CONVERSATION_LOAD_WAIT = 5           # max seconds a load waits for the session's queued writes
+
+# Persistent Serper result cache (SQLite); TTL 0 disables it
+SERPER_CACHE_DB = os.getenv('SERPER_CACHE_DB', str(BASE_DIR / 'serper_cache.db'))
+SERPER_CACHE_TTL = float(os.getenv('SERPER_CACHE_TTL', 24 * 3600))
+SERPER_CACHE_MAX_BYTES = int(os.getenv('SERPER_CACHE_MAX_BYTES', 50 * 1024 * 1024))
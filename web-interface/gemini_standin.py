@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Gemini endpoints used by server_app.py.
+Serves streamGenerateContent (SSE) and cachedContents create/patch/delete,
+so the client, tool loop and prefix cache can be exercised offline.
+Latency scales with input tokens; cached tokens are billed at a discount.
+
+Usage: python gemini_standin.py [--port 9500] [--ms-per-1k-tokens 40] [--tool-rounds 2]
+                                [--answer-words 400 --word-ms 5]   # long streamed answers
+Then run the server with GEMINI_BASE_URL=http://127.0.0.1:9500/v1beta GEMINI_API_KEY=standin
+"""
+
+import argparse
+import json
+import time
+import uuid
+
+from flask import Flask, Response, jsonify, request
+
+def count_tokens(value):
+    return len(json.dumps(value, ensure_ascii=False)) // 4 + 1
+
+def create_app(base_ms, ms_per_1k_tokens, cached_discount, tool_rounds, tool_name, answer_words=0, word_ms=0):
+    app = Flask(__name__)
+    caches = {}   # name -> {body, expires}
+    stats = {'generate': 0, 'cache_hits': 0, 'prompt_tokens': 0, 'cached_tokens': 0, 'creates': 0, 'deletes': 0}
+
+    def ttl_seconds(body):
+        return float(str(body.get('ttl', '3600s')).rstrip('s'))
+
+    def cache_view(name, entry):
+        return {
+            'name': name,
+            'model': entry['body'].get('model'),
+            'expireTime': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(entry['expires'])),
+            'usageMetadata': {'totalTokenCount': entry['tokens']},
+        }
+
+    @app.route('/v1beta/cachedContents', methods=['POST'])
+    def create_cache():
+        body = request.get_json()
+        name = f'cachedContents/{uuid.uuid4().hex[:12]}'
+        caches[name] = {'body': body, 'expires': time.time() + ttl_seconds(body), 'tokens': count_tokens(body)}
+        stats['creates'] += 1
+        return jsonify(cache_view(name, caches[name]))
+
+    @app.route('/v1beta/cachedContents/<cache_id>', methods=['PATCH', 'DELETE'])
+    def update_cache(cache_id):
+        name = f'cachedContents/{cache_id}'
+        if name not in caches or caches[name]['expires'] < time.time():
+            return jsonify({'error': {'code': 404, 'message': f'{name} not found'}}), 404
+        if request.method == 'DELETE':
+            del caches[name]
+            stats['deletes'] += 1
+            return jsonify({})
+        caches[name]['expires'] = time.time() + ttl_seconds(request.get_json())
+        return jsonify(cache_view(name, caches[name]))
+
+    @app.route('/v1beta/models/<path:action>', methods=['POST'])
+    def generate(action):
+        body = request.get_json()
+        cached_contents, cached_tokens = [], 0
+        if body.get('cachedContent'):
+            entry = caches.get(body['cachedContent'])
+            if entry is None or entry['expires'] < time.time():
+                return jsonify({'error': {'code': 404, 'message': 'CachedContent not found'}}), 404
+            if 'systemInstruction' in body or 'tools' in body:
+                return jsonify({'error': {'code': 400, 'message': 'systemInstruction/tools must be in the cached content'}}), 400
+            cached_contents, cached_tokens = entry['body'].get('contents', []), entry['tokens']
+            stats['cache_hits'] += 1
+        contents = cached_contents + body.get('contents', [])
+        prompt_tokens = cached_tokens + count_tokens(body)
+        stats['generate'] += 1
+        stats['prompt_tokens'] += prompt_tokens
+        stats['cached_tokens'] += cached_tokens
+
+        # Tool rounds answered since the last plain user message
+        rounds = 0
+        for content in reversed(contents):
+            parts = content.get('parts', [])
+            if content.get('role') == 'user' and any('text' in part for part in parts):
+                break
+            if any('functionResponse' in part for part in parts):
+                rounds += 1
+
+        uncached = prompt_tokens - cached_tokens
+        delay = (base_ms + ms_per_1k_tokens * (uncached + cached_tokens * cached_discount) / 1000) / 1000
+        usage = {'promptTokenCount': prompt_tokens, 'cachedContentTokenCount': cached_tokens}
+
+        def stream():
+            time.sleep(delay)
+            if rounds < tool_rounds:
+                parts = [{'functionCall': {'name': tool_name, 'args': {'query': f'stand-in round {rounds + 1}'}}}]
+                yield f'data: {json.dumps({"candidates": [{"content": {"role": "model", "parts": parts}}], "usageMetadata": usage})}\r\n\r\n'
+                return
+            words = ['Stand-in ', 'answer ', f'after {rounds} tool rounds.']
+            words += [f' word{index}' for index in range(answer_words)]
+            for word in words:
+                if word_ms:
+                    time.sleep(word_ms / 1000)
+                yield f'data: {json.dumps({"candidates": [{"content": {"role": "model", "parts": [{"text": word}]}}]})}\r\n\r\n'
+            yield f'data: {json.dumps({"candidates": [{"finishReason": "STOP"}], "usageMetadata": usage})}\r\n\r\n'
+
+        return Response(stream(), mimetype='text/event-stream')
+
+    @app.route('/__standin/stats')
+    def stats_view():
+        return jsonify(dict(stats, live_caches=sum(1 for entry in caches.values() if entry['expires'] > time.time())))
+
+    return app
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Gemini API stand-in')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9500)
+    parser.add_argument('--base-ms', type=float, default=150, help='fixed latency per generate call')
+    parser.add_argument('--ms-per-1k-tokens', type=float, default=40, help='extra latency per 1k uncached input tokens')
+    parser.add_argument('--cached-discount', type=float, default=0.25, help='cost of a cached token relative to an uncached one')
+    parser.add_argument('--tool-rounds', type=int, default=2, help='functionCall rounds before the final answer')
+    parser.add_argument('--tool', default='serper_search', help='tool the stand-in model calls')
+    parser.add_argument('--answer-words', type=int, default=0, help='extra words streamed in the final answer, one chunk each')
+    parser.add_argument('--word-ms', type=float, default=0, help='delay between streamed answer chunks')
+    args = parser.parse_args()
+
+    print(f'[Stand-in] Serving fake Gemini API on http://{args.host}:{args.port}/v1beta')
+    app = create_app(
+        args.base_ms, args.ms_per_1k_tokens, args.cached_discount, args.tool_rounds, args.tool,
+        args.answer_words, args.word_ms
+    )
+    app.run(host=args.host, port=args.port, threaded=True)
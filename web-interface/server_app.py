@@ -13,14 +13,22 @@ Features:
 # CRITICAL: Monkey patch must happen FIRST before any other imports!
 import eventlet
 eventlet.monkey_patch()
+import eventlet.tpool
 
 import os
+import hashlib
 import json
+import queue
+import random
+import re
 import time
 import uuid
+import sqlite3
 import ssl
+import unicodedata
+from collections import OrderedDict
 from pathlib import Path
-from threading import Lock
+from threading import Condition, Event, Lock
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -30,8 +38,10 @@ from flask import Flask, render_template, request, send_from_directory, jsonify
 from flask_cors import CORS
 from flask_socketio import SocketIO, emit, join_room, leave_room
 import requests
+from requests.adapters import HTTPAdapter
 
 import config
+from state_backend import create_backend
 
 # Initialize Flask app
 app = Flask(__name__, static_folder='static', template_folder='static')
@@ -44,109 +54,344 @@ socketio = SocketIO(
     cors_allowed_origins="*",
     async_mode='eventlet',
     ping_timeout=60,
-    ping_interval=25
+    ping_interval=25,
+    message_queue=config.SOCKETIO_MESSAGE_QUEUE or None
 )
 
+# Registries shared between workers (in-process unless STATE_BACKEND is a shared store)
+state = create_backend(config.STATE_BACKEND)
+
 # ============================================================================
 # STATE MANAGEMENT
 # ============================================================================
 
+CONVERSATION_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    generation INTEGER NOT NULL DEFAULT 0,
+    last_activity REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    session_id TEXT NOT NULL,
+    generation INTEGER NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_session ON messages (session_id, generation, id);
+"""
+
+def message_record(msg):
+    """Persisted/client-visible fields of a message (drops compaction caches)."""
+    return {key: msg.get(key) for key in ('role', 'content', 'parts', 'timestamp')}
+
+def message_bytes(msg):
+    """Approximate in-memory size of a message, including its cached compact parts."""
+    return len(msg.get('content') or '') + (len(json.dumps(msg['parts'], ensure_ascii=False)) if msg.get('parts') else 0) + 64 + msg.get('compact_bytes', 0)
+
+class ConversationStore:
+    """
+    Append-only SQLite (WAL) log of conversation messages.
+    Socket handlers only enqueue; a writer greenthread commits in batches.
+    SQLite calls run on eventlet's OS thread pool (tpool) so disk I/O never
+    blocks the hub. Clearing a conversation bumps its generation instead of
+    deleting rows.
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        # Bounded: a stalled disk slows the handlers that append instead of growing memory
+        self.queue = queue.Queue(maxsize=config.CONVERSATION_QUEUE_MAX)
+        self.unwritten = {}         # session_id -> queued ops not yet committed
+        self.written_cond = Condition(Lock())
+        self.stats = {'queued': 0, 'written': 0, 'loads': 0, 'errors': 0}
+        conn = self._connect()
+        conn.executescript(CONVERSATION_SCHEMA)
+        conn.close()
+        self.reader = self._connect()
+        self.reader_lock = Lock()
+        eventlet.spawn_n(self._writer)
+    
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+    
+    def _enqueue(self, op, session_id, data):
+        with self.written_cond:
+            self.unwritten[session_id] = self.unwritten.get(session_id, 0) + 1
+        self.queue.put((op, session_id, data, time.time()))
+    
+    def append(self, session_id, msg):
+        self._enqueue('append', session_id, json.dumps(message_record(msg), ensure_ascii=False))
+        self.stats['queued'] += 1
+    
+    def clear(self, session_id):
+        self._enqueue('clear', session_id, None)
+    
+    def _writer(self):
+        conn = self._connect()
+        while True:
+            batch = [self.queue.get()]
+            flush_at = time.time() + config.CONVERSATION_FLUSH_INTERVAL
+            while len(batch) < config.CONVERSATION_BATCH_SIZE:
+                remaining = flush_at - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                eventlet.tpool.execute(self._commit, conn, batch)
+                self.stats['written'] += sum(1 for op, *_ in batch if op == 'append')
+            except sqlite3.Error as e:
+                self.stats['errors'] += 1
+                print(f'[Store] Write failed ({len(batch)} ops): {e}')
+            finally:
+                with self.written_cond:
+                    for _, session_id, _, _ in batch:
+                        self.unwritten[session_id] -= 1
+                        if not self.unwritten[session_id]:
+                            del self.unwritten[session_id]
+                    self.written_cond.notify_all()
+    
+    def _commit(self, conn, batch):
+        with conn:
+            for op, session_id, data, at in batch:
+                self._write(conn, op, session_id, data, at)
+    
+    def _write(self, conn, op, session_id, data, at):
+        conn.execute(
+            'INSERT INTO sessions (session_id, last_activity) VALUES (?, ?) '
+            'ON CONFLICT(session_id) DO UPDATE SET last_activity = excluded.last_activity',
+            (session_id, at)
+        )
+        if op == 'clear':
+            conn.execute('UPDATE sessions SET generation = generation + 1 WHERE session_id = ?', (session_id,))
+        else:
+            conn.execute(
+                'INSERT INTO messages (session_id, generation, data) '
+                'SELECT session_id, generation, ? FROM sessions WHERE session_id = ?',
+                (data, session_id)
+            )
+    
+    def load(self, session_id):
+        """Messages of the session's current generation (waits for that session's queued writes first)."""
+        with self.written_cond:
+            self.written_cond.wait_for(lambda: session_id not in self.unwritten, timeout=config.CONVERSATION_LOAD_WAIT)
+        with self.reader_lock:
+            rows = eventlet.tpool.execute(self._read, session_id)
+        self.stats['loads'] += 1
+        return [json.loads(data) for (data,) in rows]
+    
+    def _read(self, session_id):
+        return self.reader.execute(
+            'SELECT m.data FROM messages m JOIN sessions s '
+            'ON s.session_id = m.session_id AND s.generation = m.generation '
+            'WHERE m.session_id = ? ORDER BY m.id',
+            (session_id,)
+        ).fetchall()
+    
+    def snapshot(self):
+        return dict(self.stats, pending=self.queue.qsize(), path=self.path)
+
 class ConnectionManager:
     """Manages connected clients and browser extensions."""
     
-    def __init__(self):
+    def __init__(self, store=None, hot_bytes=None):
         self.lock = Lock()
         self.web_clients = {}      # sid -> {session_id, connected_at}
         self.extensions = {}        # sid -> {tab_id, connected_at}
-        self.conversations = {}     # session_id -> {messages: [], processing: bool}
+        self.conversations = OrderedDict()  # session_id -> {messages: [], processing: bool, ...}, LRU order
+        self.session_sids = {}      # session_id -> sid of its web client on this worker
         self.pending_tools = {}     # request_id -> {session_id, tool_name, resolve}
+        self.store = store
+        self.hot_bytes = hot_bytes
+        self.loaded_bytes = 0
+        self.evictions = 0
     
     def add_web_client(self, sid, session_id):
+        info = {
+            'session_id': session_id,
+            'connected_at': time.time(),
+            'worker': state.worker_id
+        }
         with self.lock:
-            self.web_clients[sid] = {
-                'session_id': session_id,
-                'connected_at': time.time()
-            }
-            if session_id not in self.conversations:
-                self.conversations[session_id] = {
-                    'messages': [],
-                    'processing': False
-                }
+            self.web_clients[sid] = info
+            self.session_sids[session_id] = sid
+        state.hset('web_clients', sid, info)
+        if state.shared:
+            state.hset('sessions', session_id, {'sid': sid, 'worker': state.worker_id})
+            # Another worker may have appended since this copy was loaded
+            self.reload_conversation(session_id)
+        self.get_conversation(session_id)
     
     def remove_web_client(self, sid):
         with self.lock:
-            if sid in self.web_clients:
-                del self.web_clients[sid]
-    
-    def add_extension(self, sid, tab_id=None):
+            info = self.web_clients.pop(sid, None)
+            if info and self.session_sids.get(info['session_id']) == sid:
+                del self.session_sids[info['session_id']]
+            else:
+                info = None
+        state.hdel('web_clients', sid)
+        if info and state.shared:
+            owner = state.hget('sessions', info['session_id'])
+            if owner and owner['sid'] == sid:
+                state.hdel('sessions', info['session_id'])
+    
+    def add_extension(self, sid, tab_id=None, capacity=None):
+        info = {
+            'tab_id': tab_id,
+            'capacity': capacity or config.EXTENSION_CAPACITY,
+            'connected_at': time.time(),
+            'worker': state.worker_id
+        }
         with self.lock:
-            self.extensions[sid] = {
-                'tab_id': tab_id,
-                'connected_at': time.time()
-            }
+            self.extensions[sid] = info
+        state.hset('extensions', sid, info)
     
     def remove_extension(self, sid):
         with self.lock:
             if sid in self.extensions:
                 del self.extensions[sid]
+        state.hdel('extensions', sid)
     
-    def get_active_extension(self):
-        """Get the first connected extension SID."""
-        with self.lock:
-            if self.extensions:
-                return list(self.extensions.keys())[0]
-            return None
+    def all_extensions(self):
+        """Extensions connected to any live worker: sid -> info."""
+        return state.live_items('extensions') if state.shared else dict(self.extensions)
+    
+    def all_web_clients(self):
+        """Web clients connected to any live worker: sid -> info."""
+        return state.live_items('web_clients') if state.shared else dict(self.web_clients)
     
     def has_extension(self):
         """Check if any extension is connected."""
-        with self.lock:
-            return len(self.extensions) > 0
+        return bool(self.all_extensions())
+    
+    @staticmethod
+    def new_conversation(messages=None):
+        messages = messages or []
+        return {
+            'messages': messages,
+            'processing': False,
+            'current_response': [],  # Streaming response chunks, joined on read
+            'progress': None,  # Current tool progress state
+            'last_activity': time.time(),
+            'bytes': sum(message_bytes(msg) for msg in messages)
+        }
     
     def get_conversation(self, session_id):
+        """Hot conversation, loaded lazily from the store when it was evicted or never loaded."""
         with self.lock:
-            if session_id not in self.conversations:
-                self.conversations[session_id] = {
-                    'messages': [],
-                    'processing': False,
-                    'current_response': '',  # Accumulates streaming response
-                    'progress': None,  # Current tool progress state
-                    'last_activity': time.time()
-                }
-            return self.conversations[session_id]
+            conv = self.conversations.get(session_id)
+            if conv is not None:
+                self.conversations.move_to_end(session_id)
+                return conv
+        
+        messages = self.store.load(session_id) if self.store else []
+        with self.lock:
+            conv = self.conversations.get(session_id)
+            if conv is None:
+                conv = self.conversations[session_id] = self.new_conversation(messages)
+                self.loaded_bytes += conv['bytes']
+                self._evict()
+            return conv
+    
+    def _evict(self):
+        """Drop least recently used idle conversations past the byte budget (lock held)."""
+        if not self.hot_bytes or self.loaded_bytes <= self.hot_bytes:
+            return
+        active = {info['session_id'] for info in self.web_clients.values()}
+        for session_id in list(self.conversations):
+            if self.loaded_bytes <= self.hot_bytes:
+                break
+            conv = self.conversations[session_id]
+            if conv['processing'] or session_id in active:
+                continue
+            del self.conversations[session_id]
+            self.loaded_bytes -= conv['bytes']
+            self.evictions += 1
+    
+    def hot_set_snapshot(self):
+        with self.lock:
+            return {
+                'sessions': len(self.conversations),
+                'bytes': self.loaded_bytes,
+                'budget': self.hot_bytes,
+                'evictions': self.evictions
+            }
             
+    def add_bytes(self, session_id, messages, size):
+        """Count `size` bytes cached on `messages` against the hot set (if still the loaded copy)."""
+        with self.lock:
+            conv = self.conversations.get(session_id)
+            if conv is not None and conv['messages'] is messages:
+                conv['bytes'] += size
+                self.loaded_bytes += size
+                self._evict()
+    
     def get_sid_for_session(self, session_id):
         """Get the current socket ID for a given session ID."""
         with self.lock:
-            for sid, info in self.web_clients.items():
-                if info['session_id'] == session_id:
-                    return sid
+            sid = self.session_sids.get(session_id)
+        if sid or not state.shared:
+            return sid
+        owner = state.hget('sessions', session_id)
+        if owner and owner['worker'] in state.live_workers():
+            return owner['sid']
         return None
     
+    def reload_conversation(self, session_id):
+        """Drop an idle hot copy so the next access reads the shared store."""
+        with self.lock:
+            conv = self.conversations.get(session_id)
+            if conv is not None and not conv['processing']:
+                del self.conversations[session_id]
+                self.loaded_bytes -= conv['bytes']
+    
     def add_message(self, session_id, role, content, parts=None):
         conv = self.get_conversation(session_id)
-        conv['messages'].append({
+        msg = {
             'role': role,
             'content': content,
             'parts': parts,
             'timestamp': time.time()
-        })
+        }
+        conv['messages'].append(msg)
         conv['last_activity'] = time.time()
+        size = message_bytes(msg)
+        with self.lock:
+            conv['bytes'] += size
+            if self.conversations.get(session_id) is conv:
+                self.loaded_bytes += size
+                self._evict()
+        if self.store:
+            self.store.append(session_id, msg)
     
     def append_stream_chunk(self, session_id, chunk):
         """Accumulate streaming response chunks."""
         conv = self.get_conversation(session_id)
         if chunk == '__CLEAR__':
-            conv['current_response'] = ''
+            conv['current_response'] = []
         else:
-            conv['current_response'] += chunk
+            conv['current_response'].append(chunk)
         conv['last_activity'] = time.time()
     
+    def current_response(self, session_id):
+        """Streamed text so far (chunks are joined once per read, not per append)."""
+        conv = self.get_conversation(session_id)
+        if len(conv['current_response']) > 1:
+            conv['current_response'] = [''.join(conv['current_response'])]
+        return conv['current_response'][0] if conv['current_response'] else ''
+    
     def finalize_response(self, session_id):
         """Save accumulated response as assistant message and clear buffer."""
         conv = self.get_conversation(session_id)
-        if conv['current_response']:
-            self.add_message(session_id, 'assistant', conv['current_response'])
-            conv['current_response'] = ''
+        response = self.current_response(session_id)
+        if response:
+            self.add_message(session_id, 'assistant', response)
+            conv['current_response'] = []
         conv['processing'] = False
         conv['progress'] = None
     
@@ -169,15 +414,548 @@ class ConnectionManager:
     def clear_conversation(self, session_id):
         with self.lock:
             if session_id in self.conversations:
-                self.conversations[session_id] = {
-                    'messages': [],
-                    'processing': False,
-                    'current_response': '',
-                    'progress': None,
-                    'last_activity': time.time()
+                self.loaded_bytes -= self.conversations[session_id]['bytes']
+            self.conversations[session_id] = self.new_conversation()
+        if self.store:
+            self.store.clear(session_id)
+
+manager = ConnectionManager(ConversationStore(config.CONVERSATION_DB), config.CONVERSATION_HOT_BYTES)
+
+class PendingRequests:
+    """
+    Requests waiting on a reply from the extension, keyed by request_id.
+    Each entry carries an Event, so the reply handler wakes its waiter
+    immediately; the waiter enforces the timeout and always removes the entry.
+    """
+    
+    def __init__(self, kind):
+        self.kind = kind
+        self.lock = Lock()
+        self.entries = {}           # request_id -> {info..., event, result}
+        self.stats = {'completed': 0, 'timed_out': 0, 'late': 0, 'forwarded': 0}
+    
+    def register(self, **info):
+        """Create a pending entry and return its request_id."""
+        request_id = str(uuid.uuid4())
+        with self.lock:
+            self.entries[request_id] = dict(info, event=Event(), result=None, started=time.time())
+        if state.shared:
+            state.hset(f'pending:{self.kind}', request_id, dict(info, worker=state.worker_id))
+        return request_id
+    
+    def get(self, request_id):
+        """Entry for a still-pending request, or None."""
+        with self.lock:
+            return self.entries.get(request_id)
+    
+    def owner(self, request_id):
+        """Worker waiting on a request that is not pending here (None if unknown)."""
+        if not state.shared or request_id is None:
+            return None
+        info = state.hget(f'pending:{self.kind}', request_id)
+        return info and info['worker']
+    
+    def resolve(self, request_id, result):
+        """Store the result and wake the waiter (on whichever worker it is). False for unknown/expired ids."""
+        with self.lock:
+            entry = self.entries.get(request_id)
+            if entry is not None and not entry['event'].is_set():
+                entry['result'] = result
+                entry['event'].set()
+                return True
+        owner = self.owner(request_id) if entry is None else None
+        if owner and owner != state.worker_id:
+            forward_to_worker(owner, {'op': 'resolve', 'kind': self.kind, 'request_id': request_id, 'result': result})
+            with self.lock:
+                self.stats['forwarded'] += 1
+            return True
+        with self.lock:
+            self.stats['late'] += 1
+        return False
+    
+    def wait(self, request_id, timeout):
+        """Block until resolved or `timeout` seconds pass; returns the result or None."""
+        entry = self.get(request_id)
+        if entry is None:
+            return None
+        completed = entry['event'].wait(timeout)
+        with self.lock:
+            self.entries.pop(request_id, None)
+            self.stats['completed' if completed else 'timed_out'] += 1
+        if state.shared:
+            state.hdel(f'pending:{self.kind}', request_id)
+        if not completed:
+            print(f'[WS] {self.kind} request {request_id} timed out after {timeout:.0f}s')
+        return entry['result'] if completed else None
+    
+    def cancel(self, request_id):
+        """Forget a request that was never sent."""
+        with self.lock:
+            self.entries.pop(request_id, None)
+        if state.shared:
+            state.hdel(f'pending:{self.kind}', request_id)
+    
+    def outstanding(self):
+        with self.lock:
+            return len(self.entries)
+    
+    def snapshot(self):
+        with self.lock:
+            oldest = min((entry['started'] for entry in self.entries.values()), default=None)
+            return dict(
+                self.stats,
+                outstanding=len(self.entries),
+                oldest_wait_seconds=round(time.time() - oldest, 1) if oldest else 0
+            )
+
+# Extension tool calls and extension-routed AI messages
+tool_requests = PendingRequests('tool')
+ai_requests = PendingRequests('ai')
+pending_registries = {'tool': tool_requests, 'ai': ai_requests}
+
+# Socket events that must run on the worker waiting for their request_id
+forwarded_handlers = {}
+
+def forward_to_worker(worker_id, message):
+    state.publish(f'worker:{worker_id}', message)
+
+def on_worker_message(message):
+    """Messages from other workers: resolved results and forwarded extension events."""
+    if message['op'] == 'resolve':
+        pending_registries[message['kind']].resolve(message['request_id'], message['result'])
+    elif message['op'] == 'event':
+        forwarded_handlers[message['event']](message['data'])
+
+def owned_by(registry, event):
+    """
+    Run the decorated extension-event handler on the worker that owns the
+    event's request_id; other workers forward the event there.
+    """
+    def decorator(handler):
+        forwarded_handlers[event] = handler
+        
+        def wrapper(data):
+            request_id = data.get('request_id')
+            if registry.get(request_id) is None:
+                owner = registry.owner(request_id)
+                if owner and owner != state.worker_id:
+                    forward_to_worker(owner, {'op': 'event', 'event': event, 'data': data})
+                    return
+            return handler(data)
+        wrapper.__name__ = handler.__name__
+        wrapper.__doc__ = handler.__doc__
+        return wrapper
+    return decorator
+
+state.subscribe(f'worker:{state.worker_id}', on_worker_message)
+state.start_heartbeat()
+
+class ExtensionScheduler:
+    """
+    Dispatches extension jobs (execute_tool / process_ai_message) to the
+    least-loaded healthy extension. Tracks in-flight jobs, capacity and a
+    latency average per extension; callers queue while every extension is
+    at capacity. Tab-state tools (TAB_STATE_TOOLS) of a session stick to the
+    extension whose tab ran its search. Stateless jobs of a disconnected
+    extension are re-sent elsewhere; tab-bound ones fail with TAB_LOST_ERROR.
+    Load and tab affinity are tracked per hub worker.
+    """
+    
+    def __init__(self):
+        self.cond = Condition(Lock())
+        self.load = {}          # sid -> {in_flight, latency, failures, benched_until, completed}
+        self.jobs = {}          # request_id -> {sid, event, payload, started, deadline, tab_session}
+        self.tabs = {}          # session_id -> sid whose tab holds the session's search page
+        self.lost_tabs = set()  # session_ids whose tab extension disconnected
+        self.stats = {'dispatched': 0, 'queued': 0, 'reassigned': 0, 'unassigned': 0, 'tab_lost': 0}
+    
+    def _load(self, sid):
+        if sid not in self.load:
+            self.load[sid] = {'in_flight': 0, 'latency': None, 'failures': 0, 'benched_until': 0, 'completed': 0}
+        return self.load[sid]
+    
+    def _pick(self, exclude=(), only=None):
+        """Least-loaded extension with a free slot (lock held), or None; `only` pins one extension."""
+        now = time.time()
+        best, best_key = None, None
+        for sid, info in manager.all_extensions().items():
+            load = self._load(sid)
+            capacity = info.get('capacity') or config.EXTENSION_CAPACITY
+            if sid in exclude or (only and sid != only) or load['in_flight'] >= capacity:
+                continue
+            if load['benched_until'] > now and not only:
+                continue
+            key = (load['in_flight'] / capacity, load['latency'] or 0)
+            if best_key is None or key < best_key:
+                best, best_key = sid, key
+        return best
+    
+    def least_loaded(self):
+        """Extension for a quick side request (e.g. ping); ignores capacity."""
+        with self.cond:
+            extensions = manager.all_extensions()
+            return min(extensions, key=lambda sid: self._load(sid)['in_flight'], default=None)
+    
+    def _assign(self, request_id, timeout, exclude=()):
+        """Wait up to `timeout` for a slot and reserve it; returns the sid or None."""
+        deadline = time.time() + timeout
+        queued = False
+        with self.cond:
+            while True:
+                job = self.jobs.get(request_id)
+                if job is None:
+                    return None     # Completed or abandoned while queued
+                session_id = job['tab_session']
+                if session_id and session_id in self.lost_tabs:
+                    return None     # Its tab went away while queued
+                pinned = self.tabs.get(session_id) if session_id else None
+                sid = self._pick(exclude, only=pinned)
+                if sid:
+                    self._load(sid)['in_flight'] += 1
+                    job['sid'] = sid
+                    job['started'] = time.time()
+                    if session_id:
+                        self.tabs[session_id] = sid
+                    return sid
+                remaining = deadline - time.time()
+                if remaining <= 0 or not manager.has_extension():
+                    return None
+                if not queued:
+                    queued = True
+                    self.stats['queued'] += 1
+                self.cond.wait(min(remaining, 1))
+    
+    def dispatch(self, request_id, event, payload, timeout, tab_session=None, new_tab=False):
+        """
+        Queue until an extension is free, then emit the job to it. Returns the sid or None.
+        Jobs with `tab_session` run on that session's tab extension (the first
+        one, or a `new_tab` search after the tab was lost, picks the least loaded).
+        """
+        with self.cond:
+            if tab_session and new_tab:
+                self.lost_tabs.discard(tab_session)
+            self.jobs[request_id] = {
+                'sid': None, 'event': event, 'payload': payload, 'started': None,
+                'deadline': time.time() + timeout, 'tab_session': tab_session
+            }
+        sid = self._assign(request_id, timeout)
+        if sid is None:
+            with self.cond:
+                self.jobs.pop(request_id, None)
+                self.stats['unassigned'] += 1
+            return None
+        with self.cond:
+            self.stats['dispatched'] += 1
+        socketio.emit(event, payload, room=sid)
+        return sid
+    
+    def complete(self, request_id, ok):
+        """Release the job's slot and update its extension's latency/health."""
+        with self.cond:
+            job = self.jobs.pop(request_id, None)
+            if job is None or job['sid'] not in self.load:
+                return
+            load = self.load[job['sid']]
+            load['in_flight'] = max(0, load['in_flight'] - 1)
+            if ok:
+                latency = time.time() - job['started']
+                load['latency'] = latency if load['latency'] is None else 0.8 * load['latency'] + 0.2 * latency
+                load['failures'] = 0
+                load['completed'] += 1
+            else:
+                load['failures'] += 1
+                if load['failures'] >= config.EXTENSION_MAX_FAILURES:
+                    load['benched_until'] = time.time() + config.EXTENSION_BENCH_SECONDS
+                    load['failures'] = 0
+                    print(f'[Scheduler] Extension {job["sid"]} benched for {config.EXTENSION_BENCH_SECONDS}s')
+            self.cond.notify()
+    
+    def tab_lost(self, session_id):
+        """True if the extension holding the session's search tab disconnected."""
+        with self.cond:
+            return session_id in self.lost_tabs
+    
+    def on_disconnect(self, sid):
+        """Re-send the disconnected extension's stateless jobs; fail its tab-bound ones."""
+        with self.cond:
+            self.load.pop(sid, None)
+            for session_id in [session_id for session_id, tab_sid in self.tabs.items() if tab_sid == sid]:
+                del self.tabs[session_id]
+                self.lost_tabs.add(session_id)
+            orphaned, failed = [], []
+            for request_id, job in self.jobs.items():
+                if job['sid'] != sid:
+                    continue
+                job['sid'] = None
+                (failed if job['tab_session'] else orphaned).append(request_id)
+            self.stats['tab_lost'] += len(failed)
+            self.cond.notify_all()
+        for request_id in failed:
+            tool_requests.resolve(request_id, {'error': TAB_LOST_ERROR})
+        for request_id in orphaned:
+            eventlet.spawn_n(self._reassign, request_id, sid)
+    
+    def _reassign(self, request_id, old_sid):
+        with self.cond:
+            job = self.jobs.get(request_id)
+            if job is None:
+                return
+            # The job keeps its original deadline (tool and AI jobs differ)
+            timeout = job['deadline'] - time.time()
+        sid = self._assign(request_id, timeout, exclude=(old_sid,))
+        if sid is None:
+            return
+        sent = False
+        try:
+            with self.cond:
+                job = self.jobs.get(request_id)
+                if job is None or job['sid'] != sid:
+                    # Completed meanwhile; complete() already released the slot
+                    sent = True
+                    return
+                self.stats['reassigned'] += 1
+            print(f'[Scheduler] Job {request_id} reassigned {old_sid} -> {sid}')
+            socketio.emit(job['event'], job['payload'], room=sid)
+            sent = True
+        finally:
+            if not sent:
+                self._release(sid)
+    
+    def _release(self, sid):
+        with self.cond:
+            if sid in self.load:
+                self.load[sid]['in_flight'] = max(0, self.load[sid]['in_flight'] - 1)
+            self.cond.notify()
+    
+    def snapshot(self):
+        with self.cond:
+            extensions = manager.all_extensions()
+            return dict(
+                self.stats,
+                jobs=len(self.jobs),
+                extensions={
+                    sid: {
+                        'capacity': info.get('capacity') or config.EXTENSION_CAPACITY,
+                        'in_flight': self._load(sid)['in_flight'],
+                        'completed': self._load(sid)['completed'],
+                        'avg_latency': round(self._load(sid)['latency'], 2) if self._load(sid)['latency'] else None,
+                        'benched': self._load(sid)['benched_until'] > time.time(),
+                        'tab_sessions': sum(1 for tab_sid in self.tabs.values() if tab_sid == sid)
+                    }
+                    for sid, info in extensions.items()
                 }
+            )
+
+# Tools that act on (or read) the extension's current tab: a session's calls
+# must all run on the extension whose tab its search navigated
+TAB_STATE_TOOLS = ('search_shopee', 'scrape_listings')
+TAB_LOST_ERROR = (
+    "The browser tab holding this session's Shopee search is no longer connected. "
+    "Call search_shopee again before scrape_listings."
+)
 
-manager = ConnectionManager()
+scheduler = ExtensionScheduler()
+
+# Extension disconnects are broadcast so every hub worker can reassign its jobs
+state.subscribe('extensions', lambda message: scheduler.on_disconnect(message['sid']))
+
+def client_backlog(sid):
+    """Packets queued for a web client connected to this worker (0 when unknown)."""
+    try:
+        eio_sid = socketio.server.manager.eio_sid_from_sid(sid, '/')
+        return socketio.server.eio.sockets[eio_sid].queue.qsize()
+    except (AttributeError, KeyError, TypeError):
+        return 0
+
+class StreamRelay:
+    """
+    Coalesces a session's stream chunks into one `stream_chunk` frame per
+    flush window (or once STREAM_FLUSH_BYTES are pending). While the web
+    client's outgoing queue is backed up, the window doubles instead of
+    queueing more frames. Call flush() before sending any other event of
+    the stream so ordering is kept.
+    """
+    
+    def __init__(self, window_ms, max_bytes, max_backlog, max_delay_ms):
+        self.window = window_ms / 1000
+        self.max_bytes = max_bytes
+        self.max_backlog = max_backlog
+        self.max_delay = max_delay_ms / 1000
+        self.lock = Lock()
+        self.pending = {}           # session_id -> {chunks, bytes, delay, timer}
+        self.stats = {'chunks': 0, 'frames': 0, 'deferred': 0}
+    
+    def push(self, session_id, chunk):
+        """Record the chunk in the conversation and schedule its delivery."""
+        manager.append_stream_chunk(session_id, chunk)
+        if chunk == '__CLEAR__':
+            # Pending text is being discarded anyway; the client clears immediately
+            self.discard(session_id)
+            self._send(session_id, chunk)
+            return
+        with self.lock:
+            self.stats['chunks'] += 1
+            entry = self.pending.get(session_id)
+            if entry is None:
+                entry = self.pending[session_id] = {'chunks': [], 'bytes': 0, 'delay': self.window, 'timer': None}
+            entry['chunks'].append(chunk)
+            entry['bytes'] += len(chunk)
+            full = entry['bytes'] >= self.max_bytes
+            if not full and entry['timer'] is None:
+                entry['timer'] = eventlet.spawn_after(entry['delay'], self._on_timer, session_id)
+        if full:
+            self.flush(session_id, force=False)
+    
+    def _on_timer(self, session_id):
+        with self.lock:
+            entry = self.pending.get(session_id)
+            if entry:
+                entry['timer'] = None
+        self.flush(session_id, force=False)
+    
+    def flush(self, session_id, force=True):
+        """Send pending chunks as one frame; unforced flushes back off while the client lags."""
+        web_sid = manager.get_sid_for_session(session_id)
+        with self.lock:
+            entry = self.pending.get(session_id)
+            if entry is None:
+                return
+            if not force and web_sid and client_backlog(web_sid) > self.max_backlog and entry['delay'] < self.max_delay:
+                # Keep coalescing; the armed (or a longer) window decides the next attempt
+                if entry['timer'] is None:
+                    self.stats['deferred'] += 1
+                    entry['delay'] = min(entry['delay'] * 2, self.max_delay)
+                    entry['timer'] = eventlet.spawn_after(entry['delay'], self._on_timer, session_id)
+                return
+            del self.pending[session_id]
+            if entry['timer'] is not None:
+                entry['timer'].cancel()
+            self.stats['frames'] += 1
+        self._send(session_id, ''.join(entry['chunks']), web_sid)
+    
+    def discard(self, session_id):
+        """Drop undelivered chunks (e.g. a reconnecting client gets the full text instead)."""
+        with self.lock:
+            entry = self.pending.pop(session_id, None)
+        if entry and entry['timer'] is not None:
+            entry['timer'].cancel()
+    
+    def _send(self, session_id, text, web_sid=None):
+        web_sid = web_sid or manager.get_sid_for_session(session_id)
+        if web_sid:
+            socketio.emit('stream_chunk', {'chunk': text}, room=web_sid)
+    
+    def snapshot(self):
+        with self.lock:
+            return dict(self.stats, sessions=len(self.pending))
+
+stream_relay = StreamRelay(config.STREAM_FLUSH_MS, config.STREAM_FLUSH_BYTES, config.STREAM_MAX_BACKLOG, config.STREAM_MAX_DELAY_MS)
+
+# ============================================================================
+# CONTEXT COMPACTION
+# ============================================================================
+
+def estimate_tokens(msg):
+    """Rough token estimate (~4 chars/token), cached on the message."""
+    if 'tokens' not in msg:
+        payload = json.dumps(msg['parts'], ensure_ascii=False) if msg.get('parts') else (msg.get('content') or '')
+        msg['tokens'] = len(payload) // 4 + 1
+    return msg['tokens']
+
+def extract_value(value, max_chars, depth=0):
+    """Structured extract: scalars kept (long strings cut), lists sampled, nesting capped."""
+    if isinstance(value, str):
+        return value if len(value) <= max_chars else value[:max_chars] + f'... [{len(value) - max_chars} chars omitted]'
+    if isinstance(value, dict):
+        if depth >= 3:
+            return f'{{{len(value)} fields}}'
+        return {key: extract_value(item, max(80, max_chars // 4), depth + 1) for key, item in value.items()}
+    if isinstance(value, list):
+        if depth >= 3:
+            return f'[{len(value)} items]'
+        sample = [extract_value(item, max(80, max_chars // 8), depth + 1) for item in value[:5]]
+        return sample if len(value) <= 5 else {'count': len(value), 'first_items': sample}
+    return value
+
+def summarize_tool_result(response, ref, max_chars):
+    """Compact stand-in for a large functionResponse; the original stays in history under `ref`."""
+    summary = extract_value(response, max_chars)
+    if len(json.dumps(summary, ensure_ascii=False)) > max_chars:
+        summary = extract_value(json.dumps(summary, ensure_ascii=False), max_chars)
+    return {
+        'summary': summary,
+        'compacted': True,
+        'ref': ref,
+        'note': 'Older tool result summarized to save context. Call get_tool_result with this ref for the full result.'
+    }
+
+def compact_parts(msg, ref, max_chars):
+    """
+    Message parts with every functionResponse over `max_chars` summarized
+    (cached on the message, its size in `compact_bytes`). Messages the
+    summary would not shrink keep their original parts.
+    """
+    if 'compact_parts' not in msg:
+        parts = [
+            {'functionResponse': {
+                'name': part['functionResponse']['name'],
+                'response': summarize_tool_result(part['functionResponse'].get('response'), f'{ref}.{index}', max_chars)
+            }} if 'functionResponse' in part
+            and len(json.dumps(part['functionResponse'].get('response'), ensure_ascii=False)) > max_chars else part
+            for index, part in enumerate(msg['parts'])
+        ]
+        payload = json.dumps(parts, ensure_ascii=False)
+        tokens = len(payload) // 4 + 1
+        if tokens < estimate_tokens(msg):
+            msg['compact_parts'], msg['compact_tokens'], msg['compact_bytes'] = parts, tokens, len(payload)
+        else:
+            msg['compact_parts'], msg['compact_tokens'], msg['compact_bytes'] = msg['parts'], estimate_tokens(msg), 0
+    return msg['compact_parts']
+
+def compact_messages(messages, budget=None, keep_recent=None, session_id=None):
+    """
+    Messages to send to the model within an estimated token budget.
+    The trailing `keep_recent` messages are always verbatim. Compaction runs
+    in coarse steps: once over budget, older tool results are summarized
+    oldest-first down to CONTEXT_COMPACT_TARGET of the budget, and stay
+    summarized on later turns, so the request prefix (and its cachedContents
+    handle) only changes at those steps. History itself is untouched, so
+    refs (message index.part index) resolve to originals. The summaries are
+    cached on the history messages and, with `session_id`, counted against
+    the conversation hot-set budget.
+    """
+    budget = config.CONTEXT_TOKEN_BUDGET if budget is None else budget
+    keep_recent = config.CONTEXT_KEEP_RECENT if keep_recent is None else keep_recent
+    compacted = [dict(msg, parts=msg['compact_parts']) if msg.get('compacted') else msg for msg in messages]
+    total = sum(msg['compact_tokens'] if msg.get('compacted') else estimate_tokens(msg) for msg in messages)
+    if total <= budget:
+        return compacted
+    
+    target = budget * config.CONTEXT_COMPACT_TARGET
+    cached_bytes = 0
+    for index in range(max(0, len(messages) - keep_recent)):
+        msg = messages[index]
+        if msg.get('compacted') or not msg.get('parts') or not any('functionResponse' in part for part in msg['parts']):
+            continue
+        parts = compact_parts(msg, index, config.TOOL_SUMMARY_CHARS)
+        msg['compacted'] = True
+        cached_bytes += msg['compact_bytes']
+        compacted[index] = dict(msg, parts=parts)
+        total -= estimate_tokens(msg) - msg['compact_tokens']
+        if total <= target:
+            break
+    if session_id and cached_bytes:
+        manager.add_bytes(session_id, messages, cached_bytes)
+    return compacted
+
+def get_tool_result(ref, session_id):
+    """Original (uncompacted) tool result for a compaction ref like '12.0'."""
+    try:
+        message_index, part_index = (int(n) for n in str(ref).split('.'))
+        part = manager.get_conversation(session_id)['messages'][message_index]['parts'][part_index]
+        return part['functionResponse']['response']
+    except (ValueError, IndexError, KeyError, TypeError):
+        return {'error': f'No tool result found for ref {ref}'}
 
 # ============================================================================
 # GEMINI API INTEGRATION
@@ -197,6 +975,7 @@ You have access to these tools (only when browser extension is connected):
 - `scrape_listings`: Get product listings from search results
 - `deep_scrape_urls`: Deep scrape specific product pages for detailed info
 - `serper_search`: Google search for reviews and external info (always available)
+- `get_tool_result`: Full original of an older tool result that was summarized to save context (always available)
 
 ## Tool Call Format
 When you need to use a tool, respond with ONLY a JSON code block:
@@ -273,99 +1052,534 @@ TOOL_DEFINITIONS = [
                     },
                     "required": ["query"]
                 }
+            },
+            {
+                "name": "get_tool_result",
+                "description": "Retrieve the full original of an older tool result that was summarized (compacted: true) to save context",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "ref": {
+                            "type": "string",
+                            "description": "The ref value from the summarized result"
+                        }
+                    },
+                    "required": ["ref"]
+                }
             }
         ]
     }
 ]
 
-def call_gemini_api(messages, session_id, stream_callback=None):
+# Default generation config; callers may override it per call
+GENERATION_CONFIG = {
+    'temperature': 0.7,
+    'topP': 0.95,
+    'topK': 40,
+    'maxOutputTokens': 8192
+}
+
+def iter_sse_events(chunks):
+    """
+    Incremental SSE parser over raw byte chunks.
+    Yields the payload of each event (its `data:` lines joined with newlines),
+    so events whose JSON spans several `data:` lines decode correctly.
+    """
+    buffer = b''
+    data_lines = []
+    for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b'\n')
+        for line in lines:
+            if line.endswith(b'\r'):
+                line = line[:-1]
+            if not line:
+                if data_lines:
+                    yield b'\n'.join(data_lines)
+                    data_lines = []
+            elif line.startswith(b'data:'):
+                value = line[5:]
+                data_lines.append(value[1:] if value.startswith(b' ') else value)
+            # Comments (':') and other SSE fields are ignored
+    if buffer.startswith(b'data:'):
+        value = buffer[5:]
+        data_lines.append(value[1:] if value.startswith(b' ') else value)
+    if data_lines:
+        yield b'\n'.join(data_lines)
+
+class GeminiClient:
+    """
+    Streaming Gemini client over one keep-alive session.
+    429/5xx and connection errors are retried with jittered backoff until the
+    stream starts; once bytes are flowing a failure is returned as an error.
+    Tracks time-to-first-token and total stream duration.
+    """
+    
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+    
+    def __init__(self, base_url, default_model, max_attempts):
+        self.base_url = base_url
+        self.default_model = default_model
+        self.max_attempts = max_attempts
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=10))
+        self.session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=10))
+        self.lock = Lock()
+        self.stats = {'calls': 0, 'retries': 0, 'errors': 0, 'ttft_total': 0.0, 'duration_total': 0.0, 'streamed': 0}
+        self.last_timing = None
+    
+    def _open_stream(self, url, body):
+        """POST until a 200 stream is open; returns (response, attempts)."""
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                response = self.session.post(url, json=body, stream=True, timeout=(10, 120))
+                if response.status_code not in self.RETRY_STATUSES:
+                    response.raise_for_status()
+                    return response, attempt
+                retry_after = response.headers.get('Retry-After')
+                response.close()
+                if attempt >= self.max_attempts:
+                    response.raise_for_status()
+                error = f'HTTP {response.status_code}'
+            except requests.exceptions.ConnectionError as e:
+                if attempt >= self.max_attempts:
+                    raise
+                retry_after, error = None, e
+            
+            delay = min(8, 2 ** (attempt - 1)) * random.uniform(0.5, 1.5)
+            if retry_after and retry_after.isdigit():
+                delay = max(delay, int(retry_after))
+            with self.lock:
+                self.stats['retries'] += 1
+            print(f'[Gemini] {error}, retry {attempt} in {delay:.2f}s...')
+            time.sleep(delay)
+    
+    def stream_generate(self, body, model=None, stream_callback=None):
+        """
+        Run one streamGenerateContent call.
+        Returns: {"text": str, "toolCalls": list, "timing": {...}} or {"error": str}
+        """
+        model = model or self.default_model
+        url = f"{self.base_url}/models/{model}:streamGenerateContent?key={config.GEMINI_API_KEY}&alt=sse"
+        started = time.time()
+        first_token = None
+        usage = {}
+        full_text = ""
+        tool_calls = []
+        
+        with self.lock:
+            self.stats['calls'] += 1
+        try:
+            response, attempts = self._open_stream(url, body)
+            with response:
+                for payload in iter_sse_events(response.iter_content(chunk_size=None)):
+                    try:
+                        data = json.loads(payload)
+                    except json.JSONDecodeError:
+                        continue
+                    if 'usageMetadata' in data:
+                        usage = data['usageMetadata']
+                    if not data.get('candidates'):
+                        continue
+                    candidate = data['candidates'][0]
+                    for part in candidate.get('content', {}).get('parts', []):
+                        if first_token is None and ('text' in part or 'functionCall' in part):
+                            first_token = time.time() - started
+                        if 'text' in part:
+                            chunk = part['text']
+                            full_text += chunk
+                            if stream_callback:
+                                stream_callback('chunk', chunk)
+                        if 'functionCall' in part:
+                            tool_calls.append(part['functionCall'])
+                            if stream_callback:
+                                stream_callback('toolCall', part['functionCall'])
+        except requests.exceptions.RequestException as e:
+            with self.lock:
+                self.stats['errors'] += 1
+            status = e.response.status_code if e.response is not None else None
+            return {"error": str(e), "status": status}
+        
+        timing = {
+            'model': model,
+            'attempts': attempts,
+            'ttft': round(first_token, 3) if first_token is not None else None,
+            'duration': round(time.time() - started, 3),
+            'prompt_tokens': usage.get('promptTokenCount'),
+            'cached_tokens': usage.get('cachedContentTokenCount', 0)
+        }
+        with self.lock:
+            self.last_timing = timing
+            self.stats['duration_total'] += timing['duration']
+            if first_token is not None:
+                self.stats['streamed'] += 1
+                self.stats['ttft_total'] += first_token
+        return {"text": full_text, "toolCalls": tool_calls, "timing": timing}
+    
+    def cached_contents(self, method, name='', params=None, body=None):
+        """cachedContents REST call (create/patch/delete); returns the JSON reply."""
+        url = f"{self.base_url}/{name or 'cachedContents'}"
+        response = self.session.request(
+            method, url, params=dict(params or {}, key=config.GEMINI_API_KEY), json=body, timeout=30
+        )
+        response.raise_for_status()
+        return response.json() if response.content else {}
+    
+    def snapshot(self):
+        with self.lock:
+            completed = self.stats['calls'] - self.stats['errors']
+            return {
+                'calls': self.stats['calls'],
+                'retries': self.stats['retries'],
+                'errors': self.stats['errors'],
+                'avg_ttft': round(self.stats['ttft_total'] / self.stats['streamed'], 3) if self.stats['streamed'] else None,
+                'avg_duration': round(self.stats['duration_total'] / completed, 3) if completed else None,
+                'last': self.last_timing
+            }
+
+gemini_client = GeminiClient(config.GEMINI_BASE_URL, config.GEMINI_MODEL, config.GEMINI_MAX_ATTEMPTS)
+
+def contents_tokens(contents):
+    return len(json.dumps(contents, ensure_ascii=False)) // 4 + 1
+
+def contents_digest(contents):
+    return hashlib.sha1(json.dumps(contents, ensure_ascii=False, sort_keys=True).encode('utf-8')).hexdigest()
+
+class PrefixCache:
+    """
+    Per-session Gemini cachedContents handle for the stable request prefix:
+    system instruction, tools and the frozen part of the history.
+    Calls whose history starts with the cached prefix send only the new
+    messages. Handles are (re)built in the background once enough uncached
+    history has accumulated, extended while in use, and dropped when stale.
+    """
+    
+    def __init__(self, client, ttl, min_tokens):
+        self.client = client
+        self.ttl = ttl
+        self.min_tokens = min_tokens
+        self.lock = Lock()
+        self.handles = {}       # session_id -> {name, model, length, digest, expires}
+        self.building = set()   # session_ids with a create in flight
+        self.stats = {'hits': 0, 'misses': 0, 'creates': 0, 'refreshes': 0, 'failures': 0, 'invalidated': 0}
+    
+    def prefix_body(self, contents):
+        return {
+            'contents': contents,
+            'tools': TOOL_DEFINITIONS,
+            'systemInstruction': {'parts': [{'text': SYSTEM_PROMPT}]}
+        }
+    
+    def lookup(self, session_id, model, contents):
+        """Usable handle whose cached history is a prefix of `contents`, or None."""
+        with self.lock:
+            handle = self.handles.get(session_id)
+        if handle is None:
+            return None
+        if (handle['model'] != model or handle['expires'] <= time.time() + 5
+                or len(contents) <= handle['length']
+                or contents_digest(contents[:handle['length']]) != handle['digest']):
+            self.drop(session_id, handle)
+            with self.lock:
+                self.stats['invalidated'] += 1
+            return None
+        if handle['expires'] - time.time() < self.ttl / 3 and not handle.get('refreshing'):
+            handle['refreshing'] = True
+            eventlet.spawn_n(self._refresh, handle)
+        return handle
+    
+    def maybe_build(self, session_id, model, contents, handle):
+        """Start a background create when the uncached history is worth caching."""
+        frozen = contents[:-1]
+        uncached = frozen[handle['length']:] if handle else frozen
+        if not uncached:
+            return
+        estimate = contents_tokens(uncached) + (0 if handle else contents_tokens(self.prefix_body([])))
+        if estimate < self.min_tokens:
+            return
+        with self.lock:
+            if session_id in self.building:
+                return
+            self.building.add(session_id)
+        eventlet.spawn_n(self._build, session_id, model, frozen)
+    
+    def _build(self, session_id, model, frozen):
+        try:
+            body = dict(self.prefix_body(frozen), model=f'models/{model}', ttl=f'{self.ttl}s')
+            created = self.client.cached_contents('POST', body=body)
+            handle = {
+                'name': created['name'],
+                'model': model,
+                'length': len(frozen),
+                'digest': contents_digest(frozen),
+                'expires': time.time() + self.ttl
+            }
+            with self.lock:
+                old = self.handles.get(session_id)
+                self.handles[session_id] = handle
+                self.stats['creates'] += 1
+            if old:
+                self._delete(old)
+        except (requests.exceptions.RequestException, KeyError, ValueError) as e:
+            print(f'[Gemini] Context cache create failed: {e}')
+            with self.lock:
+                self.stats['failures'] += 1
+        finally:
+            with self.lock:
+                self.building.discard(session_id)
+    
+    def _refresh(self, handle):
+        try:
+            self.client.cached_contents('PATCH', handle['name'], params={'updateMask': 'ttl'}, body={'ttl': f'{self.ttl}s'})
+            handle['expires'] = time.time() + self.ttl
+            with self.lock:
+                self.stats['refreshes'] += 1
+        except requests.exceptions.RequestException as e:
+            print(f'[Gemini] Context cache refresh failed: {e}')
+        finally:
+            handle['refreshing'] = False
+    
+    def _delete(self, handle):
+        try:
+            self.client.cached_contents('DELETE', handle['name'])
+        except requests.exceptions.RequestException:
+            pass  # Expires on its own after the TTL
+    
+    def drop(self, session_id, handle=None):
+        """Forget (and delete) the session's handle; `handle` guards against dropping a newer one."""
+        with self.lock:
+            current = self.handles.get(session_id)
+            if current is None or (handle is not None and current is not handle):
+                return
+            del self.handles[session_id]
+        eventlet.spawn_n(self._delete, current)
+    
+    def generate(self, session_id, model, contents, generation_config, stream_callback):
+        handle = self.lookup(session_id, model, contents)
+        self.maybe_build(session_id, model, contents, handle)
+        if handle:
+            body = {
+                'cachedContent': handle['name'],
+                'contents': contents[handle['length']:],
+                'generationConfig': generation_config
+            }
+            result = self.client.stream_generate(body, model=model, stream_callback=stream_callback)
+            if result.get('status') not in (400, 403, 404):
+                with self.lock:
+                    self.stats['hits'] += 1
+                return result
+            # Handle rejected (expired or deleted upstream): fall back to the full request
+            self.drop(session_id, handle)
+            with self.lock:
+                self.stats['invalidated'] += 1
+        with self.lock:
+            self.stats['misses'] += 1
+        body = dict(self.prefix_body(contents), generationConfig=generation_config)
+        return self.client.stream_generate(body, model=model, stream_callback=stream_callback)
+    
+    def snapshot(self):
+        with self.lock:
+            return dict(self.stats, handles=len(self.handles), building=len(self.building))
+
+prefix_cache = PrefixCache(gemini_client, config.PREFIX_CACHE_TTL, config.PREFIX_CACHE_MIN_TOKENS) if config.PREFIX_CACHE_ENABLED else None
+
+def call_gemini_api(messages, session_id, stream_callback=None, model=None, generation_config=None):
     """
     Call Gemini API with streaming support.
-    Returns: {"text": str, "toolCalls": list}
+    `model` and `generation_config` override the defaults for this call only.
+    With PREFIX_CACHE on, the stable prefix is served from a cachedContents handle.
+    Returns: {"text": str, "toolCalls": list, "timing": dict}
     """
-    api_key = config.GEMINI_API_KEY
-    if not api_key:
+    if not config.GEMINI_API_KEY:
         return {"error": "Gemini API key not configured on server"}
     
-    model = "gemini-2.5-flash"
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/{model}:streamGenerateContent?key={api_key}&alt=sse"
-    
-    # Format messages for Gemini
+    # Format messages for Gemini (older tool results summarized past the token budget)
     contents = []
-    for msg in messages:
+    for msg in compact_messages(messages, session_id=session_id):
         role = 'model' if msg['role'] == 'assistant' else 'user'
         parts = msg.get('parts') or [{'text': msg.get('content', '')}]
         contents.append({'role': role, 'parts': parts})
     
+    model = model or config.GEMINI_MODEL
+    generation_config = dict(GENERATION_CONFIG, **(generation_config or {}))
+    
+    if prefix_cache:
+        return prefix_cache.generate(session_id, model, contents, generation_config, stream_callback)
+    
     body = {
         'contents': contents,
         'tools': TOOL_DEFINITIONS,
         'systemInstruction': {
             'parts': [{'text': SYSTEM_PROMPT}]
         },
-        'generationConfig': {
-            'temperature': 0.7,
-            'topP': 0.95,
-            'topK': 40,
-            'maxOutputTokens': 8192
-        }
+        'generationConfig': generation_config
     }
+    return gemini_client.stream_generate(body, model=model, stream_callback=stream_callback)
+
+class SerperCache:
+    """
+    Disk-backed Serper results keyed on the normalized query, so repeated
+    searches (within and across sessions) cost no API latency or quota.
+    Entries expire after SERPER_CACHE_TTL; past SERPER_CACHE_MAX_BYTES the
+    least recently used entries are evicted.
+    """
     
-    try:
-        response = requests.post(url, json=body, stream=True, timeout=120)
-        response.raise_for_status()
-        
-        full_text = ""
-        tool_calls = []
-        
-        for line in response.iter_lines():
-            if line:
-                line_str = line.decode('utf-8')
-                if line_str.startswith('data: '):
-                    try:
-                        data = json.loads(line_str[6:])
-                        if 'candidates' in data and data['candidates']:
-                            candidate = data['candidates'][0]
-                            if 'content' in candidate and 'parts' in candidate['content']:
-                                for part in candidate['content']['parts']:
-                                    if 'text' in part:
-                                        chunk = part['text']
-                                        full_text += chunk
-                                        if stream_callback:
-                                            stream_callback('chunk', chunk)
-                                    if 'functionCall' in part:
-                                        tool_calls.append(part['functionCall'])
-                                        if stream_callback:
-                                            stream_callback('toolCall', part['functionCall'])
-                    except json.JSONDecodeError:
-                        pass
-        
-        return {"text": full_text, "toolCalls": tool_calls}
+    def __init__(self, path, ttl, max_bytes):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.lock = Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'expired': 0, 'stores': 0, 'evictions': 0}
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS serper_cache (
+                key TEXT PRIMARY KEY,
+                result TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            )
+        ''')
+        self.db.execute('CREATE INDEX IF NOT EXISTS serper_cache_accessed ON serper_cache (accessed)')
+        self.bytes = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM serper_cache').fetchone()[0]
+    
+    @staticmethod
+    def normalize(query):
+        """Case, width and whitespace variants of a query share one entry."""
+        return ' '.join(unicodedata.normalize('NFKC', query).casefold().split())
+    
+    def get(self, query):
+        key = self.normalize(query)
+        now = time.time()
+        with self.lock:
+            row = self.db.execute('SELECT result, size, created FROM serper_cache WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.stats['misses'] += 1
+                return None
+            result, size, created = row
+            if now - created > self.ttl:
+                self.db.execute('DELETE FROM serper_cache WHERE key = ?', (key,))
+                self.bytes -= size
+                self.stats['expired'] += 1
+                self.stats['misses'] += 1
+                return None
+            self.db.execute('UPDATE serper_cache SET accessed = ? WHERE key = ?', (now, key))
+            self.stats['hits'] += 1
+        return json.loads(result)
+    
+    def put(self, query, result):
+        key = self.normalize(query)
+        encoded = json.dumps(result, ensure_ascii=False)
+        size = len(encoded.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        with self.lock:
+            old = self.db.execute('SELECT size FROM serper_cache WHERE key = ?', (key,)).fetchone()
+            self.db.execute(
+                'INSERT OR REPLACE INTO serper_cache (key, result, size, created, accessed) VALUES (?, ?, ?, ?, ?)',
+                (key, encoded, size, now, now)
+            )
+            self.bytes += size - (old[0] if old else 0)
+            self.stats['stores'] += 1
+            if self.bytes > self.max_bytes:
+                self._evict()
+    
+    def _evict(self):
+        """Drop least recently used entries until under the byte cap (lock held)."""
+        rows = self.db.execute('SELECT key, size FROM serper_cache ORDER BY accessed').fetchall()
+        evicted = []
+        for key, size in rows:
+            if self.bytes <= self.max_bytes:
+                break
+            evicted.append((key,))
+            self.bytes -= size
+        self.db.executemany('DELETE FROM serper_cache WHERE key = ?', evicted)
+        self.stats['evictions'] += len(evicted)
     
-    except requests.exceptions.RequestException as e:
-        return {"error": str(e)}
+    def snapshot(self):
+        with self.lock:
+            entries = self.db.execute('SELECT COUNT(*) FROM serper_cache').fetchone()[0]
+            lookups = self.stats['hits'] + self.stats['misses']
+            return dict(
+                self.stats,
+                entries=entries,
+                bytes=self.bytes,
+                hit_rate=round(self.stats['hits'] / lookups, 3) if lookups else 0
+            )
+
+serper_cache = SerperCache(config.SERPER_CACHE_DB, config.SERPER_CACHE_TTL, config.SERPER_CACHE_MAX_BYTES) if config.SERPER_CACHE_TTL > 0 else None
+
+# Keep-alive connections shared by all Serper calls; the pool bounds concurrency
+serper_session = requests.Session()
+serper_session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=config.SERPER_CONCURRENCY))
+serper_session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=config.SERPER_CONCURRENCY))
+serper_pool = eventlet.GreenPool(config.SERPER_CONCURRENCY)
+
+def serper_query(query, deadline):
+    """Run one Serper sub-query (cache first); never raises. No POST once `deadline` has passed."""
+    if serper_cache:
+        cached = serper_cache.get(query)
+        if cached is not None:
+            return {"query": query, "result": cached, "success": True, "cached": True}
+    remaining = deadline - time.time()
+    if remaining <= 0:
+        return {"query": query, "error": f"Timed out after {config.SERPER_DEADLINE:g}s", "success": False}
+    try:
+        response = serper_session.post(
+            config.SERPER_URL,
+            headers={"X-API-KEY": config.SERPER_API_KEY, "Content-Type": "application/json"},
+            json={"q": query},
+            timeout=remaining
+        )
+        result = response.json()
+        if serper_cache and response.ok:
+            serper_cache.put(query, result)
+        return {"query": query, "result": result, "success": True}
+    except Exception as e:
+        return {"query": query, "error": str(e), "success": False}
 
 def execute_serper_search(query):
-    """Execute Serper search directly (no extension needed)."""
+    """
+    Execute Serper search directly (no extension needed).
+    `;`-separated sub-queries run concurrently; queries still running at
+    SERPER_DEADLINE are reported as timed out and the rest are returned.
+    """
     api_key = config.SERPER_API_KEY
     if not api_key:
         return {"error": "Serper API key not configured"}
     
     queries = [q.strip() for q in query.split(';') if q.strip()]
-    results = []
+    deadline = time.time() + config.SERPER_DEADLINE
+    done = eventlet.queue.LightQueue()
+    
+    def run(index, q):
+        done.put((index, serper_query(q, deadline)))
+    
+    def feed():
+        # spawn_n blocks while the shared pool is full; stop feeding at the deadline
+        for index, q in enumerate(queries):
+            if time.time() >= deadline:
+                break
+            serper_pool.spawn_n(run, index, q)
+    
+    eventlet.spawn_n(feed)
     
-    for q in queries:
+    results = [None] * len(queries)
+    for _ in queries:
         try:
-            response = requests.post(
-                "https://google.serper.dev/search",
-                headers={"X-API-KEY": api_key, "Content-Type": "application/json"},
-                json={"q": q},
-                timeout=30
-            )
-            data = response.json()
-            results.append({"query": q, "result": data, "success": True})
-        except Exception as e:
-            results.append({"query": q, "error": str(e), "success": False})
+            index, item = done.get(timeout=max(0, deadline - time.time()))
+        except eventlet.queue.Empty:
+            break
+        results[index] = item
+    
+    results = [
+        item or {"query": q, "error": f"Timed out after {config.SERPER_DEADLINE:g}s", "success": False}
+        for q, item in zip(queries, results)
+    ]
     
     # Format results
     report = "=== SERPER SEARCH RESULTS ===\n"
@@ -385,6 +1599,56 @@ def execute_serper_search(query):
     
     return {"success": True, "data": report}
 
+# ============================================================================
+# TOOL DISPATCH
+# ============================================================================
+
+# Tools executed on this server; everything else goes to the browser extension
+LOCAL_TOOLS = {
+    'serper_search': lambda args, session_id: execute_serper_search(args.get('query', '')),
+    'get_tool_result': lambda args, session_id: get_tool_result(args.get('ref', ''), session_id),
+}
+
+def execute_tool_call(tool_call, session_id):
+    """Run one Gemini functionCall on the hub or the extension; always returns a dict."""
+    tool_name = tool_call['name']
+    tool_args = tool_call.get('args', {})
+    try:
+        if tool_name in LOCAL_TOOLS:
+            return LOCAL_TOOLS[tool_name](tool_args, session_id)
+        if tool_name == 'deep_scrape_urls' and manager.has_extension():
+            return execute_deep_scrape(tool_args, session_id)
+        if manager.has_extension():
+            return execute_tool_via_extension(tool_name, tool_args, session_id)
+        return {'error': f'Tool {tool_name} requires browser extension, but none connected'}
+    except Exception as e:
+        return {'error': f'Tool {tool_name} failed: {e}'}
+
+def execute_tool_calls(tool_calls, session_id):
+    """
+    Run the tool calls of one model turn. Independent tools run concurrently
+    (one greenthread each); tab-state tools (TAB_STATE_TOOLS) share the
+    session's browser tab, so they run one after another in call order.
+    Yields (index, result) in completion order, so the caller can report
+    progress while the slower calls are still running.
+    """
+    done = eventlet.queue.LightQueue()
+    
+    def run(calls):
+        for index, tool_call in calls:
+            done.put((index, execute_tool_call(tool_call, session_id)))
+    
+    tab_calls = []
+    for index, tool_call in enumerate(tool_calls):
+        if tool_call['name'] in TAB_STATE_TOOLS:
+            tab_calls.append((index, tool_call))
+        else:
+            eventlet.spawn_n(run, [(index, tool_call)])
+    if tab_calls:
+        eventlet.spawn_n(run, tab_calls)
+    for _ in tool_calls:
+        yield done.get()
+
 # ============================================================================
 # SOCKET.IO EVENT HANDLERS
 # ============================================================================
@@ -399,7 +1663,9 @@ def handle_disconnect():
     """Handle disconnections."""
     sid = request.sid
     manager.remove_web_client(sid)
-    manager.remove_extension(sid)
+    if sid in manager.extensions:
+        manager.remove_extension(sid)
+        state.publish('extensions', {'op': 'gone', 'sid': sid})
     print(f'[WS] Client disconnected: {sid}')
 
 @socketio.on('register_web_client')
@@ -420,13 +1686,15 @@ def handle_register_web(data):
     
     # Send conversation history if exists
     if conv['messages']:
-        emit('conversation_history', {'messages': conv['messages']})
+        emit('conversation_history', {'messages': [message_record(msg) for msg in conv['messages']]})
     
     # Restore processing state if active
     if conv['processing']:
-        # Send accumulated response so far
-        if conv['current_response']:
-            emit('stream_chunk', {'chunk': conv['current_response']})
+        # Send accumulated response so far (it already includes undelivered chunks)
+        stream_relay.discard(session_id)
+        response = manager.current_response(session_id)
+        if response:
+            emit('stream_chunk', {'chunk': response})
         
         # Send current tool progress if active
         if conv['progress']:
@@ -443,7 +1711,7 @@ def handle_register_web(data):
 def handle_register_extension(data):
     """Register a browser extension."""
     tab_id = data.get('tab_id')
-    manager.add_extension(request.sid, tab_id)
+    manager.add_extension(request.sid, tab_id, data.get('capacity'))
     
     # Notify all web clients
     socketio.emit('extension_status', {'connected': True})
@@ -452,7 +1720,6 @@ def handle_register_extension(data):
     print(f'[WS] Extension registered: tab={tab_id}')
 
 # Ping/Pong test for debugging connection
-pending_pings = {}
 
 @socketio.on('test_ping')
 def handle_test_ping(data):
@@ -466,15 +1733,15 @@ def handle_test_ping(data):
         emit('pong_response', {'message': 'No extension connected!', 'error': True})
         return
     
-    # Store pending ping
+    # Store pending ping (shared, so the pong may arrive on any worker)
     request_id = str(uuid.uuid4())
-    pending_pings[request_id] = {
+    state.hset('pings', request_id, {
         'web_client_sid': request.sid,
         'timestamp': timestamp
-    }
+    })
     
     # Forward to extension
-    ext_sid = manager.get_active_extension()
+    ext_sid = scheduler.least_loaded()
     socketio.emit('ping_from_server', {'request_id': request_id}, room=ext_sid)
     print(f'[WS] Ping forwarded to extension: {ext_sid}')
 
@@ -485,9 +1752,10 @@ def handle_pong_from_extension(data):
     
     print(f'[WS] Pong received from extension: request_id={request_id}')
     
-    if request_id in pending_pings:
-        web_sid = pending_pings[request_id]['web_client_sid']
-        del pending_pings[request_id]
+    ping = state.hget('pings', request_id) if request_id else None
+    if ping:
+        web_sid = ping['web_client_sid']
+        state.hdel('pings', request_id)
         
         socketio.emit('pong_response', {
             'message': 'PONG from extension! 🏓 Full round-trip successful!'
@@ -514,6 +1782,7 @@ def handle_send_message(data):
         return
     
     conv['processing'] = True
+    conv['current_response'] = []
     
     # Add user message
     manager.add_message(session_id, 'user', text)
@@ -545,6 +1814,7 @@ def handle_send_message(data):
                 socketio.emit('error', {'message': str(e)}, room=web_sid)
         finally:
             conv['processing'] = False
+            stream_relay.flush(session_id)
             
             # Send stream_end to current SID (handle reconnects)
             web_sid = manager.get_sid_for_session(session_id)
@@ -555,15 +1825,16 @@ def handle_send_message(data):
     # Otherwise use server-side Gemini API
     def stream_callback(event_type, data):
         if event_type == 'chunk':
-            manager.append_stream_chunk(session_id, data)
-            socketio.emit('stream_chunk', {'chunk': data}, room=request.sid)
+            stream_relay.push(session_id, data)
         elif event_type == 'toolCall':
+            stream_relay.flush(session_id)
             socketio.emit('tool_call', {'name': data['name'], 'args': data.get('args', {})}, room=request.sid)
 
     try:
         # Call Gemini API
         messages = conv['messages']
         response = call_gemini_api(messages, session_id, stream_callback)
+        stream_relay.flush(session_id)
         
         if 'error' in response:
             emit('error', {'message': response['error']})
@@ -571,41 +1842,37 @@ def handle_send_message(data):
             emit('stream_end')
             return
         
-        # Handle tool calls
+        # Handle tool calls: every call of a turn runs concurrently, and all
+        # responses go back to the model in a single follow-up request
         max_loops = 5
         loop_count = 0
         
         while response.get('toolCalls') and loop_count < max_loops:
             loop_count += 1
-            tool_call = response['toolCalls'][0]
-            tool_name = tool_call['name']
-            tool_args = tool_call.get('args', {})
+            tool_calls = response['toolCalls']
             
-            # Update progress
-            manager.update_progress(session_id, tool_name, 0, 0)
-            emit('tool_executing', {'name': tool_name})
+            for tool_call in tool_calls:
+                manager.update_progress(session_id, tool_call['name'], 0, 0)
+                emit('tool_executing', {'name': tool_call['name']})
             
-            # Execute tool
-            if tool_name == 'serper_search':
-                # Execute directly on server
-                result = execute_serper_search(tool_args.get('query', ''))
-            elif manager.has_extension():
-                # Route to extension
-                result = execute_tool_via_extension(tool_name, tool_args, session_id)
-            else:
-                result = {'error': f'Tool {tool_name} requires browser extension, but none connected'}
+            results = [None] * len(tool_calls)
+            for index, result in execute_tool_calls(tool_calls, session_id):
+                results[index] = result
+                emit('tool_result', {'name': tool_calls[index]['name'], 'success': 'error' not in result})
             
-            emit('tool_result', {'name': tool_name, 'success': 'error' not in result})
-            
-            # Add tool call and result to conversation
-            manager.add_message(session_id, 'assistant', '', parts=[{'functionCall': tool_call}])
-            manager.add_message(session_id, 'user', '', parts=[{
-                'functionResponse': {'name': tool_name, 'response': result}
-            }])
+            # One model turn with every call, one user turn with every response (same order)
+            manager.add_message(session_id, 'assistant', '', parts=[
+                {'functionCall': tool_call} for tool_call in tool_calls
+            ])
+            manager.add_message(session_id, 'user', '', parts=[
+                {'functionResponse': {'name': tool_call['name'], 'response': result}}
+                for tool_call, result in zip(tool_calls, results)
+            ])
             
             # Continue with AI
             messages = conv['messages']
             response = call_gemini_api(messages, session_id, stream_callback)
+            stream_relay.flush(session_id)
             
             if 'error' in response:
                 emit('error', {'message': response['error']})
@@ -616,9 +1883,11 @@ def handle_send_message(data):
             manager.add_message(session_id, 'assistant', response['text'])
         
     except Exception as e:
+        stream_relay.flush(session_id)
         emit('error', {'message': str(e)})
     finally:
         conv['processing'] = False
+        stream_relay.flush(session_id)
         emit('stream_end')
 
 @socketio.on('clear_conversation')
@@ -627,118 +1896,198 @@ def handle_clear(data):
     session_id = data.get('session_id')
     if session_id:
         manager.clear_conversation(session_id)
+        if prefix_cache:
+            prefix_cache.drop(session_id)
         emit('conversation_cleared')
 
 # Extension tool execution
-pending_tool_requests = {}
-tool_request_lock = Lock()
-
-def execute_tool_via_extension(tool_name, args, session_id):
-    """Send tool execution request to extension and wait for result."""
-    ext_sid = manager.get_active_extension()
-    if not ext_sid:
+def execute_tool_via_extension(tool_name, args, session_id, on_progress=None):
+    """
+    Send tool execution request to extension and wait for result.
+    `on_progress(current, total, url)` replaces relaying the extension's
+    tool_progress events to the web client.
+    """
+    if not manager.has_extension():
         return {'error': 'No extension connected'}
     
-    request_id = str(uuid.uuid4())
+    tab_bound = tool_name in TAB_STATE_TOOLS
+    new_tab = tool_name == 'search_shopee'
+    if tab_bound and not new_tab and scheduler.tab_lost(session_id):
+        return {'error': TAB_LOST_ERROR}
     
-    # Store pending request
-    with tool_request_lock:
-        pending_tool_requests[request_id] = {
-            'session_id': session_id,
-            'result': None,
-            'completed': False
-        }
+    request_id = tool_requests.register(session_id=session_id, tool_name=tool_name)
+    if on_progress:
+        progress_handlers[request_id] = on_progress
+    deadline = time.time() + config.TOOL_TIMEOUT
     
-    # Send to extension
-    socketio.emit('execute_tool', {
+    # Tab-state tools go to the session's tab extension, others to the
+    # least-loaded one (queues while all are busy)
+    ext_sid = scheduler.dispatch(request_id, 'execute_tool', {
         'request_id': request_id,
         'tool_name': tool_name,
         'args': args
-    }, room=ext_sid)
-    
-    # Wait for result (max 120 seconds)
-    start = time.time()
-    while time.time() - start < 120:
-        with tool_request_lock:
-            if pending_tool_requests.get(request_id, {}).get('completed'):
-                result = pending_tool_requests[request_id]['result']
-                del pending_tool_requests[request_id]
-                return result
-        time.sleep(0.5)
-    
-    # Timeout
-    with tool_request_lock:
-        if request_id in pending_tool_requests:
-            del pending_tool_requests[request_id]
-    
-    return {'error': 'Tool execution timeout'}
+    }, timeout=config.TOOL_TIMEOUT, tab_session=session_id if tab_bound else None, new_tab=new_tab)
+    if not ext_sid:
+        tool_requests.cancel(request_id)
+        progress_handlers.pop(request_id, None)
+        if tab_bound and scheduler.tab_lost(session_id):
+            return {'error': TAB_LOST_ERROR}
+        return {'error': 'No extension available'}
+    
+    # Woken by handle_tool_result(); the hub enforces the timeout
+    result = tool_requests.wait(request_id, max(0, deadline - time.time()))
+    progress_handlers.pop(request_id, None)
+    scheduler.complete(request_id, ok=result is not None and 'error' not in result)
+    if result is None:
+        return {'error': 'Tool execution timeout'}
+    return result
+
+# request_id -> on_progress callback of execute_tool_via_extension()
+progress_handlers = {}
+
+def report_tool_progress(session_id, tool_name, current, total, url=None):
+    """Store tool progress for reconnects and push it to the session's web client."""
+    manager.update_progress(session_id, tool_name, current, total, url)
+    web_sid = manager.get_sid_for_session(session_id)
+    if web_sid:
+        socketio.emit('tool_progress', {
+            'name': tool_name,
+            'current': current,
+            'total': total,
+            'url': url
+        }, room=web_sid)
 
 @socketio.on('tool_result')
 def handle_tool_result(data):
     """Handle tool result from extension."""
-    request_id = data.get('request_id')
-    result = data.get('result', {})
-    
-    with tool_request_lock:
-        if request_id in pending_tool_requests:
-            pending_tool_requests[request_id]['result'] = result
-            pending_tool_requests[request_id]['completed'] = True
+    tool_requests.resolve(data.get('request_id'), data.get('result', {}))
 
 @socketio.on('tool_progress')
+@owned_by(tool_requests, 'tool_progress')
 def handle_tool_progress(data):
-    """Relay tool progress from extension to web client."""
-    session_id = data.get('session_id')
-    # Find web client with this session and relay
-    for sid, info in manager.web_clients.items():
-        if info['session_id'] == session_id:
-            socketio.emit('tool_progress', data, room=sid)
+    """Relay tool progress from extension to the web client of the request's session."""
+    request_id = data.get('request_id')
+    req = tool_requests.get(request_id)
+    if not req:
+        return
+    current, total, url = data.get('current'), data.get('total'), data.get('url')
+    handler = progress_handlers.get(request_id)
+    if handler:
+        handler(current, total, url)
+    else:
+        report_tool_progress(req['session_id'], req['tool_name'], current, total, url)
 
-# Extension AI routing (for Web Gemini API mode)
-pending_ai_requests = {}
-ai_request_lock = Lock()
+# Deep scrape sharding (one shard of the URL list per connected extension)
+DEEP_SCRAPE_RULE = '━' * 40
+DEEP_SCRAPE_PRODUCT = re.compile(r'^PRODUCT \d+/\d+$', re.MULTILINE)
+
+def shard_urls(urls, count):
+    """Split `urls` into `count` contiguous, near-equal shards (original order kept)."""
+    size, extra = divmod(len(urls), count)
+    shards, start = [], 0
+    for index in range(count):
+        end = start + size + (index < extra)
+        shards.append(urls[start:end])
+        start = end
+    return shards
+
+class ShardedProgress:
+    """Folds the per-shard progress of one sharded tool call into a single bar."""
+    
+    def __init__(self, session_id, tool_name, total):
+        self.session_id = session_id
+        self.tool_name = tool_name
+        self.total = total
+        self.current = {}           # shard index -> URLs started in that shard
+    
+    def for_shard(self, index):
+        def on_progress(current, total, url):
+            self.current[index] = current or 0
+            report_tool_progress(self.session_id, self.tool_name, sum(self.current.values()), self.total, url)
+        return on_progress
+
+def shard_entries(result, urls):
+    """Per-URL report blocks of one shard's result (failure blocks if the shard failed)."""
+    report = result.get('data')
+    if not isinstance(report, str) or DEEP_SCRAPE_RULE not in report:
+        error = result.get('error', 'Shard returned no report')
+        return [
+            f'{DEEP_SCRAPE_RULE}\nPRODUCT 0/0\nURL: {url}\n{DEEP_SCRAPE_RULE}\n\n⚠️ SCRAPE FAILED: {error}\n\n'
+            for url in urls
+        ], 0
+    body = report[report.index(DEEP_SCRAPE_RULE):]
+    blocks = body.split(DEEP_SCRAPE_RULE + '\nPRODUCT ')[1:]
+    return [DEEP_SCRAPE_RULE + '\nPRODUCT ' + block for block in blocks], result.get('successful', 0)
 
+def merge_deep_scrape(shards, results):
+    """Rebuild the extension's single-run report from shard results, in original URL order."""
+    entries, successful = [], 0
+    for urls, result in zip(shards, results):
+        shard_blocks, shard_successful = shard_entries(result, urls)
+        entries.extend(shard_blocks)
+        successful += shard_successful
+    numbers = iter(range(1, len(entries) + 1))
+    report = f'=== DEEP SCRAPE RESULTS ===\nURLs Processed: {len(entries)}\nSuccessful: {successful}\n\n'
+    report += DEEP_SCRAPE_PRODUCT.sub(lambda m: f'PRODUCT {next(numbers)}/{len(entries)}', ''.join(entries))
+    return {
+        'success': True,
+        'count': len(entries),
+        'successful': successful,
+        'shards': len(shards),
+        'data': report
+    }
+
+def execute_deep_scrape(args, session_id):
+    """
+    deep_scrape_urls split across every connected extension: each shard is
+    a regular execute_tool job, so the scheduler places shards on different
+    extensions. Results are merged back in the original URL order.
+    """
+    urls = args.get('urls') or []
+    shard_count = min(len(manager.all_extensions()), len(urls))
+    if shard_count <= 1:
+        return execute_tool_via_extension('deep_scrape_urls', args, session_id)
+    
+    shards = shard_urls(urls, shard_count)
+    progress = ShardedProgress(session_id, 'deep_scrape_urls', len(urls))
+    print(f'[DeepScrape] {len(urls)} URLs in {shard_count} shards: {[len(shard) for shard in shards]}')
+    
+    def run(index):
+        return execute_tool_via_extension(
+            'deep_scrape_urls', dict(args, urls=shards[index]), session_id, progress.for_shard(index)
+        )
+    
+    results = list(eventlet.GreenPool(shard_count).imap(run, range(shard_count)))
+    return merge_deep_scrape(shards, results)
+
+# Extension AI routing (for Web Gemini API mode)
 def route_message_via_extension(text, session_id, web_client_sid):
     """Route user message to extension for AI processing via Web Gemini API."""
-    ext_sid = manager.get_active_extension()
-    if not ext_sid:
+    if not manager.has_extension():
         return {'error': 'No extension connected'}
     
-    request_id = str(uuid.uuid4())
+    request_id = ai_requests.register(session_id=session_id, web_client_sid=web_client_sid)
+    deadline = time.time() + config.AI_REQUEST_TIMEOUT
     
-    # Store pending request
-    with ai_request_lock:
-        pending_ai_requests[request_id] = {
-            'session_id': session_id,
-            'web_client_sid': web_client_sid,
-            'result': None,
-            'completed': False
-        }
-    
-    # Send to extension
-    socketio.emit('process_ai_message', {
+    # Send to the least-loaded extension (queues while all are busy)
+    ext_sid = scheduler.dispatch(request_id, 'process_ai_message', {
         'request_id': request_id,
         'session_id': session_id,
         'text': text
-    }, room=ext_sid)
-    
-    # Wait for completion (max 300 seconds for long AI responses)
-    start = time.time()
-    while time.time() - start < 300:
-        with ai_request_lock:
-            if pending_ai_requests.get(request_id, {}).get('completed'):
-                result = pending_ai_requests[request_id]['result']
-                del pending_ai_requests[request_id]
-                return result
-        time.sleep(0.5)
-    
-    # Timeout
-    with ai_request_lock:
-        if request_id in pending_ai_requests:
-            del pending_ai_requests[request_id]
-    
-    return {'error': 'AI request timeout'}
+    }, timeout=config.AI_REQUEST_TIMEOUT)
+    if not ext_sid:
+        ai_requests.cancel(request_id)
+        return {'error': 'No extension available'}
+    
+    # Woken by ai_response_complete / ai_response_error; long AI responses get AI_REQUEST_TIMEOUT
+    result = ai_requests.wait(request_id, max(0, deadline - time.time()))
+    scheduler.complete(request_id, ok=result is not None and 'error' not in result)
+    if result is None:
+        return {'error': 'AI request timeout'}
+    return result
 
 @socketio.on('ai_stream_chunk')
+@owned_by(ai_requests, 'ai_stream_chunk')
 def handle_ai_stream_chunk(data):
     """Relay AI stream chunks from extension to web client."""
     request_id = data.get('request_id')
@@ -746,70 +2095,60 @@ def handle_ai_stream_chunk(data):
     
     # print(f'[WS] ai_stream_chunk received: request_id={request_id}, chunk_len={len(chunk)}')  # DEBUG
     
-    with ai_request_lock:
-        if request_id in pending_ai_requests:
-            req = pending_ai_requests[request_id]
-            session_id = req['session_id']
-            
-            # Use dynamic SID lookup to handle reconnects
-            web_sid = manager.get_sid_for_session(session_id)
-            
-            # Store chunk in conversation state
-            manager.append_stream_chunk(session_id, chunk)
-            
-            if web_sid:
-                # print(f'[WS] Relaying chunk to web client: {web_sid}')  # DEBUG
-                socketio.emit('stream_chunk', {'chunk': chunk}, room=web_sid)
-        # else:
-            # print(f'[WS] No pending request found for: {request_id}')  # DEBUG
+    req = ai_requests.get(request_id)
+    if req:
+        # Stored in conversation state, delivered to the session's current SID in batches
+        stream_relay.push(req['session_id'], chunk)
 
 @socketio.on('ai_tool_call')
+@owned_by(ai_requests, 'ai_tool_call')
 def handle_ai_tool_call(data):
     """Relay AI tool calls from extension to web client."""
     request_id = data.get('request_id')
     tool_name = data.get('name')
     tool_args = data.get('args', {})
     
-    with ai_request_lock:
-        if request_id in pending_ai_requests:
-            req = pending_ai_requests[request_id]
-            session_id = req['session_id']
-            
-            # Use dynamic SID lookup
-            web_sid = manager.get_sid_for_session(session_id)
-            
-            # Update progress state to 'starting tool'
-            manager.update_progress(session_id, tool_name, 0, 0)
-            
-            # Save tool call to history so it persists on reload
-            manager.add_message(session_id, 'assistant', '', parts=[{
-                'functionCall': {
-                    'name': tool_name,
-                    'args': tool_args
-                }
-            }])
-            
-            if web_sid:
-                socketio.emit('tool_call', {
-                    'name': tool_name,
-                    'args': tool_args
-                }, room=web_sid)
+    req = ai_requests.get(request_id)
+    if req:
+        session_id = req['session_id']
+        stream_relay.flush(session_id)
+        
+        # Use dynamic SID lookup
+        web_sid = manager.get_sid_for_session(session_id)
+        
+        # Update progress state to 'starting tool'
+        manager.update_progress(session_id, tool_name, 0, 0)
+        
+        # Save tool call to history so it persists on reload
+        manager.add_message(session_id, 'assistant', '', parts=[{
+            'functionCall': {
+                'name': tool_name,
+                'args': tool_args
+            }
+        }])
+        
+        if web_sid:
+            socketio.emit('tool_call', {
+                'name': tool_name,
+                'args': tool_args
+            }, room=web_sid)
 
 @socketio.on('ai_tool_executing')
+@owned_by(ai_requests, 'ai_tool_executing')
 def handle_ai_tool_executing(data):
     """Relay tool execution status from extension to web client."""
     request_id = data.get('request_id')
     
-    with ai_request_lock:
-        if request_id in pending_ai_requests:
-            req = pending_ai_requests[request_id]
-            session_id = req['session_id']
-            web_sid = manager.get_sid_for_session(session_id)
-            
-            if web_sid:
-                socketio.emit('tool_executing', {'name': data.get('name')}, room=web_sid)
+    req = ai_requests.get(request_id)
+    if req:
+        session_id = req['session_id']
+        web_sid = manager.get_sid_for_session(session_id)
+        
+        if web_sid:
+            socketio.emit('tool_executing', {'name': data.get('name')}, room=web_sid)
 
 @socketio.on('ai_tool_result')
+@owned_by(ai_requests, 'ai_tool_result')
 def handle_ai_tool_result(data):
     """Relay tool results from extension to web client."""
     request_id = data.get('request_id')
@@ -818,28 +2157,28 @@ def handle_ai_tool_result(data):
     
     # print(f'[WS] ai_tool_result: {data.get("name")}')  # DEBUG
     
-    with ai_request_lock:
-        if request_id in pending_ai_requests:
-            req = pending_ai_requests[request_id]
-            session_id = req['session_id']
-            web_sid = manager.get_sid_for_session(session_id)
-            
-            # Save tool result to history
-            manager.add_message(session_id, 'user', '', parts=[{
-                'functionResponse': {
-                    'name': tool_name,
-                    'response': result
-                }
-            }])
-            
-            if web_sid:
-                socketio.emit('tool_result', {
-                    'name': tool_name,
-                    'result': result,  # Forward result to client if needed
-                    'success': data.get('success', False)
-                }, room=web_sid)
+    req = ai_requests.get(request_id)
+    if req:
+        session_id = req['session_id']
+        web_sid = manager.get_sid_for_session(session_id)
+        
+        # Save tool result to history
+        manager.add_message(session_id, 'user', '', parts=[{
+            'functionResponse': {
+                'name': tool_name,
+                'response': result
+            }
+        }])
+        
+        if web_sid:
+            socketio.emit('tool_result', {
+                'name': tool_name,
+                'result': result,  # Forward result to client if needed
+                'success': data.get('success', False)
+            }, room=web_sid)
 
 @socketio.on('ai_tool_progress')
+@owned_by(ai_requests, 'ai_tool_progress')
 def handle_ai_tool_progress(data):
     """Relay tool progress (e.g., deep scrape) from extension to web client."""
     request_id = data.get('request_id')
@@ -850,52 +2189,50 @@ def handle_ai_tool_progress(data):
     
     # print(f'[WS] ai_tool_progress: {tool_name} {current}/{total} - {url[:50] if url else "no url"}')  # DEBUG
     
-    with ai_request_lock:
-        if request_id in pending_ai_requests:
-            req = pending_ai_requests[request_id]
-            # web_sid = req['web_client_sid'] # OLD
-            session_id = req['session_id']
-            web_sid = manager.get_sid_for_session(session_id) # NEW
-            
-            # Store progress state
-            manager.update_progress(session_id, tool_name, current, total, url)
-            
-            if web_sid:
-                socketio.emit('tool_progress', {
-                    'name': tool_name,
-                    'current': current,
-                    'total': total,
-                    'url': url
-                }, room=web_sid)
+    req = ai_requests.get(request_id)
+    if req:
+        # web_sid = req['web_client_sid'] # OLD
+        session_id = req['session_id']
+        web_sid = manager.get_sid_for_session(session_id) # NEW
+        
+        # Store progress state
+        manager.update_progress(session_id, tool_name, current, total, url)
+        
+        if web_sid:
+            socketio.emit('tool_progress', {
+                'name': tool_name,
+                'current': current,
+                'total': total,
+                'url': url
+            }, room=web_sid)
 
 @socketio.on('ai_response_complete')
+@owned_by(ai_requests, 'ai_response_complete')
 def handle_ai_response_complete(data):
     """Handle completed AI response from extension."""
     request_id = data.get('request_id')
     
-    with ai_request_lock:
-        if request_id in pending_ai_requests:
-            req = pending_ai_requests[request_id]
-            session_id = req['session_id']
-            
-            # Finalize response: save to history, clear progress
-            manager.finalize_response(session_id)
-            
-            req['result'] = {'success': True}
-            req['completed'] = True
+    req = ai_requests.get(request_id)
+    if req:
+        session_id = req['session_id']
+        
+        # Finalize response: save to history, clear progress
+        manager.finalize_response(session_id)
+        
+        ai_requests.resolve(request_id, {'success': True})
 
 @socketio.on('ai_response_error')
+@owned_by(ai_requests, 'ai_response_error')
 def handle_ai_response_error(data):
     """Handle AI error from extension."""
     request_id = data.get('request_id')
     error = data.get('error', 'Unknown error')
     
-    with ai_request_lock:
-        if request_id in pending_ai_requests:
-            web_sid = pending_ai_requests[request_id]['web_client_sid']
-            socketio.emit('error', {'message': error}, room=web_sid)
-            pending_ai_requests[request_id]['result'] = {'error': error}
-            pending_ai_requests[request_id]['completed'] = True
+    req = ai_requests.get(request_id)
+    if req:
+        stream_relay.flush(req['session_id'])
+        socketio.emit('error', {'message': error}, room=req['web_client_sid'])
+        ai_requests.resolve(request_id, {'error': error})
 
 # ============================================================================
 # HTTP ROUTES
@@ -917,7 +2254,22 @@ def health():
     return jsonify({
         'status': 'ok',
         'web_clients': len(manager.web_clients),
-        'extensions': len(manager.extensions)
+        'extensions': len(manager.extensions),
+        'scheduler': scheduler.snapshot(),
+        'stream': stream_relay.snapshot(),
+        'state': dict(
+            state.snapshot(),
+            web_clients=len(manager.all_web_clients()),
+            extensions=len(manager.all_extensions())
+        ),
+        'pending': {
+            'tools': tool_requests.snapshot(),
+            'ai': ai_requests.snapshot()
+        },
+        'serper_cache': serper_cache.snapshot() if serper_cache else None,
+        'gemini': gemini_client.snapshot(),
+        'prefix_cache': prefix_cache.snapshot() if prefix_cache else None,
+        'conversations': dict(manager.hot_set_snapshot(), store=manager.store.snapshot())
     })
 
 @app.route('/api/settings', methods=['POST'])
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the shared store used by multi-worker deployments.
+Speaks the subset of the Redis protocol (RESP2, and RESP3 after HELLO 3) that
+state_backend.RedisBackend and the Socket.IO message queue use: hashes,
+GET/SET/DEL, PUBLISH/SUBSCRIBE.
+Data lives in memory only; use a real Redis in production.
+
+Usage: python shared_store_standin.py [--port 6390]
+Then run each worker with
+    STATE_BACKEND=redis://127.0.0.1:6390/0 SOCKETIO_MESSAGE_QUEUE=redis://127.0.0.1:6390/0 PORT=500N
+"""
+
+import argparse
+import asyncio
+
+class Store:
+    def __init__(self):
+        self.data = {}          # key -> str or dict (hash)
+        self.channels = {}      # channel -> {writer: speaks RESP3}
+
+    def hash(self, key):
+        value = self.data.setdefault(key, {})
+        if not isinstance(value, dict):
+            raise TypeError('WRONGTYPE Operation against a key holding the wrong kind of value')
+        return value
+
+class Status(str):
+    """Simple-string reply such as +OK."""
+
+OK = Status('OK')
+
+class Push(list):
+    """Out-of-band pub/sub message (RESP3 push, RESP2 array)."""
+
+def encode(value, resp3=False):
+    """RESP2/RESP3 encoding of a Python reply."""
+    if value is None:
+        return b'_\r\n' if resp3 else b'$-1\r\n'
+    if isinstance(value, bool):
+        return b':1\r\n' if value else b':0\r\n'
+    if isinstance(value, int):
+        return b':%d\r\n' % value
+    if isinstance(value, Status):
+        return b'+' + value.encode() + b'\r\n'
+    if isinstance(value, Exception):
+        return f'-{value}\r\n'.encode()
+    if isinstance(value, dict):
+        if resp3:
+            return b'%%%d\r\n' % len(value) + b''.join(encode(k, resp3) + encode(v, resp3) for k, v in value.items())
+        value = [item for pair in value.items() for item in pair]
+    if isinstance(value, (list, tuple)):
+        marker = b'>' if resp3 and isinstance(value, Push) else b'*'
+        return marker + b'%d\r\n' % len(value) + b''.join(encode(item, resp3) for item in value)
+    data = value if isinstance(value, bytes) else str(value).encode()
+    return b'$%d\r\n%s\r\n' % (len(data), data)
+
+async def read_command(reader):
+    line = await reader.readline()
+    if not line:
+        return None
+    if not line.startswith(b'*'):
+        return line.decode().split()   # inline command (e.g. from telnet)
+    args = []
+    for _ in range(int(line[1:])):
+        size = int((await reader.readline())[1:])
+        args.append((await reader.readexactly(size + 2))[:-2].decode())
+    return args
+
+def execute(store, name, args):
+    if name == 'PING':
+        return Status('PONG') if not args else args[0]
+    if name in ('SELECT', 'CLIENT', 'AUTH'):
+        return OK
+    if name == 'SET':
+        store.data[args[0]] = args[1]
+        return OK
+    if name == 'GET':
+        return store.data.get(args[0])
+    if name == 'DEL':
+        return sum(1 for key in args if store.data.pop(key, None) is not None)
+    if name == 'HSET':
+        table = store.hash(args[0])
+        added = 0
+        for field, value in zip(args[1::2], args[2::2]):
+            added += field not in table
+            table[field] = value
+        return added
+    if name == 'HGET':
+        return store.hash(args[0]).get(args[1])
+    if name == 'HDEL':
+        table = store.hash(args[0])
+        return sum(1 for field in args[1:] if table.pop(field, None) is not None)
+    if name == 'HGETALL':
+        return dict(store.hash(args[0]))
+    if name == 'HLEN':
+        return len(store.hash(args[0]))
+    if name == 'HKEYS':
+        return list(store.hash(args[0]))
+    if name == 'PUBLISH':
+        subscribers = store.channels.get(args[0], {})
+        for writer, resp3 in subscribers.items():
+            writer.write(encode(Push(['message', args[0], args[1]]), resp3))
+        return len(subscribers)
+    return ValueError(f"ERR unknown command '{name.lower()}'")
+
+async def handle(store, reader, writer):
+    subscribed = set()
+    resp3 = False
+    try:
+        while True:
+            command = await read_command(reader)
+            if command is None:
+                break
+            if not command:
+                continue
+            name, args = command[0].upper(), command[1:]
+            if name == 'HELLO':
+                resp3 = bool(args) and args[0] == '3'
+                writer.write(encode({
+                    'server': 'redis', 'version': '7.2.0', 'proto': 3 if resp3 else 2,
+                    'id': id(writer), 'mode': 'standalone', 'role': 'master', 'modules': [],
+                }, resp3))
+            elif name == 'SUBSCRIBE':
+                for channel in args:
+                    store.channels.setdefault(channel, {})[writer] = resp3
+                    subscribed.add(channel)
+                    writer.write(encode(Push(['subscribe', channel, len(subscribed)]), resp3))
+            elif name == 'UNSUBSCRIBE':
+                for channel in args or list(subscribed):
+                    store.channels.get(channel, {}).pop(writer, None)
+                    subscribed.discard(channel)
+                    writer.write(encode(Push(['unsubscribe', channel, len(subscribed)]), resp3))
+            else:
+                try:
+                    writer.write(encode(execute(store, name, args), resp3))
+                except (TypeError, IndexError) as e:
+                    writer.write(encode(ValueError(f'ERR {e}')))
+            await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        for channel in subscribed:
+            store.channels.get(channel, {}).pop(writer, None)
+        writer.close()
+
+async def main(host, port):
+    store = Store()
+    server = await asyncio.start_server(lambda r, w: handle(store, r, w), host, port)
+    print(f'[Stand-in] Shared store (Redis protocol subset) on redis://{host}:{port}/0')
+    async with server:
+        await server.serve_forever()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Shared store stand-in (Redis protocol subset)')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6390)
+    args = parser.parse_args()
+    asyncio.run(main(args.host, args.port))
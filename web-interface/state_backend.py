@@ -0,0 +1,189 @@
+"""
+Shared state backends for running several server_app.py workers.
+
+A backend holds the cross-worker registries (connected web clients and
+extensions, pending extension requests, pings) as JSON hashes and carries
+worker-to-worker messages over pub/sub:
+
+- InMemoryBackend: single process (default), no extra dependencies.
+- RedisBackend: any Redis-protocol server; shared_store_standin.py is a
+  local stand-in that is enough for testing several workers on one host.
+
+Pair RedisBackend with SOCKETIO_MESSAGE_QUEUE so emits reach sockets
+connected to other workers.
+"""
+
+import json
+import time
+import uuid
+from abc import ABC, abstractmethod
+from threading import Lock, Thread
+
+try:
+    import redis
+except ImportError:  # Optional; only needed for STATE_BACKEND=redis://...
+    redis = None
+
+# A worker whose heartbeat is older than this is treated as dead
+WORKER_TTL = 30
+HEARTBEAT_INTERVAL = 10
+
+class StateBackend(ABC):
+    """Interface shared by the backends. Values are JSON-serializable dicts."""
+
+    shared = False
+
+    def __init__(self):
+        self.worker_id = uuid.uuid4().hex[:12]
+
+    @abstractmethod
+    def hset(self, name, key, value):
+        """Store `value` under `key` in hash `name`."""
+
+    @abstractmethod
+    def hget(self, name, key):
+        """Value under `key` in hash `name`, or None."""
+
+    @abstractmethod
+    def hdel(self, name, key):
+        """Remove `key` from hash `name` (no-op if missing)."""
+
+    @abstractmethod
+    def hgetall(self, name):
+        """All entries of hash `name` as a dict."""
+
+    @abstractmethod
+    def publish(self, channel, message):
+        """Deliver `message` to every subscriber of `channel`."""
+
+    @abstractmethod
+    def subscribe(self, channel, callback):
+        """Call `callback(message)` for every message published on `channel`."""
+
+    def start_heartbeat(self):
+        """Advertise this worker as alive (needed only when state is shared)."""
+
+    def live_workers(self):
+        return {self.worker_id}
+
+    def live_items(self, name):
+        """Hash entries whose owning worker is still alive."""
+        workers = self.live_workers()
+        return {key: value for key, value in self.hgetall(name).items() if value.get('worker', self.worker_id) in workers}
+
+    def snapshot(self):
+        return {'type': type(self).__name__, 'worker_id': self.worker_id, 'shared': self.shared}
+
+class InMemoryBackend(StateBackend):
+    """Process-local dicts; pub/sub callbacks run inline."""
+
+    def __init__(self):
+        super().__init__()
+        self.lock = Lock()
+        self.hashes = {}
+        self.subscribers = {}
+
+    def hset(self, name, key, value):
+        with self.lock:
+            self.hashes.setdefault(name, {})[key] = value
+
+    def hget(self, name, key):
+        with self.lock:
+            return self.hashes.get(name, {}).get(key)
+
+    def hdel(self, name, key):
+        with self.lock:
+            self.hashes.get(name, {}).pop(key, None)
+
+    def hgetall(self, name):
+        with self.lock:
+            return dict(self.hashes.get(name, {}))
+
+    def publish(self, channel, message):
+        for callback in self.subscribers.get(channel, []):
+            callback(message)
+
+    def subscribe(self, channel, callback):
+        self.subscribers.setdefault(channel, []).append(callback)
+
+class RedisBackend(StateBackend):
+    """Hashes and pub/sub on a Redis-protocol server shared by all workers."""
+
+    shared = True
+
+    def __init__(self, url, prefix='shopping-assistant'):
+        if redis is None:
+            raise RuntimeError('STATE_BACKEND points at a shared store but the redis package is not installed')
+        super().__init__()
+        self.url = url
+        self.prefix = prefix
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self.workers_cache = (0, set())
+
+    def key(self, name):
+        return f'{self.prefix}:{name}'
+
+    def hset(self, name, key, value):
+        self.client.hset(self.key(name), key, json.dumps(value, ensure_ascii=False))
+
+    def hget(self, name, key):
+        value = self.client.hget(self.key(name), key)
+        return json.loads(value) if value is not None else None
+
+    def hdel(self, name, key):
+        self.client.hdel(self.key(name), key)
+
+    def hgetall(self, name):
+        return {key: json.loads(value) for key, value in self.client.hgetall(self.key(name)).items()}
+
+    def publish(self, channel, message):
+        self.client.publish(self.key(channel), json.dumps(message, ensure_ascii=False))
+
+    def subscribe(self, channel, callback):
+        def listen():
+            delay = 1
+            while True:
+                try:
+                    pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                    pubsub.subscribe(self.key(channel))
+                    delay = 1
+                    for item in pubsub.listen():
+                        if item.get('type') == 'message':
+                            try:
+                                callback(json.loads(item['data']))
+                            except Exception as e:
+                                print(f'[State] Handler for {channel} failed: {e}')
+                except redis.RedisError as e:
+                    print(f'[State] Subscription to {channel} lost ({e}), retrying in {delay}s')
+                    time.sleep(delay)
+                    delay = min(delay * 2, 30)
+        Thread(target=listen, daemon=True, name=f'subscribe-{channel}').start()
+
+    def start_heartbeat(self):
+        def beat():
+            while True:
+                try:
+                    self.hset('workers', self.worker_id, {'seen': time.time()})
+                except redis.RedisError as e:
+                    print(f'[State] Heartbeat failed: {e}')
+                time.sleep(HEARTBEAT_INTERVAL)
+        self.hset('workers', self.worker_id, {'seen': time.time()})
+        Thread(target=beat, daemon=True, name='state-heartbeat').start()
+
+    def live_workers(self):
+        checked, workers = self.workers_cache
+        if time.time() - checked > 1:
+            cutoff = time.time() - WORKER_TTL
+            workers = {worker for worker, info in self.hgetall('workers').items() if info['seen'] >= cutoff}
+            workers.add(self.worker_id)
+            self.workers_cache = (time.time(), workers)
+        return workers
+
+    def snapshot(self):
+        return dict(super().snapshot(), url=self.url, live_workers=len(self.live_workers()))
+
+def create_backend(url):
+    """'memory' (or empty) -> InMemoryBackend; redis://host:port/db -> RedisBackend."""
+    if not url or url == 'memory':
+        return InMemoryBackend()
+    return RedisBackend(url)
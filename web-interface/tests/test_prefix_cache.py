@@ -0,0 +1,97 @@
+"""
+Prefix cache against gemini_standin.py: once a conversation is past the
+context budget, compaction must not invalidate the cached prefix every turn.
+
+Run from web-interface/:  python -m pytest -q tests
+"""
+
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+WEB_INTERFACE = os.path.dirname(HERE)
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def wait_for_port(port, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f'stand-in did not start on port {port}')
+
+class PrefixCacheAcrossTurnsTest(unittest.TestCase):
+    TURNS = 12
+
+    @classmethod
+    def setUpClass(cls):
+        port = free_port()
+        cls.standin = subprocess.Popen(
+            [sys.executable, os.path.join(WEB_INTERFACE, 'gemini_standin.py'),
+             '--port', str(port), '--tool-rounds', '0', '--base-ms', '0', '--ms-per-1k-tokens', '0'],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        wait_for_port(port)
+        cls.tmp = tempfile.TemporaryDirectory()
+        os.environ.update({
+            'GEMINI_BASE_URL': f'http://127.0.0.1:{port}/v1beta',
+            'GEMINI_API_KEY': 'standin',
+            'PREFIX_CACHE': 'on',
+            'PREFIX_CACHE_MIN_TOKENS': '3000',
+            'CONTEXT_TOKEN_BUDGET': '12000',
+            'CONVERSATION_DB': os.path.join(cls.tmp.name, 'conversations.db'),
+            'SERPER_CACHE_DB': os.path.join(cls.tmp.name, 'serper_cache.db'),
+        })
+        sys.path.insert(0, WEB_INTERFACE)
+        import server_app
+        cls.app = server_app
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.standin.terminate()
+        cls.standin.wait()
+        cls.tmp.cleanup()
+
+    def test_cache_hits_across_turns_past_budget(self):
+        app = self.app
+        session_id = 'prefix-cache-test'
+        app.manager.clear_conversation(session_id)
+        listing = [{'name': f'Product {n}', 'price': 10000 + n, 'description': 'x' * 200} for n in range(25)]
+        for turn in range(self.TURNS):
+            app.manager.add_message(session_id, 'user', f'question {turn}')
+            app.manager.add_message(session_id, 'assistant', '', parts=[
+                {'functionCall': {'name': 'scrape_listings', 'args': {}}}
+            ])
+            app.manager.add_message(session_id, 'user', '', parts=[
+                {'functionResponse': {'name': 'scrape_listings', 'response': {'products': listing}}}
+            ])
+            messages = app.manager.get_conversation(session_id)['messages']
+            response = app.call_gemini_api(messages, session_id)
+            self.assertNotIn('error', response)
+            app.manager.add_message(session_id, 'assistant', response['text'])
+            app.eventlet.sleep(0.3)  # let the background cache build finish
+
+        stats = app.prefix_cache.snapshot()
+        compacted = [
+            msg for msg in app.compact_messages(messages)
+            if msg.get('parts') and msg['parts'][0].get('functionResponse', {}).get('response', {}).get('compacted')
+        ]
+        self.assertTrue(compacted, 'conversation never went past the context budget')
+        self.assertGreaterEqual(stats['hits'], self.TURNS // 2, stats)
+        # Every handle created is used before it is replaced
+        self.assertLessEqual(stats['creates'], stats['hits'] + 1, stats)
+        self.assertLessEqual(stats['invalidated'], self.TURNS // 4, stats)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+"""
+Tool calls of one model turn: search_shopee and scrape_listings share the
+session's browser tab, so a scrape must only start once the search is done,
+on the same extension, even when another extension is idle.
+
+Run from web-interface/:  python -m pytest -q tests
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+WEB_INTERFACE = os.path.dirname(HERE)
+
+class TabStateToolOrderTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        os.environ.setdefault('CONVERSATION_DB', os.path.join(cls.tmp.name, 'conversations.db'))
+        os.environ.setdefault('SERPER_CACHE_DB', os.path.join(cls.tmp.name, 'serper_cache.db'))
+        sys.path.insert(0, WEB_INTERFACE)
+        import eventlet
+        import server_app
+        cls.eventlet = eventlet
+        cls.app = server_app
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def setUp(self):
+        app = self.app
+        self.emitted = []
+        self.timeline = []
+        self.real_emit = app.socketio.emit
+        app.socketio.emit = self.fake_extension
+        for sid in ('ext-a', 'ext-b'):
+            app.manager.add_extension(sid, capacity=4)
+
+    def tearDown(self):
+        app = self.app
+        app.socketio.emit = self.real_emit
+        for sid in ('ext-a', 'ext-b'):
+            app.manager.remove_extension(sid)
+            app.scheduler.on_disconnect(sid)
+
+    def fake_extension(self, event, payload=None, room=None, **kwargs):
+        """Answers execute_tool jobs after a short delay; a search takes longer than a scrape."""
+        if event != 'execute_tool':
+            return
+        self.emitted.append((payload['tool_name'], room))
+        self.timeline.append(('start', payload['tool_name']))
+        delay = 0.05 if payload['tool_name'] == 'search_shopee' else 0.0
+
+        def answer():
+            self.eventlet.sleep(delay)
+            self.timeline.append(('done', payload['tool_name']))
+            self.app.tool_requests.resolve(payload['request_id'], {'tool': payload['tool_name'], 'extension': room})
+
+        self.eventlet.spawn_n(answer)
+
+    def test_search_then_scrape_in_one_turn(self):
+        tool_calls = [
+            {'name': 'search_shopee', 'args': {'query': 'mechanical keyboard'}},
+            {'name': 'scrape_listings', 'args': {'max_items': 10}},
+        ]
+        results = dict(self.app.execute_tool_calls(tool_calls, 'tab-order-test'))
+
+        self.assertEqual(self.timeline, [
+            ('start', 'search_shopee'), ('done', 'search_shopee'),
+            ('start', 'scrape_listings'), ('done', 'scrape_listings'),
+        ])
+        self.assertEqual(self.emitted[0][1], self.emitted[1][1])
+        self.assertEqual(results[0]['tool'], 'search_shopee')
+        self.assertEqual(results[1]['tool'], 'scrape_listings')
+        self.assertEqual(results[0]['extension'], results[1]['extension'])
+
+if __name__ == '__main__':
+    unittest.main()